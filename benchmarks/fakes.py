@@ -0,0 +1,97 @@
+"""Поддельные Update и контекст для вызова обработчиков bot.py без Telegram.
+
+Ответы бота не отправляются, а учитываются: число сообщений и объем
+отправленных данных попадают в результаты бенчмарка.
+"""
+import os
+import itertools
+from types import SimpleNamespace
+
+_ids = itertools.count(1)
+
+
+class SentStats:
+    """Счетчики ответов бота"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def record(self, payload):
+        self.messages += 1
+        # Файлы отправляются как InputFile с открытым файлом или содержимым
+        payload = getattr(payload, "input_file_content", payload)
+        if isinstance(payload, (bytes, bytearray)):
+            self.bytes += len(payload)
+        elif isinstance(payload, str):
+            self.bytes += len(payload.encode('utf-8'))
+        elif hasattr(payload, "fileno"):
+            self.bytes += os.fstat(payload.fileno()).st_size
+
+
+def _sent_file():
+    file_id = f"bench-{next(_ids)}"
+    return SimpleNamespace(file_id=file_id, file_unique_id=file_id)
+
+
+class FakeMessage:
+    """Сообщение пользователя с методами ответа, как у telegram.Message"""
+
+    def __init__(self, text, stats, chat_id=1, user_id=1):
+        self.text = text
+        self.stats = stats
+        self.message_id = next(_ids)
+        self.chat_id = chat_id
+        self.chat = SimpleNamespace(id=chat_id, type="private")
+        self.from_user = SimpleNamespace(id=user_id)
+        self.photo = None
+        self.document = None
+
+    def _reply(self):
+        return FakeMessage(None, self.stats, self.chat_id)
+
+    async def reply_text(self, text, **kwargs):
+        self.stats.record(text)
+        return self._reply()
+
+    async def reply_photo(self, photo, **kwargs):
+        self.stats.record(photo)
+        message = self._reply()
+        message.photo = [_sent_file()]
+        return message
+
+    async def reply_document(self, document, **kwargs):
+        self.stats.record(document)
+        message = self._reply()
+        message.document = _sent_file()
+        return message
+
+    async def reply_media_group(self, media, **kwargs):
+        messages = []
+        for item in media:
+            self.stats.record(item.media)
+            message = self._reply()
+            if item.type == "photo":
+                message.photo = [_sent_file()]
+            else:
+                message.document = _sent_file()
+            messages.append(message)
+        return tuple(messages)
+
+
+def make_update(text, stats, chat_id=1, user_id=1):
+    """Update с текстовым сообщением"""
+    message = FakeMessage(text, stats, chat_id, user_id)
+    return SimpleNamespace(
+        update_id=next(_ids),
+        message=message,
+        effective_message=message,
+        effective_chat=message.chat,
+        effective_user=message.from_user,
+        callback_query=None,
+    )
+
+
+def make_context(user_data=None):
+    """Контекст обработчика (ContextTypes.DEFAULT_TYPE) с данными пользователя"""
+    return SimpleNamespace(user_data={} if user_data is None else user_data, chat_data={}, bot_data={}, bot=None)
@@ -0,0 +1,178 @@
+"""Генератор синтетической базы знаний для бенчмарков.
+
+Создает в указанном каталоге дерево knowledge_base/ того же формата, что
+и у бота: разделы с подразделами (texts/<раздел>/<подраздел>.txt),
+пул вложений в files/ и materials.json. Содержимое детерминировано
+параметром --seed, поэтому результаты разных версий сопоставимы.
+
+Пример (масштаб из постановки задачи):
+
+    python benchmarks/generate_kb.py /tmp/kb-bench --topics 100 --subtopics 1000 \\
+        --materials 50000 --large-files 5 --large-size-mb 4
+"""
+import os
+import json
+import random
+import shutil
+import argparse
+
+# Слоги для построения словаря псевдослов
+SYLLABLES = [
+    "ба", "ве", "ги", "до", "жу", "за", "ки", "ло", "ме", "ни", "по", "ру", "са", "те", "фу",
+    "ха", "це", "чи", "ша", "ют", "ям", "ол", "ен", "ир", "ус", "ак", "от", "ум", "эл", "ин",
+]
+
+
+def build_vocabulary(rng, size):
+    """Возвращает список из size различных псевдослов"""
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class TextGenerator:
+    """Текст с частотами слов по закону Ципфа, как в естественном языке"""
+
+    WORDS_PER_LINE = 12
+
+    def __init__(self, rng, vocabulary):
+        self.rng = rng
+        self.vocabulary = vocabulary
+        self.weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def lines(self, size):
+        """Возвращает строки текста общей длиной около size символов"""
+        lines = []
+        length = 0
+        while length < size:
+            words = self.rng.choices(self.vocabulary, self.weights, k=self.WORDS_PER_LINE)
+            line = " ".join(words).capitalize() + "."
+            lines.append(line)
+            length += len(line) + 1
+        return lines
+
+
+def generate(root, topics=10, subtopics=100, materials=5000, text_size=1500, large_files=2,
+             large_size_mb=2, blobs=20, blob_size=64 * 1024, vocabulary_size=20000, seed=1):
+    """Создает синтетическую базу знаний в root/knowledge_base, возвращает ее параметры"""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(rng, vocabulary_size)
+    text = TextGenerator(rng, vocabulary)
+
+    base = os.path.join(root, "knowledge_base")
+    if os.path.exists(base):
+        shutil.rmtree(base)
+    texts_path = os.path.join(base, "texts")
+    files_path = os.path.join(base, "files")
+    os.makedirs(os.path.join(base, "images"))
+    os.makedirs(files_path)
+
+    topic_keys = []
+    for topic_number in range(topics):
+        topic = f"Раздел {topic_number:03d} {vocabulary[topic_number]}"
+        topic_path = os.path.join(texts_path, topic)
+        os.makedirs(topic_path)
+        with open(os.path.join(topic_path, "_description.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(text.lines(300)))
+        for subtopic_number in range(subtopics):
+            subtopic = f"{vocabulary[rng.randrange(len(vocabulary))]}_{subtopic_number:04d}"
+            # Первые подразделы первых разделов - большие файлы
+            if subtopic_number == 0 and topic_number < large_files:
+                size = large_size_mb * 1024 * 1024
+            else:
+                size = text_size
+            with open(os.path.join(topic_path, f"{subtopic}.txt"), 'w', encoding='utf-8') as f:
+                f.write("\n".join(text.lines(size)))
+            topic_keys.append(f"{topic}/{subtopic}")
+
+    # Пул вложений: материалы ссылаются на них, как на файлы в хранилище по sha256
+    blob_paths = []
+    for blob_number in range(blobs):
+        blob_path = os.path.join(files_path, f"{blob_number:064x}.txt")
+        with open(blob_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(text.lines(blob_size)))
+        blob_paths.append(blob_path)
+
+    material_records = {}
+    for material_number in range(materials):
+        topic_key = rng.choice(topic_keys)
+        topic = material_records.setdefault(topic_key, {"images": [], "files": []})
+        topic["files"].append({
+            "id": f"synthetic-{material_number:08d}",
+            "path": rng.choice(blob_paths),
+            "caption": " ".join(rng.choices(vocabulary, k=4)),
+            "type": "file",
+            # Материал уже отправлялся - Telegram выдал file_id
+            "file_id": f"synthetic-file-{material_number:08d}",
+            "filename": f"material_{material_number}.txt",
+        })
+    with open(os.path.join(base, "materials.json"), 'w', encoding='utf-8') as f:
+        json.dump(material_records, f, ensure_ascii=False)
+
+    # Слова средней частоты - запросы поиска, которые находят заметное, но не огромное число документов
+    queries = vocabulary[50:550]
+    params = {
+        "topics": topics,
+        "subtopics": subtopics,
+        "materials": materials,
+        "text_size": text_size,
+        "large_files": large_files,
+        "large_size_mb": large_size_mb,
+        "blobs": blobs,
+        "blob_size": blob_size,
+        "vocabulary_size": vocabulary_size,
+        "seed": seed,
+        "queries": queries,
+    }
+    with open(os.path.join(root, "synthetic_kb.json"), 'w', encoding='utf-8') as f:
+        json.dump(params, f, ensure_ascii=False)
+    return params
+
+
+def add_arguments(parser):
+    """Добавляет параметры генератора в разбор аргументов"""
+    parser.add_argument("--topics", type=int, default=10)
+    parser.add_argument("--subtopics", type=int, default=100, help="подразделов в каждом разделе")
+    parser.add_argument("--materials", type=int, default=5000)
+    parser.add_argument("--text-size", type=int, default=1500, help="размер текста подраздела, символов")
+    parser.add_argument("--large-files", type=int, default=2, help="число больших подразделов")
+    parser.add_argument("--large-size-mb", type=int, default=2)
+    parser.add_argument("--blobs", type=int, default=20, help="число файлов-вложений")
+    parser.add_argument("--blob-size", type=int, default=64 * 1024)
+    parser.add_argument("--vocabulary-size", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def generator_kwargs(args):
+    """Параметры generate() из разобранных аргументов"""
+    return {
+        "topics": args.topics,
+        "subtopics": args.subtopics,
+        "materials": args.materials,
+        "text_size": args.text_size,
+        "large_files": args.large_files,
+        "large_size_mb": args.large_size_mb,
+        "blobs": args.blobs,
+        "blob_size": args.blob_size,
+        "vocabulary_size": args.vocabulary_size,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерирует синтетическую базу знаний")
+    parser.add_argument("root", help="каталог, в котором будет создан knowledge_base/")
+    add_arguments(parser)
+    args = parser.parse_args()
+    params = generate(args.root, **generator_kwargs(args))
+    print(f"Создано: {params['topics']} разделов × {params['subtopics']} подразделов, "
+          f"{params['materials']} материалов в {args.root}")
+
+
+if __name__ == "__main__":
+    main()
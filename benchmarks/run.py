@@ -0,0 +1,404 @@
+"""Бенчмарки базы знаний и обработчиков бота на синтетических данных.
+
+Каждая операция выполняется в отдельном процессе, чтобы пиковое
+потребление памяти (ru_maxrss) относилось только к ней. Результат -
+JSON с задержками (p50/p99), пропускной способностью и пиковым RSS по
+каждой операции; с --baseline результаты сравниваются с прошлым запуском,
+и при замедлении больше допустимого или ошибках операций процесс
+завершается с кодом 1.
+
+    python benchmarks/run.py --workdir /tmp/kb-bench --topics 100 --subtopics 1000 \\
+        --materials 50000 --output bench.json
+    python benchmarks/run.py --workdir /tmp/kb-bench --baseline bench.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+import generate_kb
+
+BOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "telegram_1c_knowledge_bot"))
+
+# Версия формата результатов
+RESULTS_FORMAT = 1
+# Показатели, по которым ищутся регрессии (больше - хуже)
+REGRESSION_METRICS = ("p50_ms", "p99_ms", "peak_rss_kb")
+
+
+class Operation:
+    """Измеряемая операция: setup и teardown не входят в замер"""
+
+    iterations = 200
+
+    async def setup(self, env):
+        pass
+
+    async def step(self, env, number):
+        raise NotImplementedError
+
+    async def teardown(self, env):
+        pass
+
+
+class ColdStart(Operation):
+    """Создание KnowledgeBase и проверка всего поискового индекса, как при запуске бота"""
+
+    iterations = 5
+
+    async def step(self, env, number):
+        import config
+        from database import KnowledgeBase
+        from storage import JsonMaterialsStore, SqliteMaterialsStore
+
+        def start():
+            # Отдельное хранилище - чтобы не использовать уже прочитанные материалы
+            if config.STORAGE_BACKEND == "sqlite":
+                store = SqliteMaterialsStore(config.MATERIALS_DB)
+            else:
+                store = JsonMaterialsStore(config.MATERIALS_FILE)
+            kb = KnowledgeBase(env.kb.texts_path, env.kb.images_path, env.kb.files_path, env.kb.materials_file,
+                               env.kb.index_file, store, extracted_path=config.EXTRACTED_PATH)
+            kb.sync_index()
+
+        await env.akb.run(start)
+
+
+class LoadTopics(Operation):
+    """Загрузка списка разделов (манифест и проверка mtime)"""
+
+    async def step(self, env, number):
+        await env.akb.run(env.kb.load_topics)
+
+
+class GetContent(Operation):
+    """Чтение подраздела с материалами"""
+
+    iterations = 500
+
+    async def step(self, env, number):
+        topic, subtopic = env.pick_subtopic()
+        await env.akb.run(env.kb.get_content, topic, subtopic)
+
+
+class Search(Operation):
+    """Первая страница результатов полнотекстового поиска"""
+
+    iterations = 300
+
+    async def step(self, env, number):
+        results = await env.akb.run(env.kb.search, env.pick_query())
+        await env.akb.run(env.kb.search_page, results, 0, env.config.SEARCH_PAGE_SIZE)
+
+
+class AddMaterial(Operation):
+    """Добавление материала (запись хранилища материалов)"""
+
+    async def setup(self, env):
+        self.added = []
+
+    async def step(self, env, number):
+        topic, subtopic = env.pick_subtopic()
+        topic_key = f"{topic}/{subtopic}"
+        material_id = await env.akb.run(env.kb.add_material, topic_key, env.pick_blob(), f"bench {number}",
+                                        "file", f"bench-file-{number}", f"bench_{number}.txt")
+        self.added.append((topic_key, material_id))
+
+    async def teardown(self, env):
+        # Возвращаем базу в исходное состояние для следующих операций
+        for topic_key, material_id in self.added:
+            await env.akb.run(env.kb.delete_material, topic_key, material_id, "file")
+
+
+class HandleSearchMessage(Operation):
+    """Обработчик сообщения "Поиск <запрос>" целиком"""
+
+    iterations = 300
+
+    async def step(self, env, number):
+        update = env.update(f"Поиск {env.pick_query()}", number)
+        await env.bot.handle_message(update, env.context())
+
+
+class HandleTopicMessage(Operation):
+    """Обработчик выбора раздела: описание и клавиатура подразделов"""
+
+    iterations = 300
+
+    async def step(self, env, number):
+        update = env.update(env.rng.choice(env.topics), number)
+        await env.bot.handle_message(update, env.context())
+
+
+class HandleSubtopicSelection(Operation):
+    """Обработчик выбора подраздела: текст и материалы"""
+
+    iterations = 300
+
+    async def step(self, env, number):
+        topic, subtopic = env.pick_subtopic()
+        update = env.update(subtopic, number)
+        await env.bot.handle_subtopic_selection(update, env.context({'current_topic': topic}))
+
+
+OPERATIONS = {
+    "cold_start": ColdStart,
+    "load_topics": LoadTopics,
+    "get_content": GetContent,
+    "search": Search,
+    "add_material": AddMaterial,
+    "handle_message_search": HandleSearchMessage,
+    "handle_message_topic": HandleTopicMessage,
+    "handle_subtopic_selection": HandleSubtopicSelection,
+}
+
+
+class Environment:
+    """Модули бота и случайный выбор данных для операций (в процессе операции)"""
+
+    def __init__(self, workdir, seed):
+        import fakes
+        import config
+        import bot
+        from async_kb import akb
+
+        self.fakes = fakes
+        self.config = config
+        self.bot = bot
+        self.akb = akb
+        self.kb = akb.kb
+        self.rng = random.Random(seed)
+        self.stats = fakes.SentStats()
+
+        with open(os.path.join(workdir, "synthetic_kb.json"), 'r', encoding='utf-8') as f:
+            self.params = json.load(f)
+        self.topics = self.kb.get_topics()
+        # Подразделы берем из манифеста, не загружая разделы заранее
+        self.subtopics = [
+            (topic, file_name[:-len(".txt")])
+            for topic, entry in self.kb.manifest["topics"].items()
+            for file_name in entry["files"]
+            if file_name != "_description.txt"
+        ]
+        self.blobs = sorted(entry.path for entry in os.scandir(self.kb.files_path) if entry.is_file())
+
+    def pick_subtopic(self):
+        return self.rng.choice(self.subtopics)
+
+    def pick_query(self):
+        return self.rng.choice(self.params["queries"])
+
+    def pick_blob(self):
+        return self.rng.choice(self.blobs)
+
+    def update(self, text, number):
+        # Разные пользователи - как при реальной нагрузке
+        return self.fakes.make_update(text, self.stats, chat_id=number + 1, user_id=number + 1)
+
+    def context(self, user_data=None):
+        return self.fakes.make_context(user_data)
+
+
+def percentile(sorted_values, fraction):
+    """Процентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return None
+    rank = min(max(1, math.ceil(fraction * len(sorted_values))), len(sorted_values))
+    return sorted_values[rank - 1]
+
+
+def peak_rss_kb():
+    """Пиковый RSS текущего процесса в КиБ"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS ru_maxrss в байтах, в Linux - в КиБ
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+async def measure(env, operation, iterations, concurrency):
+    """Выполняет операцию iterations раз в concurrency параллельных потоках запросов"""
+    await operation.setup(env)
+    baseline_rss = peak_rss_kb()
+    latencies = []
+    errors = 0
+    counter = iter(range(iterations))
+
+    async def worker():
+        nonlocal errors
+        for number in counter:
+            started = time.perf_counter()
+            try:
+                await operation.step(env, number)
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка операции: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    peak_rss = peak_rss_kb()
+    await operation.teardown(env)
+    await asyncio.gather(*env.akb.background_tasks)
+
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 3)
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p90_ms": to_ms(percentile(latencies, 0.90)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1]),
+        "mean_ms": to_ms(sum(latencies) / len(latencies)),
+        "throughput_per_s": round(iterations / elapsed, 2),
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": peak_rss,
+        "messages_sent": env.stats.messages,
+        "bytes_sent": env.stats.bytes,
+    }
+
+
+def child_main(args):
+    """Выполняется в процессе операции (--op) или подготовки (--prepare)"""
+    benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [BOT_DIR, benchmarks_dir]
+    # Пути базы знаний в config заданы относительно рабочего каталога
+    os.chdir(args.workdir)
+
+    if args.prepare:
+        started = time.perf_counter()
+        from database import kb
+        # Строим манифест и поисковый индекс, чтобы операции измеряли рабочий режим
+        kb.sync_index()
+        result = {"prepare_s": round(time.perf_counter() - started, 3), "documents": kb.index.document_count()}
+    else:
+        env = Environment(args.workdir, args.seed)
+        operation = OPERATIONS[args.op]()
+        iterations = args.iterations or operation.iterations
+        result = asyncio.run(measure(env, operation, iterations, args.concurrency))
+
+    with open(args.result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def run_child(args, extra):
+    """Запускает этот скрипт в отдельном процессе, возвращает его результат"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--workdir", args.workdir,
+                   "--seed", str(args.seed), "--concurrency", str(args.concurrency),
+                   "--result-file", result_file] + extra
+        if args.iterations:
+            command += ["--iterations", str(args.iterations)]
+        subprocess.run(command, check=True)
+        with open(result_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+def compare(results, baseline, max_regression):
+    """Возвращает список регрессий относительно прошлых результатов.
+
+    Ошибки операции - всегда регрессия: время неудачных запросов не сравнимо
+    с прошлым запуском.
+    """
+    regressions = []
+    for name, result in results["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if result.get("errors"):
+            regressions.append({"operation": name, "metric": "errors",
+                                "baseline": previous.get("errors", 0) if previous else None,
+                                "current": result["errors"]})
+        if not previous:
+            continue
+        for metric in REGRESSION_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if old and new is not None and new > old * (1 + max_regression):
+                regressions.append({"operation": name, "metric": metric, "baseline": old, "current": new,
+                                    "change": round(new / old - 1, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки базы знаний на синтетических данных")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "kb-bench"),
+                        help="каталог синтетической базы знаний")
+    parser.add_argument("--regenerate", action="store_true", help="пересоздать базу знаний, даже если она есть")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="операции через запятую")
+    parser.add_argument("--iterations", type=int, help="число повторов каждой операции")
+    parser.add_argument("--concurrency", type=int, default=1, help="параллельных запросов")
+    parser.add_argument("--output", help="файл для результатов (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="результаты прошлого запуска для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="допустимое ухудшение показателя (доля)")
+    generate_kb.add_arguments(parser)
+    # Служебные параметры процесса операции
+    parser.add_argument("--op", choices=list(OPERATIONS), help=argparse.SUPPRESS)
+    parser.add_argument("--prepare", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+
+    if args.op or args.prepare:
+        child_main(args)
+        return
+
+    ops = [name for name in args.ops.split(",") if name]
+    unknown = [name for name in ops if name not in OPERATIONS]
+    if unknown:
+        parser.error(f"неизвестные операции: {', '.join(unknown)}")
+
+    started = time.perf_counter()
+    if args.regenerate or not os.path.exists(os.path.join(args.workdir, "synthetic_kb.json")):
+        os.makedirs(args.workdir, exist_ok=True)
+        generate_kb.generate(args.workdir, **generate_kb.generator_kwargs(args))
+    generate_s = round(time.perf_counter() - started, 3)
+
+    with open(os.path.join(args.workdir, "synthetic_kb.json"), 'r', encoding='utf-8') as f:
+        params = json.load(f)
+    params.pop("queries")
+
+    prepared = run_child(args, ["--prepare"])
+    results = {
+        "format": RESULTS_FORMAT,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage_backend": os.getenv("STORAGE_BACKEND", "json"),
+        "knowledge_base": params,
+        "generate_s": generate_s,
+        "prepare": prepared,
+        "operations": {},
+    }
+    for name in ops:
+        print(f"{name}...", file=sys.stderr)
+        results["operations"][name] = run_child(args, ["--op", name])
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            results["regressions"] = compare(results, json.load(f), args.max_regression)
+        exit_code = 1 if results["regressions"] else 0
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""Локальная заглушка Bot API для нагрузочного тестирования.
+
+Реализует методы, которыми пользуется бот (getMe, getUpdates, setWebhook,
+deleteWebhook, sendMessage, sendDocument, sendPhoto, sendMediaGroup,
+getFile, editMessageText, editMessageReplyMarkup, answerCallbackQuery),
+поверх встроенного HTTP-сервера бота. Бот подключается к ней через BOT_API_BASE_URL и
+BOT_API_FILE_URL. Обновления от «пользователей» отдаются через getUpdates
+или, если бот вызвал setWebhook, отправляются на его webhook.
+
+Каждое исходящее сообщение бота попадает в очередь своего чата вместе со
+временем получения - по ним драйвер нагрузки считает задержки.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import functools
+import itertools
+from email import policy
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "telegram_1c_knowledge_bot"))
+
+from http_server import HttpServer, HttpResponse, json_response  # noqa: E402
+from webhook import SECRET_HEADER  # noqa: E402
+
+# Методы отправки и поле сообщения, в котором возвращается файл
+SEND_METHODS = {
+    "sendMessage": None,
+    "sendDocument": "document",
+    "sendPhoto": "photo",
+}
+
+
+class OutgoingMessage:
+    """Сообщение, отправленное ботом"""
+
+    def __init__(self, method, chat_id, message, params):
+        self.method = method
+        self.chat_id = chat_id
+        self.message = message
+        self.text = params.get("text") or params.get("caption")
+        self.reply_markup = params.get("reply_markup")
+        self.received_at = time.perf_counter()
+
+    def buttons(self):
+        """Тексты кнопок обычной клавиатуры"""
+        keyboard = (self.reply_markup or {}).get("keyboard") or []
+        return [button if isinstance(button, str) else button.get("text") for row in keyboard for button in row]
+
+    def callback_data(self):
+        """callback_data кнопок встроенной клавиатуры"""
+        keyboard = (self.reply_markup or {}).get("inline_keyboard") or []
+        return [button.get("callback_data") for row in keyboard for button in row]
+
+
+class FakeBotApi:
+    """Заглушка Bot API для одного токена"""
+
+    # Ограничение тела запроса больше, чем у webhook: бот загружает файлы
+    MAX_BODY_SIZE = 100 * 1024 * 1024
+
+    def __init__(self, token, host="127.0.0.1", port=0):
+        self.token = token
+        self.http = HttpServer(host, port)
+        self.http.MAX_BODY_SIZE = self.MAX_BODY_SIZE
+        self.bot_user = {"id": int(token.split(":")[0]), "is_bot": True, "first_name": "LoadTest",
+                         "username": "load_test_bot"}
+        handlers = {
+            "getMe": self.get_me,
+            "getUpdates": self.get_updates,
+            "setWebhook": self.set_webhook,
+            "deleteWebhook": self.delete_webhook,
+            "getWebhookInfo": self.get_webhook_info,
+            "sendMediaGroup": self.send_media_group,
+            "getFile": self.get_file,
+            "editMessageText": self.edit_message_text,
+            "editMessageReplyMarkup": self.edit_message_reply_markup,
+            "answerCallbackQuery": self.answer_callback_query,
+            "close": self.ok,
+            "logOut": self.ok,
+        }
+        for method in SEND_METHODS:
+            handlers[method] = functools.partial(self.send, method)
+        for method, handler in handlers.items():
+            path = f"/bot{token}/{method}"
+            for http_method in ("GET", "POST"):
+                self.http.route(http_method, path, self._api_handler(method, handler))
+
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        # Обновления для getUpdates и событие появления новых
+        self.pending_updates = []
+        self.updates_available = asyncio.Event()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_client = None
+        # Очереди исходящих сообщений по чатам
+        self.chat_queues = {}
+        # file_id -> содержимое файлов, «загруженных» пользователями
+        self.files = {}
+        self.calls = {}
+        self.delivered = 0
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        # Бот готов принимать обновления (первый getUpdates или setWebhook)
+        self.ready = asyncio.Event()
+
+    @property
+    def base_url(self):
+        return f"http://{self.http.host}:{self.http.port}/bot"
+
+    @property
+    def file_url(self):
+        return f"http://{self.http.host}:{self.http.port}/file/bot"
+
+    async def start(self):
+        await self.http.start()
+
+    async def stop(self):
+        await self.http.stop()
+        if self.webhook_client is not None:
+            await self.webhook_client.aclose()
+
+    # Разбор запросов Bot API
+
+    def _parse_params(self, request):
+        """Возвращает (параметры, файлы) запроса; сложные параметры передаются в JSON"""
+        content_type = request.headers.get("content-type", "")
+        files = {}
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + request.body
+            )
+            raw = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True) or b""
+                if part.get_filename() is not None:
+                    files[name] = payload
+                else:
+                    raw[name] = payload.decode('utf-8')
+        elif content_type.startswith("application/json"):
+            raw = request.json() if request.body else {}
+        else:
+            source = request.body.decode('utf-8') if request.body else request.query
+            raw = dict(parse_qsl(source, keep_blank_values=True))
+
+        params = {}
+        for name, value in raw.items():
+            if isinstance(value, str) and value[:1] in ("{", "["):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[name] = value
+        return params, files
+
+    def _api_handler(self, method, handler):
+        async def handle(request):
+            self.calls[method] = self.calls.get(method, 0) + 1
+            params, files = self._parse_params(request)
+            result = await handler(params, files)
+            return json_response({"ok": True, "result": result})
+        return handle
+
+    # Объекты Telegram
+
+    def user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    def chat(self, chat_id):
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+    def new_file(self, size=0):
+        file_number = next(self.file_ids)
+        return {"file_id": f"fake-file-{file_number}", "file_unique_id": f"fake-unique-{file_number}",
+                "file_size": size}
+
+    def bot_message(self, chat_id, **fields):
+        message = {"message_id": next(self.message_ids), "date": int(time.time()), "chat": self.chat(chat_id),
+                   "from": self.bot_user}
+        message.update(fields)
+        return message
+
+    def _record(self, method, chat_id, message, params, sent_bytes):
+        outgoing = OutgoingMessage(method, chat_id, message, params)
+        self.sent_messages += 1
+        self.sent_bytes += sent_bytes
+        self.chat_queue(chat_id).put_nowait(outgoing)
+
+    def _file_field(self, field, value, files):
+        """Описание отправленного файла и его размер; file_id и attach://имя не загружают данные"""
+        size = 0
+        if isinstance(value, str) and value.startswith("attach://"):
+            size = len(files.get(value[len("attach://"):], b""))
+        elif value is None:
+            size = sum(len(data) for data in files.values())
+        file_info = self.new_file(size)
+        if field == "photo":
+            file_info.update(width=320, height=240)
+            return [file_info], size
+        return file_info, size
+
+    # Методы Bot API
+
+    async def ok(self, params, files):
+        return True
+
+    async def get_me(self, params, files):
+        return self.bot_user
+
+    async def get_updates(self, params, files):
+        self.ready.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        if offset:
+            self.pending_updates = [update for update in self.pending_updates if update["update_id"] >= offset]
+        if not self.pending_updates and timeout:
+            self.updates_available.clear()
+            try:
+                await asyncio.wait_for(self.updates_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending_updates[:limit]
+
+    async def set_webhook(self, params, files):
+        self.webhook_url = params.get("url") or None
+        self.webhook_secret = params.get("secret_token") or None
+        if self.webhook_url and self.webhook_client is None:
+            self.webhook_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
+        self.ready.set()
+        return True
+
+    async def delete_webhook(self, params, files):
+        self.webhook_url = None
+        return True
+
+    async def get_webhook_info(self, params, files):
+        return {"url": self.webhook_url or "", "has_custom_certificate": False,
+                "pending_update_count": len(self.pending_updates)}
+
+    async def send(self, method, params, files):
+        chat_id = int(params["chat_id"])
+        field = SEND_METHODS[method]
+        fields = {}
+        sent_bytes = len(params.get("text", "").encode('utf-8'))
+        if field is not None:
+            fields[field], sent_bytes = self._file_field(field, params.get(field), files)
+            if params.get("caption"):
+                fields["caption"] = params["caption"]
+        else:
+            fields["text"] = params["text"]
+        message = self.bot_message(chat_id, **fields)
+        self._record(method, chat_id, message, params, sent_bytes)
+        return message
+
+    async def send_media_group(self, params, files):
+        chat_id = int(params["chat_id"])
+        messages = []
+        for media in params.get("media", []):
+            field = "photo" if media.get("type") == "photo" else "document"
+            file_info, sent_bytes = self._file_field(field, media.get("media"), files)
+            message = self.bot_message(chat_id, **{field: file_info}, caption=media.get("caption", ""))
+            self._record("sendMediaGroup", chat_id, message, media, sent_bytes)
+            messages.append(message)
+        return messages
+
+    async def get_file(self, params, files):
+        file_id = params["file_id"]
+        data = self.files.get(file_id, b"")
+        file_path = f"documents/{file_id}"
+        route = f"/file/bot{self.token}/{file_path}"
+        if ("GET", route) not in self.http.routes:
+            async def download(request):
+                return HttpResponse(200, data, "application/octet-stream")
+            self.http.route("GET", route, download)
+        return {"file_id": file_id, "file_unique_id": f"unique-{file_id}", "file_size": len(data),
+                "file_path": file_path}
+
+    async def edit_message_text(self, params, files):
+        """Измененное сообщение попадает в очередь чата так же, как новое"""
+        chat_id = int(params["chat_id"])
+        message = self.bot_message(chat_id, text=params["text"])
+        message["message_id"] = int(params["message_id"])
+        self._record("editMessageText", chat_id, message, params, len(params["text"].encode('utf-8')))
+        return message
+
+    async def edit_message_reply_markup(self, params, files):
+        return True
+
+    async def answer_callback_query(self, params, files):
+        return True
+
+    # Действия пользователей
+
+    def chat_queue(self, chat_id):
+        if chat_id not in self.chat_queues:
+            self.chat_queues[chat_id] = asyncio.Queue()
+        return self.chat_queues[chat_id]
+
+    def add_file(self, data):
+        """Регистрирует файл пользователя, возвращает его описание для сообщения"""
+        file_info = self.new_file(len(data))
+        self.files[file_info["file_id"]] = data
+        return file_info
+
+    def user_message(self, user_id, text=None, **fields):
+        """Сообщение пользователя в личном чате с ботом"""
+        message = {"message_id": next(self.message_ids), "date": int(time.time()), "chat": self.chat(user_id),
+                   "from": self.user(user_id)}
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        message.update(fields)
+        return message
+
+    async def deliver(self, update_fields):
+        """Передает обновление боту: через webhook, если он задан, иначе в очередь getUpdates"""
+        update = {"update_id": next(self.update_ids)}
+        update.update(update_fields)
+        self.delivered += 1
+        if self.webhook_url:
+            headers = {SECRET_HEADER: self.webhook_secret} if self.webhook_secret else {}
+            response = await self.webhook_client.post(self.webhook_url, json=update, headers=headers)
+            response.raise_for_status()
+        else:
+            self.pending_updates.append(update)
+            self.updates_available.set()
+        return update
+
+    async def send_text(self, user_id, text):
+        return await self.deliver({"message": self.user_message(user_id, text)})
+
+    async def send_document(self, user_id, data, file_name, mime_type="text/plain"):
+        document = self.add_file(data)
+        document.update(file_name=file_name, mime_type=mime_type)
+        return await self.deliver({"message": self.user_message(user_id, document=document)})
+
+    async def press_button(self, user_id, outgoing, data):
+        """Нажатие кнопки встроенной клавиатуры под сообщением бота"""
+        return await self.deliver({"callback_query": {
+            "id": str(next(self.update_ids)),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "message": outgoing.message,
+            "data": data,
+        }})
@@ -0,0 +1,397 @@
+"""Сквозной нагрузочный тест бота с локальной заглушкой Bot API.
+
+Запускает заглушку Bot API и процесс бота (bot.py) с BOT_API_BASE_URL,
+указывающим на нее, после чего N одновременных пользователей проходят
+сценарии ConversationHandler: просмотр раздела и подраздела, «Поиск»
+(с кнопкой «Ещё»), «Интеллектуальная система» и загрузка файла.
+
+Задержка - время от передачи обновления боту до первого ответа
+(first_reply) и до последнего ответа шага (last_reply). Шаг считается
+завершенным, когда бот молчит think_time секунд - это же пауза
+пользователя между действиями. Результат печатается в JSON.
+
+    python loadtest/run.py --users 50 --duration 60 --mode polling
+    python loadtest/run.py --users 20 --flows search,upload --env OUTBOUND_CHAT_RATE=100
+
+Ограничения исходящих сообщений бота (OUTBOUND_*) действуют и здесь;
+чтобы измерять только обработку, их можно поднять через --env.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+
+from fake_bot_api import FakeBotApi
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BOT_SCRIPT = os.path.join(ROOT_DIR, "telegram_1c_knowledge_bot", "bot.py")
+TOKEN = "123456:LOADTEST"
+FLOWS = ("browse", "search", "intelligent", "upload")
+# Ограничение числа «Да» в диалоге интеллектуальной системы
+MAX_SCENARIO_STEPS = 20
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    """Процентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return None
+    rank = min(max(1, math.ceil(fraction * len(sorted_values))), len(sorted_values))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    to_ms = lambda value: None if value is None else round(value * 1000, 1)
+    return {
+        "count": len(latencies),
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p90_ms": to_ms(percentile(latencies, 0.90)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+    }
+
+
+class KnowledgeBaseView:
+    """Разделы, подразделы и сценарии копии базы знаний - из них пользователи выбирают действия"""
+
+    def __init__(self, knowledge_path):
+        texts_path = os.path.join(knowledge_path, "texts")
+        self.subtopics = {}
+        for topic in sorted(os.listdir(texts_path)):
+            topic_path = os.path.join(texts_path, topic)
+            if os.path.isdir(topic_path):
+                names = sorted(name[:-len(".txt")] for name in os.listdir(topic_path)
+                               if name.endswith(".txt") and name != "_description.txt")
+                if names:
+                    self.subtopics[topic] = names
+        self.problems = []
+        scenarios_path = os.path.join(knowledge_path, "scenarios")
+        for name in sorted(os.listdir(scenarios_path)) if os.path.isdir(scenarios_path) else []:
+            if name.endswith(".json"):
+                with open(os.path.join(scenarios_path, name), 'r', encoding='utf-8') as f:
+                    keywords = json.load(f).get("keywords", [])
+                if keywords:
+                    self.problems.append(" ".join(keywords[:3]))
+        if not self.subtopics:
+            raise SystemExit(f"В {texts_path} нет разделов с подразделами")
+
+
+class Step:
+    """Результат одного действия пользователя"""
+
+    def __init__(self, replies, sent_at):
+        self.replies = replies
+        self.sent_at = sent_at
+
+    @property
+    def last(self):
+        return self.replies[-1] if self.replies else None
+
+
+class SimulatedUser:
+    """Пользователь, проходящий сценарии диалога с ботом"""
+
+    def __init__(self, user_id, api, view, stats, rng, think_time, reply_timeout):
+        self.user_id = user_id
+        self.api = api
+        self.view = view
+        self.stats = stats
+        self.rng = rng
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.queue = api.chat_queue(user_id)
+
+    async def _collect(self, flow, action, sent_at):
+        """Собирает ответы бота на действие и записывает задержки"""
+        replies = []
+        try:
+            replies.append(await asyncio.wait_for(self.queue.get(), self.reply_timeout))
+        except asyncio.TimeoutError:
+            self.stats.timeout(flow, action)
+            return Step(replies, sent_at)
+        while True:
+            try:
+                replies.append(await asyncio.wait_for(self.queue.get(), self.think_time))
+            except asyncio.TimeoutError:
+                break
+        self.stats.record(flow, action, replies[0].received_at - sent_at, replies[-1].received_at - sent_at)
+        return Step(replies, sent_at)
+
+    def _drain(self):
+        """Отбрасывает запоздавшие ответы на прошлые действия"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.stats.late_replies += 1
+
+    async def say(self, flow, action, text):
+        self._drain()
+        sent_at = time.perf_counter()
+        await self.api.send_text(self.user_id, text)
+        return await self._collect(flow, action, sent_at)
+
+    async def upload(self, flow, action, data, file_name):
+        self._drain()
+        sent_at = time.perf_counter()
+        await self.api.send_document(self.user_id, data, file_name)
+        return await self._collect(flow, action, sent_at)
+
+    async def press(self, flow, action, outgoing, data):
+        self._drain()
+        sent_at = time.perf_counter()
+        await self.api.press_button(self.user_id, outgoing, data)
+        return await self._collect(flow, action, sent_at)
+
+    def pick_subtopic(self):
+        topic = self.rng.choice(list(self.view.subtopics))
+        return topic, self.rng.choice(self.view.subtopics[topic])
+
+    # Сценарии
+
+    async def browse(self):
+        topic, subtopic = self.pick_subtopic()
+        await self.say("browse", "topic", topic)
+        await self.say("browse", "subtopic", subtopic)
+
+    async def search(self):
+        _, subtopic = self.pick_subtopic()
+        words = [word for word in subtopic.replace("_", " ").split() if len(word) > 2] or [subtopic]
+        step = await self.say("search", "query", f"Поиск {self.rng.choice(words)}")
+        for reply in step.replies:
+            more = [data for data in reply.callback_data() if data.startswith("sr:")]
+            if more:
+                await self.press("search", "more", reply, more[0])
+                break
+
+    async def intelligent(self):
+        if not self.view.problems:
+            return
+        await self.say("intelligent", "enter", "Интеллектуальная система")
+        step = await self.say("intelligent", "problem", self.rng.choice(self.view.problems))
+        for _ in range(MAX_SCENARIO_STEPS):
+            if step.last is None or "Да" not in step.last.buttons():
+                break
+            step = await self.say("intelligent", "answer", self.rng.choice(("Да", "Нет")))
+        if step.last is not None and "Показать инструкцию" in step.last.buttons():
+            await self.say("intelligent", "instructions", "Показать инструкцию")
+        elif step.last is not None and "Отмена" in step.last.buttons():
+            await self.say("intelligent", "cancel", "Отмена")
+
+    async def upload_file(self):
+        topic, subtopic = self.pick_subtopic()
+        await self.say("upload", "manage", "Управление материалами")
+        await self.say("upload", "action", "Загрузить файл")
+        await self.say("upload", "topic", topic)
+        await self.say("upload", "subtopic", subtopic)
+        data = f"Нагрузочный тест {self.user_id} {time.time()}\n".encode('utf-8') * 64
+        await self.upload("upload", "file", data, f"loadtest_{self.user_id}.txt")
+        await self.say("upload", "caption", f"Файл пользователя {self.user_id}")
+
+    async def run(self, flows, deadline, rounds):
+        await self.say("start", "start", "/start")
+        flow_methods = {"browse": self.browse, "search": self.search, "intelligent": self.intelligent,
+                        "upload": self.upload_file}
+        completed = 0
+        while time.perf_counter() < deadline and (rounds is None or completed < rounds):
+            await flow_methods[self.rng.choice(flows)]()
+            completed += 1
+        self.stats.flows_completed += completed
+
+
+class LoadStats:
+    """Задержки по шагам сценариев"""
+
+    def __init__(self):
+        self.first_reply = {}
+        self.last_reply = {}
+        self.timeouts = {}
+        self.late_replies = 0
+        self.flows_completed = 0
+
+    def record(self, flow, action, first, last):
+        key = f"{flow}.{action}"
+        self.first_reply.setdefault(key, []).append(first)
+        self.last_reply.setdefault(key, []).append(last)
+
+    def timeout(self, flow, action):
+        key = f"{flow}.{action}"
+        self.timeouts[key] = self.timeouts.get(key, 0) + 1
+
+    def report(self):
+        all_first = [value for values in self.first_reply.values() for value in values]
+        all_last = [value for values in self.last_reply.values() for value in values]
+        return {
+            "first_reply": summarize(all_first),
+            "last_reply": summarize(all_last),
+            "steps": {
+                key: {"first_reply": summarize(self.first_reply[key]), "last_reply": summarize(self.last_reply[key])}
+                for key in sorted(self.first_reply)
+            },
+            "timeouts": self.timeouts,
+            "late_replies": self.late_replies,
+            "flows_completed": self.flows_completed,
+        }
+
+
+def prepare_workdir(source, workdir):
+    """Копирует базу знаний во временный каталог: тест добавляет в нее материалы"""
+    target = os.path.join(workdir, "knowledge_base")
+    shutil.copytree(source, target)
+    for name in ("search_index.sqlite3", "topics_manifest.json", "state.sqlite3"):
+        # Вместе с базой SQLite удаляем ее журнал WAL
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(target, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+    return target
+
+
+async def start_bot(api, args, workdir):
+    """Запускает процесс бота, направленный на заглушку Bot API"""
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": TOKEN,
+        "BOT_API_BASE_URL": api.base_url,
+        "BOT_API_FILE_URL": api.file_url,
+        "BOT_MODE": args.mode,
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.mode in ("webhook", "multi"):
+        # Бот вызовет setWebhook заглушки со своим адресом и секретом
+        port = free_port()
+        env.update({
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "WEBHOOK_PORT": str(port),
+            "WEBHOOK_HEALTH_PORT": str(free_port()),
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+            "WEBHOOK_SECRET": "loadtest-secret",
+        })
+    if args.mode == "multi":
+        env["WORKER_BASE_PORT"] = str(free_port())
+    for item in args.env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    log = open(os.path.join(workdir, "bot.log"), 'wb')
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, BOT_SCRIPT, cwd=workdir, env=env, stdout=log, stderr=asyncio.subprocess.STDOUT
+    )
+    return process, log
+
+
+async def stop_bot(process):
+    if process.returncode is None:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), 15)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+
+async def run_load(args):
+    workdir = tempfile.mkdtemp(prefix="kb-loadtest-")
+    knowledge_path = prepare_workdir(args.knowledge_base, workdir)
+    view = KnowledgeBaseView(knowledge_path)
+    flows = [flow for flow in args.flows.split(",") if flow]
+
+    api = FakeBotApi(TOKEN)
+    await api.start()
+    process, log = await start_bot(api, args, workdir)
+    stats = LoadStats()
+    try:
+        try:
+            await asyncio.wait_for(api.ready.wait(), args.startup_timeout)
+        except asyncio.TimeoutError:
+            raise SystemExit(f"Бот не запустился за {args.startup_timeout} с, журнал: {log.name}")
+        if args.mode == "multi":
+            # Первый обработчик вызывает setWebhook до того, как начнут слушать остальные
+            await asyncio.sleep(args.startup_delay)
+
+        rng = random.Random(args.seed)
+        users = [
+            SimulatedUser(args.first_user_id + number, api, view, stats, random.Random(rng.random()),
+                          args.think_time, args.reply_timeout)
+            for number in range(args.users)
+        ]
+        started = time.perf_counter()
+        deadline = started + args.duration
+        sent_before = api.sent_messages
+        updates_before = api.delivered
+        await asyncio.gather(*(user.run(flows, deadline, args.rounds) for user in users))
+        elapsed = time.perf_counter() - started
+    finally:
+        await stop_bot(process)
+        log.close()
+        await api.stop()
+
+    result = {
+        "mode": args.mode,
+        "users": args.users,
+        "flows": flows,
+        "think_time_s": args.think_time,
+        "elapsed_s": round(elapsed, 2),
+        "bot_messages": api.sent_messages - sent_before,
+        "messages_per_s": round((api.sent_messages - sent_before) / elapsed, 2),
+        "updates_sent": api.delivered - updates_before,
+        "sent_bytes": api.sent_bytes,
+        "api_calls": dict(sorted(api.calls.items())),
+        "latency": stats.report(),
+        "workdir": workdir,
+    }
+    if not args.keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+        del result["workdir"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Bot API")
+    parser.add_argument("--users", type=int, default=10, help="одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность теста, секунд")
+    parser.add_argument("--rounds", type=int, help="сценариев на пользователя (вместо ограничения по времени)")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"сценарии через запятую: {', '.join(FLOWS)}")
+    parser.add_argument("--mode", choices=("polling", "webhook", "multi"), default="polling")
+    parser.add_argument("--think-time", type=float, default=1.5,
+                        help="пауза пользователя; шаг завершен, если бот молчит столько секунд")
+    parser.add_argument("--reply-timeout", type=float, default=30, help="сколько ждать первого ответа")
+    parser.add_argument("--knowledge-base", default=os.path.join(ROOT_DIR, "knowledge_base"),
+                        help="база знаний, копия которой используется в тесте")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="дополнительные переменные окружения бота")
+    parser.add_argument("--first-user-id", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--startup-delay", type=float, default=3, help="пауза после запуска в режиме multi")
+    parser.add_argument("--keep-workdir", action="store_true", help="не удалять каталог теста (журнал бота)")
+    parser.add_argument("--output", help="файл для результатов (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    unknown = [flow for flow in args.flows.split(",") if flow and flow not in FLOWS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+    if args.rounds is not None:
+        args.duration = float("inf")
+
+    result = asyncio.run(run_load(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import os
+import asyncio
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import InputFile
+
+import config
+from database import kb
+from extraction import extract_text
+from images import Image, normalize_image
+from workers import run_in_process
+
+
+class FileStream(InputFile):
+    """Файл для отправки в Telegram, который httpx читает с диска частями.
+
+    InputFile из PTB 20.7 читает файловый объект в память целиком; здесь
+    вместо содержимого передается сам открытый файл. Части (по 64 КБ) httpx
+    читает синхронно в цикле событий - асинхронных файлов в multipart он не
+    принимает. Компромисс: память не растет с размером файла, а чтобы эти
+    чтения шли из страничного кэша, open_file заранее просит ОС подгрузить файл.
+    """
+
+    def __init__(self, handle, filename, attach=False):
+        super().__init__(b"", filename=filename, attach=attach)
+        self.input_file_content = handle
+
+
+class AsyncKnowledgeBase:
+    """Асинхронный фасад над KnowledgeBase.
+
+    Методы, читающие или пишущие файлы, выполняются в ограниченном пуле
+    потоков, чтобы не блокировать цикл событий; исключение - чтение частей
+    отправляемого файла (см. FileStream). Методы, работающие со структурой
+    тем в памяти, вызываются напрямую.
+    """
+
+    def __init__(self, knowledge_base, max_workers):
+        self.kb = knowledge_base
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kb-io")
+        # Фоновые задачи (ссылки нужны, чтобы задачи не собрал сборщик мусора)
+        self.background_tasks = set()
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет блокирующую функцию в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def background(self, coro):
+        """Запускает задачу в фоне, не дожидаясь ее завершения"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    async def wait_background(self):
+        """Дожидается завершения фоновых задач (при остановке бота)"""
+        while self.background_tasks:
+            await asyncio.gather(*list(self.background_tasks), return_exceptions=True)
+
+    def _background_done(self, task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Ошибка фоновой задачи: {task.exception()!r}")
+
+    # Данные в памяти
+
+    def get_topics(self):
+        return self.kb.get_topics()
+
+    def has_topic(self, topic):
+        return self.kb.has_topic(topic)
+
+    # Дисковый ввод-вывод
+
+    # Подразделы раздела читаются с диска и индексируются при первом обращении
+    # к разделу, а KnowledgeBase может ждать блокировку записи
+
+    async def get_subtopics(self, topic):
+        return await self.run(self.kb.get_subtopics, topic)
+
+    async def get_visible_subtopics(self, topic):
+        return await self.run(self.kb.get_visible_subtopics, topic)
+
+    async def find_subtopic(self, name, topic=None):
+        return await self.run(self.kb.find_subtopic, name, topic)
+
+    async def find_subtopics(self, query):
+        return await self.run(self.kb.find_subtopics, query)
+
+    async def get_topic_description(self, topic):
+        return await self.run(self.kb.get_topic_description, topic)
+
+    async def get_content(self, topic, subtopic):
+        return await self.run(self.kb.get_content, topic, subtopic)
+
+    async def get_article_page(self, article_id, number):
+        return await self.run(self.kb.get_article_page, article_id, number)
+
+    async def search(self, query):
+        return await self.run(self.kb.search, query)
+
+    async def search_page(self, results, offset=0, limit=10):
+        return await self.run(self.kb.search_page, results, offset, limit)
+
+    async def add_topic(self, topic_name):
+        return await self.run(self.kb.add_topic, topic_name)
+
+    async def add_subtopic(self, topic, subtopic_name):
+        return await self.run(self.kb.add_subtopic, topic, subtopic_name)
+
+    async def add_material(self, topic_key, file_path, caption, material_type="image", file_id=None, filename=None,
+                           upload_id=None):
+        material_id = await self.run(self.kb.add_material, topic_key, file_path, caption, material_type,
+                                     file_id, filename, upload_id)
+        if material_id is not None and material_type != "image":
+            # Текст вложения попадет в поиск, когда будет извлечен
+            self.background(self.extract_material_text(topic_key, material_id, material_type))
+        return material_id
+
+    async def update_material(self, topic_key, material_id, new_caption=None, new_file_path=None,
+                              material_type="image"):
+        updated = await self.run(self.kb.update_material, topic_key, material_id, new_caption, new_file_path,
+                                 material_type)
+        if updated and material_type != "image":
+            # Изменились файл или подпись - переиндексируем текст вложения
+            self.background(self.extract_material_text(topic_key, material_id, material_type))
+        return updated
+
+    async def delete_material(self, *args, **kwargs):
+        return await self.run(self.kb.delete_material, *args, **kwargs)
+
+    async def get_material(self, *args, **kwargs):
+        return await self.run(self.kb.get_material, *args, **kwargs)
+
+    async def set_material_file_id(self, *args, **kwargs):
+        return await self.run(self.kb.set_material_file_id, *args, **kwargs)
+
+    async def create_text_file(self, text, filename):
+        return await self.run(self.kb.create_text_file, text, filename)
+
+    async def save_uploaded_file(self, file_data, filename, file_type="image"):
+        file_path = await self.run(self.kb.save_uploaded_file, file_data, filename, file_type)
+        if file_type == "image":
+            file_path = await self.process_image(file_path)
+        return file_path
+
+    async def process_image(self, file_path, upload_id=None):
+        """Уменьшает и перекодирует загруженное изображение в пуле процессов.
+
+        Возвращает путь к обработанному изображению; если обработать файл не
+        удалось, остается исходный. Ожидающая загрузка upload_id переходит
+        на обработанный файл.
+        """
+        if Image is None:
+            return file_path
+        image_tmp = self.kb.image_blobs.temp_path()
+        try:
+            await run_in_process(normalize_image, file_path, image_tmp, config.IMAGE_MAX_SIDE, config.IMAGE_QUALITY)
+            return await self.run(self.kb.store_processed_image, file_path, image_tmp,
+                                  config.KEEP_ORIGINAL_IMAGES, upload_id)
+        except Exception as e:
+            print(f"Не удалось обработать изображение {file_path}: {e!r}")
+            return file_path
+        finally:
+            # Временный файл остается, только если обработка не завершилась
+            await self.run(_remove_if_exists, image_tmp)
+
+    async def open_upload(self, filename, file_type="image"):
+        return await self.run(self.kb.open_upload, filename, file_type)
+
+    async def commit_upload(self, writer, file_type="image"):
+        return await self.run(self.kb.commit_upload, writer, file_type)
+
+    async def release_upload(self, upload_id):
+        return await self.run(self.kb.release_upload, upload_id)
+
+    async def extract_material_text(self, topic_key, material_id, material_type="file"):
+        """Извлекает текст вложения в пуле процессов и добавляет его в поисковый индекс"""
+        prepared = await self.run(self.kb.prepare_material_text, topic_key, material_id, material_type)
+        if prepared is None:
+            return False
+        source_path, digest, text_path = prepared
+        if text_path is None:
+            text = await run_in_process(extract_text, source_path)
+            text_path = await self.run(self.kb.extracted_text.put, digest, text)
+        return await self.run(self.kb.index_material_text, topic_key, material_id, text_path, material_type)
+
+    async def backfill_material_text(self):
+        """Извлекает текст вложений, добавленных до появления извлечения (или при сбое)"""
+        for topic_key, material_id in await self.run(self.kb.materials_without_text):
+            try:
+                await self.extract_material_text(topic_key, material_id)
+            except Exception as e:
+                print(f"Не удалось извлечь текст вложения {material_id}: {e!r}")
+
+    @contextlib.asynccontextmanager
+    async def open_file(self, path, filename=None, attach=False):
+        """Открывает файл материала в пуле потоков для потоковой отправки в Telegram.
+
+        attach=True нужен для файлов альбома (InputMedia*).
+        """
+        handle = await self.run(_open_for_sending, path)
+        try:
+            yield FileStream(handle, filename or os.path.basename(path), attach)
+        finally:
+            handle.close()
+
+
+def _open_for_sending(path):
+    """Открывает файл и просит ОС заранее прочитать его в страничный кэш"""
+    handle = open(path, 'rb')
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+    return handle
+
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Асинхронный доступ к базе знаний для обработчиков бота
+akb = AsyncKnowledgeBase(kb, config.KB_IO_WORKERS)
@@ -0,0 +1,54 @@
+import os
+import uuid
+import hashlib
+
+
+class BlobStore:
+    """Хранилище файлов, адресуемых по содержимому.
+
+    Файл называется sha256 своего содержимого (с исходным расширением),
+    поэтому одинаковые загрузки хранятся в одном экземпляре. Ссылки на файл -
+    это записи материалов с таким путем; удалять файл можно только когда
+    исчезла последняя из них.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest, ext=""):
+        """Возвращает путь к файлу с указанным sha256"""
+        return os.path.join(self.root, f"{digest}{ext.lower()}")
+
+    def temp_path(self):
+        """Возвращает путь для временного файла в том же каталоге (для атомарного переименования)"""
+        return os.path.join(self.root, f".upload-{uuid.uuid4().hex}.part")
+
+    def put_file(self, tmp_path, digest, ext=""):
+        """Переносит готовый временный файл в хранилище, возвращает путь к нему"""
+        blob_path = self.path_for(digest, ext)
+        if os.path.exists(blob_path):
+            # Такой файл уже есть - копия не нужна
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, blob_path)
+        return blob_path
+
+    def put_temp(self, tmp_path, ext=""):
+        """Переносит временный файл в хранилище, вычислив sha256 его содержимого"""
+        sha256 = hashlib.sha256()
+        with open(tmp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return self.put_file(tmp_path, sha256.hexdigest(), ext)
+
+    def put_bytes(self, data, ext=""):
+        """Сохраняет содержимое в хранилище, возвращает путь к файлу"""
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.path_for(digest, ext)
+        if not os.path.exists(blob_path):
+            tmp_path = self.temp_path()
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+        return blob_path
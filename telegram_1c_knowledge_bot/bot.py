@@ -1,11 +1,28 @@
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters, ContextTypes, 
-    ConversationHandler
+    ConversationHandler, CallbackQueryHandler, TypeHandler
 )
 import config
-from database import kb
-import re
+from async_kb import akb
+from delivery import article_page_markup, send_content
+from intelligent import ScenarioRegistry
+from render_cache import render_cache, set_user_markup, user_markup
+from uploads import close_download_client, download_client, stream_upload
+from outbound import OutboundScheduler
+from profiling import UpdateProfiler, annotate_conversation, annotate_handler
+from metrics import (
+    MetricsServer, instrument_conversation, instrument_handler, instrument_methods,
+    instrument_outbound, instrument_render_cache
+)
+from router import run_router
+from shared_state import SqlitePersistence
+from update_processor import ChatOrderedUpdateProcessor
+from webhook import HealthServer, run_webhook
+from workers import shutdown_process_pool
+import os
+import asyncio
 import uuid
 
 # Состояния для ConversationHandler
@@ -14,53 +31,16 @@ import uuid
     TYPING_TITLE, TYPING_CONTENT, UPLOADING_IMAGE, UPLOADING_FILE, 
     TYPING_CAPTION, ADDING_TOPIC, ADDING_SUBTOPIC, INTELLIGENT_SYSTEM, SHOWING_INSTRUCTIONS
 ) = range(12)
+# Названия состояний для метрик
+STATE_NAMES = dict(enumerate([
+    "SELECTING_ACTION", "SELECTING_TOPIC", "SELECTING_SUBTOPIC",
+    "TYPING_TITLE", "TYPING_CONTENT", "UPLOADING_IMAGE", "UPLOADING_FILE",
+    "TYPING_CAPTION", "ADDING_TOPIC", "ADDING_SUBTOPIC", "INTELLIGENT_SYSTEM", "SHOWING_INSTRUCTIONS"
+]))
 
-# Получаем список тем из базы знаний
-topics = kb.get_topics()
-# База знаний для интеллектуальной системы
-INTELLIGENT_KNOWLEDGE_BASE = {
-    "документ_подписание": {
-        "keywords": ["документ", "подписание", "подписать", "подписан", "подписывать", "не приходит", "не поступает"],
-        "questions": [
-            "У вас не приходит документ на подписание?",
-            "Не приходит МОЛу?",
-            "Есть ли в справочнике сотрудники дубли?"
-        ],
-        "answers": {
-            "да": {
-                "0": "Проверьте настройки маршрутизации документов в системе.",
-                "1": "Проверьте настройки прав МОЛа и его учетную запись в системе.",
-                "2": "Удалите дубликаты сотрудников и перенастройте адресацию."
-            },
-            "нет": {
-                "0": "Опишите проблему более подробно, возможно, дело не в подписании документов.",
-                "1": "Тогда проблема может быть в настройках конкретного пользователя. Проверьте его учетную запись и права доступа.",
-                "2": "Тогда проблема может быть в настройках маршрутизации. Проверьте правила маршрутизации документов в системе."
-            }
-        },
-        # Добавляем информацию о связанном подразделе
-        "related_subtopic": {
-            "topic": "ОЦО ЦБ",
-            "subtopic": "не_поступила_задача_на_подписание_молу",
-            "condition": "all_yes"  # Показывать инструкцию только если на все вопросы ответили "да"
-        }
-    }
-}
-
-# Создаем клавиатуру для основного меню
-def create_main_keyboard():
-    keyboard = [[topic] for topic in topics]
-    keyboard.append(["Поиск", "Управление материалами","Интеллектуальная система"])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-# Создаем клавиатуру для подразделов
-def create_subtopic_keyboard(topic):
-    subtopics = kb.get_subtopics(topic)
-    # Исключаем служебный файл _description из списка подразделов
-    subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
-    keyboard = [[subtopic] for subtopic in subtopics]
-    keyboard.append(["Назад к разделам"])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+# Сценарии интеллектуальной системы (knowledge_base/scenarios/*.json)
+scenario_registry = ScenarioRegistry(config.SCENARIOS_PATH, config.SCENARIOS_RELOAD_INTERVAL)
+scenario_registry.refresh(force=True)
 
 # Клавиатура для управления материалами
 manage_keyboard = [
@@ -74,41 +54,48 @@ cancel_only_markup = ReplyKeyboardMarkup(cancel_only_keyboard, resize_keyboard=T
 # Клавиатура для ответов да/нет
 yes_no_keyboard = [["Да", "Нет"], ["Отмена"]]
 yes_no_markup = ReplyKeyboardMarkup(yes_no_keyboard, resize_keyboard=True)
-# Глобальная переменная для хранения текущей клавиатуры
-current_markup = create_main_keyboard()
+# Клавиатура с предложением посмотреть инструкцию
+instructions_keyboard = [["Показать инструкцию"], ["Отмена"]]
+instructions_markup = ReplyKeyboardMarkup(instructions_keyboard, resize_keyboard=True)
+# Действия управления материалами, для которых после раздела выбирается подраздел
+MATERIAL_ACTIONS = ('add_text', 'add_image', 'upload_file')
+# Сколько последних поисков пользователя можно листать кнопкой "Ещё"
+SEARCHES_KEPT = 3
+
+def search_more_markup(search_id, offset):
+    """Кнопка следующей страницы результатов поиска: callback_data "sr:<id поиска>:<номер результата>" """
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Ещё", callback_data=f"sr:{search_id}:{offset}")]])
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
-    global current_markup
     
     welcome_text = """
 Привет! Я - база знаний для системного аналитика в 1С.
 
 Выбери раздел из меню ниже, напиши "Поиск [запрос]" для поиска информации или "Управление материалами" для редактирования базы знаний.
     """
-    current_markup = create_main_keyboard()
-    await update.message.reply_text(welcome_text, reply_markup=current_markup)
+    markup = await set_user_markup(context)
+    await update.message.reply_text(welcome_text, reply_markup=markup)
     return SELECTING_ACTION
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений в основном состоянии"""
-    global current_markup
     
     text = update.message.text
     
     # Проверяем команды управления материалами
     if text == "Добавить текст":
-        await update.message.reply_text("Выбери раздел для нового материала:", reply_markup=current_markup)
+        await update.message.reply_text("Выбери раздел для нового материала:", reply_markup=await user_markup(context))
         context.user_data['action'] = 'add_text'
         return SELECTING_TOPIC
     
     elif text == "Добавить изображение":
-        await update.message.reply_text("Выбери раздел для нового изображения:", reply_markup=current_markup)
+        await update.message.reply_text("Выбери раздел для нового изображения:", reply_markup=await user_markup(context))
         context.user_data['action'] = 'add_image'
         return SELECTING_TOPIC
     
     elif text == "Загрузить файл":
-        await update.message.reply_text("Выбери раздел для загрузки файла:", reply_markup=current_markup)
+        await update.message.reply_text("Выбери раздел для загрузки файла:", reply_markup=await user_markup(context))
         context.user_data['action'] = 'upload_file'
         return SELECTING_TOPIC
     
@@ -118,7 +105,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ADDING_TOPIC
     
     elif text == "Добавить подраздел":
-        await update.message.reply_text("Выбери раздел для добавления подраздела:", reply_markup=current_markup)
+        await update.message.reply_text("Выбери раздел для добавления подраздела:", reply_markup=await user_markup(context))
         context.user_data['action'] = 'add_subtopic'
         return SELECTING_TOPIC
     
@@ -139,83 +126,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return INTELLIGENT_SYSTEM
     elif text == "Назад к разделам":
-        current_markup = create_main_keyboard()
+        markup = await set_user_markup(context)
         # Очищаем информацию о текущем разделе из контекста
         if 'current_topic' in context.user_data:
             del context.user_data['current_topic']
-        await update.message.reply_text("Выбери раздел:", reply_markup=current_markup)
+        await update.message.reply_text("Выбери раздел:", reply_markup=markup)
         return SELECTING_ACTION
     
     elif text.lower().startswith("поиск "):
         query = text[6:].strip()
         if query:
-            # Нормализуем запрос для сравнения
-            normalized_query = query.lower().replace(' ', '_')
-            found_exact_match = False
-            
             # Сначала ищем точное совпадение с подразделом
-            for topic in topics:
-                subtopics = kb.get_subtopics(topic)
-                # Исключаем служебный файл _description
-                subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
-                
-                for subtopic in subtopics:
-                    # Нормализуем название подраздела для сравнения
-                    normalized_subtopic = subtopic.lower().replace(' ', '_')
-                    
-                    if normalized_query == normalized_subtopic:
-                        # Нашли точное совпадение - показываем инструкцию
-                        found_exact_match = True
-                        content = kb.get_content(topic, subtopic)
-                        
-                        # Отправляем текст
-                        await update.message.reply_text(content["text"])
-                        
-                        # Отправляем изображения, если они есть
-                        for image_info in content["images"]:
-                            try:
-                                with open(image_info["path"], 'rb') as photo:
-                                    caption = f"{image_info['caption']}\n\nID: {image_info['id']}"
-                                    await update.message.reply_photo(photo=photo, caption=caption)
-                            except FileNotFoundError:
-                                await update.message.reply_text(f"Изображение не найдено: {image_info['path']}")
-                        
-                        # Отправляем файлы, если они есть
-                        for file_info in content["files"]:
-                            try:
-                                with open(file_info["path"], 'rb') as file:
-                                    caption = f"{file_info['caption']}\n\nID: {file_info['id']}"
-                                    await update.message.reply_document(document=file, caption=caption)
-                            except FileNotFoundError:
-                                await update.message.reply_text(f"Файл не найден: {file_info['path']}")
-                        
-                        break
-                
-                if found_exact_match:
-                    break
+            exact_match = await akb.find_subtopic(query)
             
-            # Если не нашли точное совпадение, ищем по ключевым словам
-            if not found_exact_match:
-                results = []
-                for topic in topics:
-                    subtopics = kb.get_subtopics(topic)
-                    # Исключаем служебный файл _description
-                    subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
-                    
-                    for subtopic in subtopics:
-                        # Нормализуем название подраздела для поиска
-                        normalized_subtopic = subtopic.lower().replace(' ', '_')
-                        
-                        # Ищем вхождение слов запроса в названии подраздела
-                        query_words = normalized_query.split('_')
-                        found = any(word in normalized_subtopic for word in query_words if len(word) > 2)
-                        
-                        if found:
-                            results.append(f"{topic} -> {subtopic}")
+            if exact_match:
+                # Нашли точное совпадение - показываем инструкцию
+                topic, subtopic = exact_match
+                content = await akb.get_content(topic, subtopic)
+                await send_content(update.message, content)
+            elif not await send_search_page(update.message, context, query):
+                # По текстам ничего не нашлось - ищем похожие названия подразделов
+                results = [f"{topic} -> {subtopic}" for topic, subtopic in await akb.find_subtopics(query)]
                 
                 if results:
-                    response = "Найдены подразделы по ключевым словам:\n\n" + "\n".join(results)
-                    await update.message.reply_text(response[:4000])
+                    response = "Найдены подразделы по ключевым словам:\n\n" + "\n".join(results[:config.SEARCH_PAGE_SIZE])
+                    await update.message.reply_text(response)
                 else:
                     await update.message.reply_text("Ничего не найдено по подразделам")
         else:
@@ -223,28 +158,19 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECTING_ACTION
         
     # Проверяем, является ли сообщение одним из разделов
-    elif text in topics:
+    elif akb.has_topic(text):
         # Показываем описание раздела и его подразделы
-        description = kb.get_topic_description(text)
-        subtopics = kb.get_subtopics(text)
-        # Исключаем служебный файл _description из списка подразделов
-        subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
+        response, has_subtopics = await render_cache.topic_page(text)
         
-        if subtopics:
-            # Сохраняем текущий раздел и показываем подразделы
+        if has_subtopics:
+            # Сохраняем текущий раздел и показываем подразделы (незавершенное добавление материала отменяется)
+            context.user_data.pop('action', None)
             context.user_data['current_topic'] = text
-            current_markup = create_subtopic_keyboard(text)
-            
-            response = f"{description}\n\nПодразделы раздела '{text}':\n"
-            for subtopic in subtopics:
-                response += f"• {subtopic}\n"
-            response += "\nВыбери подраздел:"
-            
-            await update.message.reply_text(response, reply_markup=current_markup)
+            markup = await set_user_markup(context, text)
+            await update.message.reply_text(response, reply_markup=markup)
             return SELECTING_SUBTOPIC
         else:
             # В разделе нет подразделов
-            response = f"{description}\n\nВ разделе '{text}' пока нет подразделов. Добавь подраздел через меню 'Управление материалами'."
             await update.message.reply_text(response)
             return SELECTING_ACTION
     
@@ -252,15 +178,71 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Не понимаю команду. Выбери раздел из меню или используй 'Поиск'.")
     return SELECTING_ACTION
 
+async def send_search_page(message, context, query):
+    """Ищет по базе знаний и отправляет первую страницу результатов, возвращает False, если ничего не найдено"""
+    results = await akb.search(query)
+    if not results:
+        return False
+    
+    # Снимок результатов запоминается под своим id - кнопка "Ещё" листает именно этот поиск
+    search_id = uuid.uuid4().hex[:8]
+    searches = context.user_data.setdefault('searches', {})
+    searches[search_id] = results
+    while len(searches) > SEARCHES_KEPT:
+        del searches[next(iter(searches))]
+    return await send_results_page(message, context, search_id, 0)
+
+async def send_results_page(message, context, search_id, offset):
+    """Отправляет страницу запомненных результатов поиска, возвращает False, если показать нечего"""
+    results = context.user_data['searches'][search_id]
+    response, next_offset = await akb.search_page(results, offset, config.SEARCH_PAGE_SIZE)
+    if response is None:
+        return False
+    
+    markup = search_more_markup(search_id, next_offset) if next_offset is not None else None
+    await message.reply_text(response, reply_markup=markup)
+    return True
+
+async def search_more(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопки "Ещё" - следующая страница результатов того поиска, к которому относится кнопка"""
+    callback_query = update.callback_query
+    await callback_query.answer()
+    # Кнопка больше не нужна - следующая страница придет отдельным сообщением
+    await callback_query.edit_message_reply_markup(None)
+    
+    _, search_id, offset = callback_query.data.split(":")
+    if search_id not in context.user_data.get('searches', {}):
+        await callback_query.message.reply_text("Результаты поиска устарели. Повтори поиск.")
+    elif not await send_results_page(callback_query.message, context, search_id, int(offset)):
+        await callback_query.message.reply_text("Больше результатов нет. Повтори поиск.")
+
+async def article_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопок листания статьи - показывает страницу из кэша в том же сообщении"""
+    callback_query = update.callback_query
+    _, article_id, number = callback_query.data.split(":")
+    page = await akb.get_article_page(article_id, int(number))
+    if page is None:
+        await callback_query.answer("Статья больше недоступна. Открой подраздел заново.")
+        await callback_query.edit_message_reply_markup(None)
+        return
+    
+    await callback_query.answer()
+    text, page_count = page
+    number = min(max(int(number), 1), page_count)
+    try:
+        await callback_query.edit_message_text(text, reply_markup=article_page_markup(article_id, number, page_count))
+    except BadRequest:
+        # Повторное нажатие на ту же кнопку - сообщение уже показывает эту страницу
+        pass
+
 async def show_instructions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик для показа инструкций из подраздела"""
-    global current_markup
     
     user_input = update.message.text
     
     if user_input == "Отмена":
-        current_markup = create_main_keyboard()
-        await update.message.reply_text("Действие отменено.", reply_markup=current_markup)
+        markup = await set_user_markup(context)
+        await update.message.reply_text("Действие отменено.", reply_markup=markup)
         
         # Очищаем информацию об инструкции
         if 'instructions_topic' in context.user_data:
@@ -277,36 +259,17 @@ async def show_instructions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if topic and subtopic:
             # Показываем содержимое подраздела
-            content = kb.get_content(topic, subtopic)
-            
-            # Отправляем текст
-            await update.message.reply_text(content["text"])
+            content = await akb.get_content(topic, subtopic)
             
-            # Отправляем изображения, если они есть
-            for image_info in content["images"]:
-                try:
-                    with open(image_info["path"], 'rb') as photo:
-                        caption = f"{image_info['caption']}\n\nID: {image_info['id']}"
-                        await update.message.reply_photo(photo=photo, caption=caption)
-                except FileNotFoundError:
-                    await update.message.reply_text(f"Изображение не найдено: {image_info['path']}")
-            
-            # Отправляем файлы, если они есть
-            for file_info in content["files"]:
-                try:
-                    with open(file_info["path"], 'rb') as file:
-                        caption = f"{file_info['caption']}\n\nID: {file_info['id']}"
-                        await update.message.reply_document(document=file, caption=caption)
-                except FileNotFoundError:
-                    await update.message.reply_text(f"Файл не найден: {file_info['path']}")
+            await send_content(update.message, content)
             
             # Очищаем информацию об инструкции
             del context.user_data['instructions_topic']
             del context.user_data['instructions_subtopic']
             
             # Возвращаемся к основному меню
-            current_markup = create_main_keyboard()
-            await update.message.reply_text("Чем еще могу помочь?", reply_markup=current_markup)
+            markup = await set_user_markup(context)
+            await update.message.reply_text("Чем еще могу помочь?", reply_markup=markup)
             
             return SELECTING_ACTION
         else:
@@ -318,184 +281,139 @@ async def show_instructions(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_intelligent_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик интеллектуальной системы"""
-    global current_markup
     
     user_input = update.message.text.lower()
     
     if user_input == "отмена":
-        current_markup = create_main_keyboard()
-        await update.message.reply_text("Диалог прерван.", reply_markup=current_markup)
+        markup = await set_user_markup(context)
+        await update.message.reply_text("Диалог прерван.", reply_markup=markup)
         return SELECTING_ACTION
     
-    # Инициализация или получение текущего состояния диалога
-    if 'intelligent_state' not in context.user_data:
-        context.user_data['intelligent_state'] = {
-            'current_topic': None,
-            'current_question': 0,
-            'answers': {}
-        }
-    
-    state = context.user_data['intelligent_state']
-    
-    # Определяем тему по ключевым словам
-    if not state['current_topic']:
-        matched_topics = []
-        for topic, data in INTELLIGENT_KNOWLEDGE_BASE.items():
-            for keyword in data['keywords']:
-                if re.search(rf'\b{keyword}\b', user_input):
-                    matched_topics.append(topic)
-                    break
-        
-        if matched_topics:
-            state['current_topic'] = matched_topics[0]
-            state['current_question'] = 0
-            question = INTELLIGENT_KNOWLEDGE_BASE[state['current_topic']]['questions'][0]
-            await update.message.reply_text(question, reply_markup=yes_no_markup)
+    # Подхватываем изменения файлов сценариев без перезапуска бота
+    await akb.run(scenario_registry.refresh)
+    
+    state = context.user_data.get('intelligent_state')
+    
+    # Определяем сценарий по ключевым словам
+    if not state:
+        scenario = scenario_registry.match(user_input)
+        
+        if scenario:
+            context.user_data['intelligent_state'] = {
+                'scenario': scenario.id,
+                'node': scenario.start,
+                'answers': {},
+                'said': []
+            }
+            await update.message.reply_text(scenario.question(scenario.start), reply_markup=yes_no_markup)
             return INTELLIGENT_SYSTEM
         else:
-            current_markup = create_main_keyboard()
+            markup = await set_user_markup(context)
             await update.message.reply_text(
                 "Не могу определить тему вашего вопроса. Попробуйте использовать другие слова или обратитесь к разделам базы знаний.",
-                reply_markup=current_markup
+                reply_markup=markup
             )
             return SELECTING_ACTION
     
+    scenario = scenario_registry.get(state['scenario'])
+    if scenario is None or state['node'] not in scenario.nodes:
+        # Сценарий изменили или удалили во время диалога
+        del context.user_data['intelligent_state']
+        markup = await set_user_markup(context)
+        await update.message.reply_text(
+            "Сценарий диагностики был обновлен. Опишите проблему заново через меню 'Интеллектуальная система'.",
+            reply_markup=markup
+        )
+        return SELECTING_ACTION
+    
     # Обработка ответов да/нет
     if user_input in ["да", "нет"]:
-        topic_data = INTELLIGENT_KNOWLEDGE_BASE[state['current_topic']]
-        current_q = state['current_question']
+        # Сохраняем ответ и переходим по ветви графа
+        say, next_node = scenario.step(state['node'], user_input)
+        state['answers'][state['node']] = user_input
+        if say:
+            state['said'].append(say)
+        
+        if next_node is not None:
+            state['node'] = next_node
+            await update.message.reply_text(scenario.question(next_node), reply_markup=yes_no_markup)
+            return INTELLIGENT_SYSTEM
         
-        # Сохраняем ответ
-        state['answers'][current_q] = user_input
+        # Формируем итоговый ответ по пройденной ветви
+        final_answer = "".join(f"{text}\n\n" for text in state['said'])
         
-        # Проверяем, есть ли следующий вопрос
-        if current_q + 1 < len(topic_data['questions']):
-            state['current_question'] += 1
-            next_question = topic_data['questions'][current_q + 1]
-            await update.message.reply_text(next_question, reply_markup=yes_no_markup)
-            return INTELLIGENT_SYSTEM
-        else:
-            # Формируем итоговый ответ на основе всех ответов
-            final_answer = ""
-            for i, answer in state['answers'].items():
-                answer_text = topic_data['answers'][answer].get(str(i), "")
-                if answer_text:
-                    final_answer += f"{answer_text}\n\n"
-            
-            # Проверяем, нужно ли показывать инструкцию из подраздела
-            if 'related_subtopic' in topic_data:
-                condition = topic_data['related_subtopic'].get('condition')
-                topic_name = topic_data['related_subtopic']['topic']
-                subtopic_name = topic_data['related_subtopic']['subtopic']
-                
-                # Проверяем условие для показа инструкции
-                show_instructions = False
-                if condition == "all_yes":
-                    show_instructions = all(answer == "да" for answer in state['answers'].values())
-                
-                if show_instructions:
-                    # Сохраняем информацию о подразделе для показа
-                    context.user_data['instructions_topic'] = topic_name
-                    context.user_data['instructions_subtopic'] = subtopic_name
-                    
-                    # Добавляем предложение посмотреть инструкцию
-                    final_answer += f"\nРекомендую ознакомиться с инструкции по настройке: '{subtopic_name}'"
-            
-            # Устанавливаем клавиатуру с предложением посмотреть инструкцию
-            if 'instructions_topic' in context.user_data:
-                instructions_keyboard = [["Показать инструкцию"], ["Отмена"]]
-                instructions_markup = ReplyKeyboardMarkup(instructions_keyboard, resize_keyboard=True)
-                await update.message.reply_text(final_answer, reply_markup=instructions_markup)
-            else:
-                current_markup = create_main_keyboard()
-                await update.message.reply_text(final_answer, reply_markup=current_markup)
-            
-            # Сбрасываем состояние интеллектуальной системы
-            del context.user_data['intelligent_state']
+        # Проверяем, нужно ли показывать инструкцию из подраздела
+        related = scenario.related_for(state['answers'])
+        if related:
+            topic_name, subtopic_name = related
+            # Сохраняем информацию о подразделе для показа
+            context.user_data['instructions_topic'] = topic_name
+            context.user_data['instructions_subtopic'] = subtopic_name
             
-            # Переходим в состояние показа инструкции или возвращаемся к выбору действия
-            if 'instructions_topic' in context.user_data:
-                return SHOWING_INSTRUCTIONS
-            else:
-                return SELECTING_ACTION
+            # Добавляем предложение посмотреть инструкцию
+            final_answer += f"\nРекомендую ознакомиться с инструкции по настройке: '{subtopic_name}'"
+        
+        # Устанавливаем клавиатуру с предложением посмотреть инструкцию
+        if 'instructions_topic' in context.user_data:
+            await update.message.reply_text(final_answer, reply_markup=instructions_markup)
+        else:
+            markup = await set_user_markup(context)
+            await update.message.reply_text(final_answer or "Диагностика завершена.", reply_markup=markup)
+        
+        # Сбрасываем состояние интеллектуальной системы
+        del context.user_data['intelligent_state']
+        
+        # Переходим в состояние показа инструкции или возвращаемся к выбору действия
+        if 'instructions_topic' in context.user_data:
+            return SHOWING_INSTRUCTIONS
+        else:
+            return SELECTING_ACTION
     else:
         await update.message.reply_text("Пожалуйста, ответьте 'Да' или 'Нет'.", reply_markup=yes_no_markup)
         return INTELLIGENT_SYSTEM
 
 async def handle_subtopic_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик выбора подраздела"""
-    global current_markup
     
     text = update.message.text.strip()  # Убираем лишние пробелы
     
     # Проверяем, не хочет ли пользователь вернуться к разделам
     if text == "Назад к разделам":
-        current_markup = create_main_keyboard()
+        markup = await set_user_markup(context)
         # Очищаем информацию о текущем разделе из контекста
         if 'current_topic' in context.user_data:
             del context.user_data['current_topic']
-        await update.message.reply_text("Выбери раздел:", reply_markup=current_markup)
+        await update.message.reply_text("Выбери раздел:", reply_markup=markup)
         return SELECTING_ACTION
     
+    # Подраздел выбирают и для добавления материала - это обрабатывает select_subtopic
+    if context.user_data.get('action') in MATERIAL_ACTIONS:
+        return await select_subtopic(update, context)
+    
     # Проверяем, есть ли текущий раздел в контекста
     if 'current_topic' not in context.user_data:
-        current_markup = create_main_keyboard()
-        await update.message.reply_text("Сессия устарела. Выбери раздел заново:", reply_markup=current_markup)
+        markup = await set_user_markup(context)
+        await update.message.reply_text("Сессия устарела. Выбери раздел заново:", reply_markup=markup)
         return SELECTING_ACTION
     
     current_topic = context.user_data['current_topic']
-    subtopics = kb.get_subtopics(current_topic)
-    # Исключаем служебный файл _description из списка подразделов
-    subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
     
-    # Нормализуем текст для сравнения (приводим к нижнему регистру и заменяем пробелы на подчеркивания)
-    normalized_text = text.lower().replace(' ', '_')
-    
-    # Ищем подраздел с учетом нормализации
-    matching_subtopic = None
-    for subtopic in subtopics:
-        normalized_subtopic = subtopic.lower().replace(' ', '_')
-        if normalized_subtopic == normalized_text:
-            matching_subtopic = subtopic
-            break
+    # Ищем подраздел без учета регистра и пробелов
+    match = await akb.find_subtopic(text, topic=current_topic)
+    matching_subtopic = match[1] if match else None
     
     # Проверяем, является ли сообщение одним из подразделов
     if matching_subtopic:
         # Показываем содержимое подраздела
-        content = kb.get_content(current_topic, matching_subtopic)
-        
-        # Отправляем текст
-        await update.message.reply_text(content["text"])
-        
-        # Отправляем изображения, если они есть
-        for image_info in content["images"]:
-            try:
-                with open(image_info["path"], 'rb') as photo:
-                    caption = f"{image_info['caption']}\n\nID: {image_info['id']}"
-                    await update.message.reply_photo(photo=photo, caption=caption)
-            except FileNotFoundError:
-                await update.message.reply_text(f"Изображение не найдено: {image_info['path']}")
-        
-        # Отправляем файлы, если они есть
-        for file_info in content["files"]:
-            try:
-                with open(file_info["path"], 'rb') as file:
-                    caption = f"{file_info['caption']}\n\nID: {file_info['id']}"
-                    await update.message.reply_document(document=file, caption=caption)
-            except FileNotFoundError:
-                await update.message.reply_text(f"Файл не найден: {file_info['path']}")
+        content = await akb.get_content(current_topic, matching_subtopic)
+        
+        await send_content(update.message, content)
         
         return SELECTING_ACTION
     else:
         # Если это не подраздел, показываем подразделы снова
-        description = kb.get_topic_description(current_topic)
-        
-        response = f"{description}\n\nПодразделы раздела '{current_topic}':\n"
-        for subtopic in subtopics:
-            response += f"• {subtopic}\n"
-        response += "\nВыбери подраздел:"
-        
-        await update.message.reply_text(response, reply_markup=current_markup)
+        response, _ = await render_cache.topic_page(current_topic)
+        await update.message.reply_text(response, reply_markup=await user_markup(context))
         return SELECTING_SUBTOPIC
 
 async def select_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -503,7 +421,7 @@ async def select_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     action = context.user_data.get('action')
     
-    if text not in topics:
+    if not akb.has_topic(text):
         await update.message.reply_text("Пожалуйста, выбери раздел из предложенных вариантов.")
         return SELECTING_TOPIC
     
@@ -511,42 +429,37 @@ async def select_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if action == 'add_text':
         # Переходим к выбору подраздела
-        subtopics = kb.get_subtopics(text)
-        # Исключаем служебный файл _description из списка подразделов
-        subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
+        subtopics = await akb.get_visible_subtopics(text)
         if not subtopics:
             await update.message.reply_text("В этом разделе нет подразделов. Сначала добавь подраздел.")
             return SELECTING_ACTION
         
-        global current_markup
-        current_markup = create_subtopic_keyboard(text)
-        await update.message.reply_text("Выбери подраздел для добавления текста:", reply_markup=current_markup)
+        markup = await set_user_markup(context, text)
+        await update.message.reply_text("Выбери подраздел для добавления текста:", reply_markup=markup)
         context.user_data['current_topic'] = text
         return SELECTING_SUBTOPIC
     
     elif action == 'add_image':
         # Переходим к выбору подраздела
-        subtopics = kb.get_subtopics(text)
-        subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
+        subtopics = await akb.get_visible_subtopics(text)
         if not subtopics:
             await update.message.reply_text("В этом раздее нет подразделов. Сначала добавь подраздел.")
             return SELECTING_ACTION
         
-        current_markup = create_subtopic_keyboard(text)
-        await update.message.reply_text("Выбери подраздел для добавления изображения:", reply_markup=current_markup)
+        markup = await set_user_markup(context, text)
+        await update.message.reply_text("Выбери подраздел для добавления изображения:", reply_markup=markup)
         context.user_data['current_topic'] = text
         return SELECTING_SUBTOPIC
     
     elif action == 'upload_file':
         # Переходим к выбору подраздела
-        subtopics = kb.get_subtopics(text)
-        subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
+        subtopics = await akb.get_visible_subtopics(text)
         if not subtopics:
             await update.message.reply_text("В этого раздела нет подразделов. Сначала добавь подраздел.")
             return SELECTING_ACTION
         
-        current_markup = create_subtopic_keyboard(text)
-        await update.message.reply_text("Выбери подраздел для загрузки файла:", reply_markup=current_markup)
+        markup = await set_user_markup(context, text)
+        await update.message.reply_text("Выбери подраздел для загрузки файла:", reply_markup=markup)
         context.user_data['current_topic'] = text
         return SELECTING_SUBTOPIC
     
@@ -562,21 +475,9 @@ async def select_subtopic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     action = context.user_data.get('action')
     topic = context.user_data.get('topic')
     
-    # Получаем подразделы для текущего раздела
-    subtopics = kb.get_subtopics(topic) if topic else []
-    # Исключаем служебный файл _description из списка подразделов
-    subtopics = [subtopic for subtopic in subtopics if subtopic != '_description']
-    
-    # Нормализуем текст для сравнения
-    normalized_text = text.lower().replace(' ', '_')
-    
-    # Ищем подраздел с учетом нормализации
-    matching_subtopic = None
-    for subtopic in subtopics:
-        normalized_subtopic = subtopic.lower().replace(' ', '_')
-        if normalized_subtopic == normalized_text:
-            matching_subtopic = subtopic
-            break
+    # Ищем подраздел текущего раздела без учета регистра и пробелов
+    match = await akb.find_subtopic(text, topic=topic) if topic else None
+    matching_subtopic = match[1] if match else None
     
     # Проверяем, является ли текст подразделом
     if not matching_subtopic:
@@ -601,24 +502,20 @@ async def select_subtopic(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def add_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Добавление нового раздела"""
-    global topics, current_markup
-    
     topic_name = update.message.text
     
     # Проверяем, не существует ли уже такой раздел
-    if topic_name in topics:
+    if akb.has_topic(topic_name):
         await update.message.reply_text("Раздел с таким названием уже существует. Введите другое название:")
         return ADDING_TOPIC
     
     # Добавляем новый раздел
-    success = kb.add_topic(topic_name)
+    success = await akb.add_topic(topic_name)
     
     if success:
-        # Обновляем список тем
-        topics = kb.get_topics()
-        current_markup = create_main_keyboard()
+        markup = await set_user_markup(context)
         
-        await update.message.reply_text(f"Раздел '{topic_name}' успешно добавлен!", reply_markup=current_markup)
+        await update.message.reply_text(f"Раздел '{topic_name}' успешно добавлен!", reply_markup=markup)
     else:
         await update.message.reply_text("Ошибка при добавлении раздела. Попробуйте еще раз.")
     
@@ -629,28 +526,20 @@ async def add_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def add_subtopic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Добавление нового подраздела"""
-    global current_markup
     
     subtopic_name = update.message.text
     topic = context.user_data['topic']
     
-    # Проверяем, не существует ли уже такой подраздел
-    existing_subtopics = kb.get_subtopics(topic)
-    existing_subtopics = [subtopic for subtopic in existing_subtopics if subtopic != '_description']
-    
-    # Нормализуем для сравнения
-    normalized_new_subtopic = subtopic_name.lower().replace(' ', '_')
-    for existing_subtopic in existing_subtopics:
-        normalized_existing = existing_subtopic.lower().replace(' ', '_')
-        if normalized_existing == normalized_new_subtopic:
-            await update.message.reply_text("Подраздел с таким названием уже существует в этом разделе. Введите другое название:")
-            return ADDING_SUBTOPIC
+    # Проверяем, не существует ли уже такой подраздел (без учета регистра и пробелов)
+    if await akb.find_subtopic(subtopic_name, topic=topic):
+        await update.message.reply_text("Подраздел с таким названием уже существует в этом разделе. Введите другое название:")
+        return ADDING_SUBTOPIC
     
     # Добавляем новый подраздел
-    success = kb.add_subtopic(topic, subtopic_name)
+    success = await akb.add_subtopic(topic, subtopic_name)
     
     if success:
-        await update.message.reply_text(f"Подраздел '{subtopic_name}' успешно добавлен в раздел '{topic}'!", reply_markup=current_markup)
+        await update.message.reply_text(f"Подраздел '{subtopic_name}' успешно добавлен в раздел '{topic}'!", reply_markup=await user_markup(context))
     else:
         await update.message.reply_text("Ошибка при добавлении подраздела. Попробуйте еще раз.")
     
@@ -677,17 +566,18 @@ async def create_text_material(update: Update, context: ContextTypes.DEFAULT_TYP
         # Создаем текстовый файл
         full_text = f"{title}\n\n{content}"
         filename = f"{topic_key.replace('/', '_')}_{uuid.uuid4().hex[:8]}.txt"
-        file_path = kb.create_text_file(full_text, filename)
+        file_path = await akb.create_text_file(full_text, filename)
         
         # Добавляем материал в базу знаний
-        material_id = kb.add_material(topic_key, file_path, title, "file")
+        material_id = await akb.add_material(topic_key, file_path, title, "file")
         
         # Отправляем подтверждение
         await update.message.reply_text(f"Материал '{title}' успешно добавлен в подраздел '{subtopic}' раздела '{topic}'! ID: {material_id}")
         
-        # Показываем созданный файл
-        with open(file_path, 'rb') as file:
-            await update.message.reply_document(document=file, caption=title)
+        # Показываем созданный файл и запоминаем его file_id для следующих показов
+        async with akb.open_file(file_path, filename) as file_stream:
+            sent_message = await update.message.reply_document(document=file_stream, caption=title)
+        await akb.set_material_file_id(topic_key, material_id, sent_message.document.file_id, "file")
         
         # Очищаем данные пользователя
         context.user_data.clear()
@@ -700,7 +590,6 @@ async def upload_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Получаем самое большое изображение
         photo = update.message.photo[-1]
         file = await photo.get_file()
-        file_data = await file.download_as_bytearray()
         
         # Определяем раздел и подраздел
         topic = context.user_data.get('topic')
@@ -711,9 +600,13 @@ async def upload_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Сохраняем изображение
         filename = f"{topic_key.replace('/', '_')}_{uuid.uuid4().hex[:8]}.jpg"
-        image_path = kb.save_uploaded_file(file_data, filename, "image")
+        upload = await stream_upload(file, filename, "image")
+        # Уменьшаем и перекодируем изображение перед сохранением в материалы
+        image_path = await akb.process_image(upload.file_path, upload.upload_id)
         
         context.user_data['file_path'] = image_path
+        context.user_data['upload_id'] = upload.upload_id
+        context.user_data['file_id'] = photo.file_id
         await update.message.reply_text("Изображение загружено! Теперь введи подпись:")
         return TYPING_CAPTION
     
@@ -726,7 +619,6 @@ async def upload_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Получаем файл
         document = update.message.document
         file = await document.get_file()
-        file_data = await file.download_as_bytearray()
         
         # Определяем раздел и подраздел
         topic = context.user_data.get('topic')
@@ -737,10 +629,14 @@ async def upload_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Сохраняем файл
         filename = document.file_name or f"{topic_key.replace('/', '_')}_{uuid.uuid4().hex[:8]}"
-        file_path = kb.save_uploaded_file(file_data, filename, "file")
+        upload = await stream_upload(file, filename, "file")
+        file_path = upload.file_path
         
         context.user_data['file_path'] = file_path
+        context.user_data['upload_id'] = upload.upload_id
         context.user_data['file_type'] = "file"
+        context.user_data['file_id'] = document.file_id
+        context.user_data['file_name'] = filename
         await update.message.reply_text("Файл загружен! Теперь введи описание:")
         return TYPING_CAPTION
     
@@ -760,20 +656,37 @@ async def add_file_caption(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     file_path = context.user_data['file_path']
     file_type = context.user_data.get('file_type', 'image')
+    # file_id загруженного файла можно сразу использовать для отправки
+    file_id = context.user_data.get('file_id')
     
     # Добавляем материал в базу знаний
-    material_id = kb.add_material(topic_key, file_path, caption, file_type)
+    material_id = await akb.add_material(
+        topic_key, file_path, caption, file_type,
+        file_id=file_id, filename=context.user_data.get('file_name'), upload_id=context.user_data.get('upload_id')
+    )
+    if material_id is None:
+        # Загрузку освободили как брошенную - файла может уже не быть
+        context.user_data.clear()
+        await update.message.reply_text("Загрузка устарела. Загрузи файл заново.", reply_markup=await set_user_markup(context))
+        return SELECTING_ACTION
     
     # Отправляем подтверждение
     await update.message.reply_text(f"Файл успешно добавлен в подраздел '{subtopic}' раздела '{topic}'! ID: {material_id}")
     
     # Показываем добавленный файл
     if file_type == "image":
-        with open(file_path, 'rb') as photo:
-            await update.message.reply_photo(photo=photo, caption=caption)
+        if file_id:
+            await update.message.reply_photo(photo=file_id, caption=caption)
+        else:
+            async with akb.open_file(file_path) as photo:
+                await update.message.reply_photo(photo=photo, caption=caption)
     else:
-        with open(file_path, 'rb') as file:
-            await update.message.reply_document(document=file, caption=caption)
+        if file_id:
+            await update.message.reply_document(document=file_id, caption=caption)
+        else:
+            filename = context.user_data.get('file_name') or os.path.basename(file_path)
+            async with akb.open_file(file_path, filename) as file_stream:
+                await update.message.reply_document(document=file_stream, caption=caption)
     
     # Очищаем данные пользователя
     context.user_data.clear()
@@ -782,10 +695,13 @@ async def add_file_caption(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена текущей операции"""
-    global current_markup
     
-    current_markup = create_main_keyboard()
-    await update.message.reply_text("Операция отменена.", reply_markup=current_markup)
+    # Загруженный файл без подписи больше не нужен
+    if context.user_data.get('upload_id'):
+        await akb.release_upload(context.user_data['upload_id'])
+    
+    markup = await set_user_markup(context)
+    await update.message.reply_text("Операция отменена.", reply_markup=markup)
     context.user_data.clear()
     return SELECTING_ACTION
 
@@ -803,9 +719,88 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(help_text)
     return SELECTING_ACTION
 
+async def refresh_shared_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подхватывает изменения базы знаний, сделанные другими процессами бота"""
+    await akb.run(akb.kb.refresh_if_stale)
+
+# HTTP-сервер метрик (при METRICS_ENABLED)
+metrics_server = None
+# HTTP-сервер /healthz (в режиме webhook)
+health_server = None
+
+async def warm_up(application):
+    """Строит индекс названий подразделов, извлекает текст вложений и освобождает брошенные загрузки в фоне, не задерживая запуск бота"""
+    global metrics_server, health_server
+    akb.background(akb.run(akb.kb.get_name_index))
+    akb.background(akb.backfill_material_text())
+    akb.background(akb.run(akb.kb.release_stale_uploads))
+    download_client()
+    if config.METRICS_ENABLED:
+        metrics_server = MetricsServer(config.METRICS_LISTEN, config.METRICS_PORT)
+        await metrics_server.start()
+        print(f"Метрики: http://{config.METRICS_LISTEN}:{metrics_server.http.port}/metrics")
+    if config.BOT_MODE == "webhook":
+        health_server = HealthServer(application, config.WEBHOOK_LISTEN, config.WEBHOOK_HEALTH_PORT)
+        await health_server.start()
+
+async def shut_down(application):
+    """Дожидается фоновых задач, останавливает серверы метрик и /healthz, закрывает клиент скачивания файлов и останавливает пул процессов"""
+    # Фоновые задачи пишут в базу знаний и используют пул процессов - не прерываем их на середине
+    await akb.wait_background()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    if health_server is not None:
+        await health_server.stop()
+    await close_download_client()
+    shutdown_process_pool()
+
+def instrument(application, conv_handler):
+    """Включает сбор метрик: время обработчиков и методов базы знаний, объем отправленного, очереди"""
+    instrument_conversation(conv_handler, STATE_NAMES)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if handler is not conv_handler:
+                instrument_handler(handler)
+    instrument_methods(akb.kb, "knowledge_base")
+    instrument_methods(akb.kb.materials_store, "materials_store")
+    instrument_methods(akb.kb.index, "search_index")
+    instrument_outbound(application.bot.rate_limiter)
+    instrument_render_cache(render_cache)
+
 def main():
     """Основная функция запуска бота"""
-    application = Application.builder().token(config.TOKEN).build()
+    if config.BOT_MODE == "multi":
+        # Маршрутизатор сам не обрабатывает обновления - он запускает процессы-обработчики
+        asyncio.run(run_router())
+        return
+    
+    profiler = None
+    if config.PROFILE_ENABLED:
+        # Профили части обновлений и всех медленных - в PROFILE_PATH
+        profiler = UpdateProfiler(config.PROFILE_PATH, config.PROFILE_SAMPLE_RATE, config.PROFILE_SLOW_SECONDS,
+                                  config.PROFILE_MAX_FILES, config.PROFILE_INTERVAL)
+    
+    builder = (
+        Application.builder()
+        .token(config.TOKEN)
+        .base_url(config.BOT_API_BASE_URL)
+        .base_file_url(config.BOT_API_FILE_URL)
+        .post_init(warm_up)
+        .post_shutdown(shut_down)
+        # Разные чаты обрабатываются параллельно, сообщения одного чата - по порядку
+        .concurrent_updates(ChatOrderedUpdateProcessor(config.UPDATE_WORKERS, profiler))
+        # Исходящие запросы проходят через планировщик с учетом ограничений Telegram
+        .rate_limiter(OutboundScheduler(
+            config.OUTBOUND_GLOBAL_RATE, config.OUTBOUND_CHAT_RATE, config.OUTBOUND_CHAT_BURST,
+            config.OUTBOUND_GROUP_RATE, config.OUTBOUND_MAX_RETRIES
+        ))
+    )
+    if config.PROXY_URL:
+        builder.proxy_url(config.PROXY_URL).get_updates_proxy_url(config.PROXY_URL)
+    if config.SHARED_STATE:
+        # Диалоги и user_data хранятся в общей базе, чтобы их видели все процессы
+        builder.persistence(SqlitePersistence(config.STATE_DB))
+    application = builder.build()
     
     # Создаем обработчик диалога
     conv_handler = ConversationHandler(
@@ -860,15 +855,34 @@ def main():
                 CommandHandler('cancel', cancel)
             ]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="main",
+        persistent=config.SHARED_STATE
     )
     
     # Добавляем обработчики
+    if config.SHARED_STATE:
+        # Перед любым обработчиком проверяем, не изменили ли базу знаний другие процессы
+        application.add_handler(TypeHandler(Update, refresh_shared_state), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CallbackQueryHandler(search_more, pattern=r"^sr:\w+:\d+$"))
+    application.add_handler(CallbackQueryHandler(article_page, pattern=r"^pg:\w+:\d+$"))
+    if config.METRICS_ENABLED:
+        instrument(application, conv_handler)
+    if config.PROFILE_ENABLED:
+        # Обработчики отмечают в профиле свое имя и состояние диалога
+        annotate_conversation(conv_handler, STATE_NAMES)
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if handler is not conv_handler:
+                    annotate_handler(handler)
     
     print("Бот запущен...")
-    application.run_polling()
+    if config.BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
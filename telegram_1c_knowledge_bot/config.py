@@ -4,8 +4,93 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TOKEN = os.getenv("BOT_TOKEN")
+# Адрес Bot API (например, локальный сервер Bot API или заглушка для нагрузочных тестов)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+BOT_API_FILE_URL = os.getenv("BOT_API_FILE_URL", "https://api.telegram.org/file/bot")
+# Прокси для запросов к Bot API и скачивания файлов (например, http://host:3128 или socks5://host:1080)
+PROXY_URL = os.getenv("PROXY_URL") or None
 KNOWLEDGE_PATH = "knowledge_base/"
 TEXTS_PATH = os.path.join(KNOWLEDGE_PATH, "texts")
 IMAGES_PATH = os.path.join(KNOWLEDGE_PATH, "images")
 FILES_PATH = os.path.join(KNOWLEDGE_PATH, "files")
-MATERIALS_FILE = os.path.join(KNOWLEDGE_PATH, "materials.json")
\ No newline at end of file
+MATERIALS_FILE = os.path.join(KNOWLEDGE_PATH, "materials.json")
+
+# Бэкенд хранилища материалов: "json" (materials.json) или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+MATERIALS_DB = os.path.join(KNOWLEDGE_PATH, "materials.sqlite3")
+
+# Размер пула потоков для дисковых операций базы знаний
+KB_IO_WORKERS = int(os.getenv("KB_IO_WORKERS", "4"))
+
+# Размер фрагмента при потоковой загрузке файлов от пользователей
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+# Каталог сценариев интеллектуальной системы и период проверки их изменений (секунды)
+SCENARIOS_PATH = os.path.join(KNOWLEDGE_PATH, "scenarios")
+SCENARIOS_RELOAD_INTERVAL = float(os.getenv("SCENARIOS_RELOAD_INTERVAL", "2"))
+
+# Число результатов поиска на одной странице
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+# Наибольшая длина страницы статьи (символов); статьи длиннее отправляются по страницам
+ARTICLE_PAGE_LIMIT = int(os.getenv("ARTICLE_PAGE_LIMIT", "4000"))
+PAGES_PATH = os.path.join(KNOWLEDGE_PATH, "pages")
+
+# Число процессов для тяжелых задач (извлечение текста из вложений)
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", "2"))
+EXTRACTED_PATH = os.path.join(KNOWLEDGE_PATH, "extracted")
+
+# Обработка загруженных изображений: большая сторона, качество JPEG
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2560"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# Сохранять ли исходные изображения (в images/originals)
+KEEP_ORIGINAL_IMAGES = os.getenv("KEEP_ORIGINAL_IMAGES", "false").lower() in ("1", "true", "yes")
+
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Адрес и путь веб-сервера webhook (PTB Application.run_webhook)
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token;
+# обязателен в режимах webhook и multi (1-256 символов A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Внешний адрес бота (https://...), обязателен в режимах webhook и multi
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Порт GET /healthz в режиме webhook
+WEBHOOK_HEALTH_PORT = int(os.getenv("WEBHOOK_HEALTH_PORT", str(WEBHOOK_PORT + 1)))
+
+# Сколько обновлений разных чатов обрабатывается одновременно
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+
+# Ограничения исходящих сообщений (сообщений в секунду): всего, в личный чат, в группу
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+# Сколько раз повторять запрос после ответа 429 (retry_after)
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Общее состояние процессов бота (диалоги, user_data, версия базы знаний) в SQLite
+SHARED_STATE = os.getenv("SHARED_STATE", "false").lower() in ("1", "true", "yes")
+STATE_DB = os.path.join(KNOWLEDGE_PATH, "state.sqlite3")
+# Режим BOT_MODE=multi: число процессов-обработчиков и их внутренние порты (WORKER_BASE_PORT + номер)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "2"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8500"))
+# Номер процесса-обработчика, назначается маршрутизатором
+WORKER_ID = os.getenv("WORKER_ID")
+
+# Метрики в формате Prometheus на локальном HTTP-сервере (GET /metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Профилирование обработки обновлений: доля профилируемых cProfile обновлений,
+# порог медленного обновления (секунды, 0 - не отслеживать), каталог и число хранимых профилей
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "1.0"))
+PROFILE_PATH = os.getenv("PROFILE_PATH", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+# Период сэмплирования стеков для медленных обновлений (секунды); сэмплер работает,
+# только пока какое-то обновление обрабатывается дольше половины PROFILE_SLOW_SECONDS
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.02"))
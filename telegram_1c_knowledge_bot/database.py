@@ -1,40 +1,199 @@
 import os
-import re
+import glob
 import json
+import time
 import uuid
 import shutil
+import hashlib
+import functools
+
+import config
+from blob_store import BlobStore
+from extraction import ExtractedTextCache, file_digest, is_extractable
+from name_index import SubtopicNameIndex
+from pages import ArticlePages
+from search_index import SearchIndex
+from shared_state import FileLock, SharedVersion
+from storage import create_store, get_json_store, material_kind
+
+class UploadWriter:
+    """Потоковая запись загружаемого файла.
+
+    Данные пишутся во временный файл в каталоге хранилища и хэшируются по
+    мере записи; commit атомарно переносит файл в хранилище под именем,
+    равным его sha256.
+    """
+    
+    def __init__(self, blob_store, ext=""):
+        self.blob_store = blob_store
+        self.ext = ext
+        self.file_path = None
+        # id ожидающей загрузки (KnowledgeBase.commit_upload)
+        self.upload_id = None
+        self.tmp_path = blob_store.temp_path()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._file = open(self.tmp_path, 'wb')
+    
+    def write(self, chunk):
+        """Дописывает очередной фрагмент файла"""
+        self._file.write(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+    
+    def commit(self):
+        """Сохраняет файл на диск и переносит его в хранилище"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self.file_path = self.blob_store.put_file(self.tmp_path, self.sha256.hexdigest(), self.ext)
+        return self.file_path
+    
+    def abort(self):
+        """Прерывает загрузку и удаляет временный файл"""
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def synchronized(method):
+    """Выполняет метод KnowledgeBase под блокировкой записи (общей для процессов бота)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class KnowledgeBase:
-    def __init__(self, texts_path, images_path, files_path, materials_file):
+    # Ограничения страницы результатов поиска (одно сообщение Telegram)
+    SEARCH_MESSAGE_LIMIT = 4000
+    SEARCH_SNIPPET_LINES = 3
+    SEARCH_SNIPPET_LENGTH = 200
+    # Сколько лучших результатов поиска запоминается для листания
+    SEARCH_RESULTS_LIMIT = 50
+    # Не чаще чем раз в столько секунд поиск проверяет, не изменились ли файлы на диске
+    INDEX_CHECK_INTERVAL = 5
+    # Страница пустой статьи: Telegram не принимает сообщения без текста
+    EMPTY_ARTICLE_TEXT = "Текст подраздела пока не заполнен."
+    # Через сколько секунд брошенная загрузка освобождается при запуске бота
+    PENDING_UPLOAD_MAX_AGE = 24 * 3600
+
+    def __init__(self, texts_path, images_path, files_path, materials_file, index_file=None, materials_store=None,
+                 manifest_file=None, extracted_path=None, shared_version=None, pages_path=None):
         self.texts_path = texts_path
+        # Изменения разделов, материалов и индексов выполняются из пула потоков,
+        # параллельных обработчиков и других процессов бота (BOT_MODE=multi) -
+        # сериализуем их (read-modify-write) блокировкой на файле рядом с базой
+        data_path = os.path.dirname(os.path.abspath(materials_file))
+        os.makedirs(data_path, exist_ok=True)
+        self.write_lock = FileLock(os.path.join(data_path, "knowledge_base.lock"))
         self.images_path = images_path
         self.files_path = files_path
         self.materials_file = materials_file
+        self.index_file = index_file or os.path.join(os.path.dirname(materials_file), "search_index.sqlite3")
+        self.materials_store = materials_store or get_json_store(materials_file)
+        self.manifest_file = manifest_file or os.path.join(os.path.dirname(materials_file), "topics_manifest.json")
+        self.manifest = {}
         self.topics = self.load_topics()
+        # Индекс названий подразделов строится при первом обращении
+        self.name_index = None
+        # Версия базы знаний: увеличивается при каждом изменении разделов,
+        # подразделов и материалов, по ней сбрасываются кэши отображения
+        self.version = 0
+        # Общая для процессов версия (SharedVersion) и ее значение, изменения
+        # до которого уже учтены в этом процессе
+        self.shared_version = shared_version
+        self.synced_version = shared_version.get() if shared_version else None
         
         # Создаем необходимые директории
         os.makedirs(texts_path, exist_ok=True)
         os.makedirs(images_path, exist_ok=True)
         os.makedirs(files_path, exist_ok=True)
         
+        # Загруженные изображения и файлы хранятся по sha256 содержимого
+        self.image_blobs = BlobStore(images_path)
+        self.file_blobs = BlobStore(files_path)
+        # Текст, извлеченный из вложений, по sha256 файла
+        self.extracted_text = ExtractedTextCache(
+            extracted_path or os.path.join(os.path.dirname(materials_file), "extracted")
+        )
+        
         # Инициализируем файл материалов
         self.load_materials()
+        
+        # Статьи, заранее разбитые на страницы размером с сообщение Telegram
+        self.pages = ArticlePages(
+            pages_path or os.path.join(os.path.dirname(materials_file), "pages"), config.ARTICLE_PAGE_LIMIT
+        )
+        
+        # Загружаем поисковый индекс; изменившиеся файлы доиндексируются
+        # при первой загрузке подразделов раздела и перед поиском
+        self.index = SearchIndex(self.index_file)
+        self.index_synced = False
+        self.index_checked_at = 0.0
+    
+    def load_manifest(self):
+        """Читает кэшированный манифест структуры разделов"""
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {"root_mtime": None, "topics": {}}
+        if not isinstance(manifest.get("topics"), dict):
+            return {"root_mtime": None, "topics": {}}
+        return manifest
+    
+    @synchronized
+    def save_manifest(self, topics=None):
+        """Атомарно сохраняет манифест структуры разделов.
+
+        topics - разделы, записи которых изменились: остальные записи берутся
+        из файла, чтобы не затереть изменения других процессов бота. Без topics
+        манифест сохраняется целиком.
+        """
+        if topics is not None:
+            manifest = self.load_manifest()
+            for topic in topics:
+                manifest["topics"][topic] = self.manifest["topics"][topic]
+            self.manifest = manifest
+        tmp_path = f"{self.manifest_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_file)
+        except OSError:
+            # Манифест - только кэш, без него разделы читаются с диска
+            pass
     
+    @synchronized
     def load_topics(self):
-        """Загружает темы и подтемы из структуры папок"""
+        """Загружает список разделов из манифеста, проверяя его по mtime папки texts.
+
+        Подразделы не читаются: они загружаются при первом обращении к разделу.
+        """
+        self.manifest = self.load_manifest()
         topics = {}
-        if os.path.exists(self.texts_path):
-            for root, dirs, files in os.walk(self.texts_path):
-                # Определяем уровень вложенности
-                rel_path = os.path.relpath(root, self.texts_path)
-                
-                if rel_path == '.':
-                    # Корневой уровень - здесь будут только подразделы
-                    for dir_name in dirs:
-                        topics[dir_name] = {
-                            'path': os.path.join(root, dir_name),
-                            'subtopics': self.load_subtopics(os.path.join(root, dir_name))
-                        }
+        try:
+            root_mtime = os.stat(self.texts_path).st_mtime_ns
+        except OSError:
+            return topics
+        
+        if self.manifest["root_mtime"] != root_mtime:
+            # Набор разделов изменился - перечитываем корневую папку
+            topic_names = sorted(entry.name for entry in os.scandir(self.texts_path) if entry.is_dir())
+            self.manifest["topics"] = {
+                name: self.manifest["topics"].get(name, {"mtime": None, "files": []})
+                for name in topic_names
+            }
+            self.manifest["root_mtime"] = root_mtime
+            self.save_manifest()
+        
+        for topic_name in self.manifest["topics"]:
+            topics[topic_name] = {
+                'path': os.path.join(self.texts_path, topic_name),
+                'subtopics': None
+            }
         return topics
     
     def load_subtopics(self, topic_path):
@@ -49,20 +208,65 @@ class KnowledgeBase:
                     }
         return subtopics
     
+    def get_topic_subtopics(self, topic):
+        """Возвращает словарь подразделов раздела, загружая его при первом обращении"""
+        topic_info = self.topics[topic]
+        if topic_info['subtopics'] is not None:
+            return topic_info['subtopics']
+        with self.write_lock:
+            if topic_info['subtopics'] is not None:
+                return topic_info['subtopics']
+            return self._load_topic_subtopics(topic)
+    
+    def _topic_files(self, topic):
+        """Возвращает имена файлов подразделов раздела из манифеста, перечитывая папку при ее изменении.
+
+        Файлы не читаются и не индексируются - достаточно одного stat папки.
+        """
+        topic_path = self.topics[topic]['path']
+        entry = self.manifest["topics"].setdefault(topic, {"mtime": None, "files": []})
+        try:
+            mtime = os.stat(topic_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        
+        if mtime is None or entry["mtime"] != mtime:
+            entry["mtime"] = mtime
+            entry["files"] = [os.path.basename(info['path']) for info in self.load_subtopics(topic_path).values()]
+            self.save_manifest([topic])
+        return entry["files"]
+    
+    def _load_topic_subtopics(self, topic):
+        """Загружает подразделы раздела по манифесту и доиндексирует их"""
+        topic_info = self.topics[topic]
+        topic_info['subtopics'] = {
+            file_name.replace('.txt', ''): {'path': os.path.join(topic_info['path'], file_name)}
+            for file_name in self._topic_files(topic)
+        }
+        self.sync_topic_index(topic)
+        return topic_info['subtopics']
+    
+    def refresh_topic_manifest(self, topic):
+        """Обновляет запись манифеста после изменения папки раздела"""
+        topic_info = self.topics[topic]
+        try:
+            mtime = os.stat(topic_info['path']).st_mtime_ns
+        except OSError:
+            return
+        self.manifest["topics"][topic] = {
+            "mtime": mtime,
+            "files": [os.path.basename(info['path']) for info in self.load_subtopics(topic_info['path']).values()]
+        }
+        self.save_manifest([topic])
+    
     def load_materials(self):
-        """Загружает материалы из JSON файла"""
-        if os.path.exists(self.materials_file):
-            try:
-                with open(self.materials_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+        """Возвращает копию всех материалов"""
+        return self.materials_store.all()
     
+    @synchronized
     def save_materials(self, materials):
         """Сохраняет материалы в JSON файл"""
-        with open(self.materials_file, 'w', encoding='utf-8') as f:
-            json.dump(materials, f, ensure_ascii=False, indent=2)
+        self.materials_store.save(materials)
     
     def get_topics(self):
         """Возвращает список основных разделов"""
@@ -71,15 +275,91 @@ class KnowledgeBase:
     def get_subtopics(self, topic):
         """Возвращает подразделы для указанного раздела"""
         if topic in self.topics:
-            return list(self.topics[topic]['subtopics'].keys())
+            return list(self.get_topic_subtopics(topic).keys())
         return []
     
+    def bump_version(self):
+        """Отмечает изменение базы знаний (и сообщает о нем другим процессам)"""
+        self.version += 1
+        if self.shared_version is not None:
+            previous, current = self.shared_version.bump()
+            # Если до нас версию меняли другие процессы, их изменения еще не учтены -
+            # оставляем прежнее значение, чтобы refresh_if_stale перечитал базу
+            if previous == self.synced_version:
+                self.synced_version = current
+    
+    def refresh_if_stale(self):
+        """Перечитывает базу знаний, если ее изменил другой процесс"""
+        if self.shared_version is None:
+            return False
+        current = self.shared_version.get()
+        if current == self.synced_version:
+            return False
+        with self.write_lock:
+            self.reload()
+            self.synced_version = current
+        return True
+    
+    @synchronized
+    def reload(self):
+        """Перечитывает структуру разделов и поисковый индекс с диска"""
+        self.topics = self.load_topics()
+        self.name_index = None
+        self.index_synced = False
+        # Индекс названий строим здесь, а не при первом обращении из цикла событий
+        self.get_name_index()
+        self.version += 1
+    
+    def has_topic(self, topic):
+        """Проверяет, существует ли раздел"""
+        return topic in self.topics
+    
+    def get_name_index(self):
+        """Возвращает индекс названий подразделов, строя его при первом обращении.
+
+        Названия берутся из манифеста, поэтому подразделы разделов при этом не
+        загружаются и не индексируются.
+        """
+        if self.name_index is None:
+            with self.write_lock:
+                if self.name_index is None:
+                    name_index = SubtopicNameIndex()
+                    for topic, topic_info in list(self.topics.items()):
+                        name_index.add_topic(topic)
+                        if topic_info['subtopics'] is not None:
+                            subtopics = list(topic_info['subtopics'])
+                        else:
+                            subtopics = [file_name.replace('.txt', '') for file_name in self._topic_files(topic)]
+                        for subtopic in subtopics:
+                            name_index.add(topic, subtopic)
+                    self.name_index = name_index
+        return self.name_index
+    
+    def get_visible_subtopics(self, topic):
+        """Возвращает подразделы раздела без служебного файла _description"""
+        return self.get_name_index().subtopics(topic)
+    
+    def find_subtopic(self, name, topic=None):
+        """Ищет подраздел по названию без учета регистра и пробелов.
+
+        Возвращает (раздел, подраздел) или None.
+        """
+        return self.get_name_index().find(name, topic)
+    
+    def find_subtopics(self, query):
+        """Ищет подразделы, в названии которых встречаются слова запроса, а при их отсутствии - похожие"""
+        name_index = self.get_name_index()
+        return name_index.find_partial(query) or name_index.find_similar(query)
+    
     def get_subtopic_path(self, topic, subtopic):
         """Возвращает путь к файлу подраздела"""
-        if topic in self.topics and subtopic in self.topics[topic]['subtopics']:
-            return self.topics[topic]['subtopics'][subtopic]['path']
+        if topic in self.topics:
+            subtopic_info = self.get_topic_subtopics(topic).get(subtopic)
+            if subtopic_info:
+                return subtopic_info['path']
         return None
     
+    @synchronized
     def add_topic(self, topic_name):
         """Добавляет новый раздел"""
         # Создаем папку для раздела
@@ -97,8 +377,20 @@ class KnowledgeBase:
             'subtopics': {}
         }
         
+        # Обновляем манифест
+        self.refresh_topic_manifest(topic_name)
+        try:
+            self.manifest["root_mtime"] = os.stat(self.texts_path).st_mtime_ns
+        except OSError:
+            self.manifest["root_mtime"] = None
+        self.save_manifest()
+        if self.name_index is not None:
+            self.name_index.add_topic(topic_name)
+        self.bump_version()
+        
         return True
     
+    @synchronized
     def add_subtopic(self, topic, subtopic_name):
         """Добавляет новый подраздел"""
         if topic not in self.topics:
@@ -112,9 +404,17 @@ class KnowledgeBase:
             f.write(f"# {subtopic_name}\n\nОписание подраздела {subtopic_name}.")
         
         # Обновляем структуру тем
-        self.topics[topic]['subtopics'][subtopic_name] = {
+        self.get_topic_subtopics(topic)[subtopic_name] = {
             'path': filepath
         }
+        self.refresh_topic_manifest(topic)
+        if self.name_index is not None:
+            self.name_index.add(topic, subtopic_name)
+        self.bump_version()
+        
+        # Добавляем подраздел в поисковый индекс и разбиваем его на страницы
+        self.index.add_document(filepath, filepath, f"{topic}/{subtopic_name}")
+        self.pages.build(filepath)
         
         return True
     
@@ -128,171 +428,438 @@ class KnowledgeBase:
         return "Описание раздела отсутствует."
     
     def get_content(self, topic, subtopic):
-        """Получает содержимое подраздела"""
+        """Получает содержимое подраздела: первую страницу текста, число страниц и материалы"""
         filepath = self.get_subtopic_path(topic, subtopic)
         
         if not filepath or not os.path.exists(filepath):
             return {"text": "Подраздел не найден", "images": [], "files": []}
         
-        try:
-            # Читаем текст
-            with open(filepath, 'r', encoding='utf-8') as file:
-                text_content = file.read()
-            
-            # Формируем ключ для материалов
-            material_key = f"{topic}/{subtopic}"
-            
-            # Получаем связанные изображения и файлы
-            images = self.get_images_for_topic(material_key)
-            files = self.get_files_for_topic(material_key)
-            
-            return {"text": text_content, "images": images, "files": files}
-        except FileNotFoundError:
+        # Страницы текста берем из кэша (файл разбивается, только если изменился)
+        article = self.pages.pages_for(filepath)
+        if article is None:
             return {"text": "Файл с знаниями не найден", "images": [], "files": []}
+        
+        # Формируем ключ для материалов
+        material_key = f"{topic}/{subtopic}"
+        
+        # Получаем связанные изображения и файлы
+        images = self.get_images_for_topic(material_key)
+        files = self.get_files_for_topic(material_key)
+        
+        pages = self.article_texts(article)
+        return {"text": pages[0], "page_count": len(pages),
+                "article_id": self.pages.article_id(filepath),
+                "images": images, "files": files, "topic_key": material_key}
+    
+    def article_texts(self, article):
+        """Страницы статьи; у пустой статьи - одна страница-заглушка"""
+        pages = article["pages"]
+        # Старые записи кэша хранили пустую статью как [""]
+        if not pages or not pages[0].strip():
+            return [self.EMPTY_ARTICLE_TEXT]
+        return pages
+    
+    def get_article_page(self, article_id, number):
+        """Возвращает (текст страницы, число страниц) статьи из кэша страниц или None.
+
+        Номер страницы начинается с 1; если статья с тех пор сократилась,
+        отдается последняя страница.
+        """
+        article = self.pages.get(article_id)
+        if article is None:
+            return None
+        pages = self.article_texts(article)
+        number = min(max(number, 1), len(pages))
+        return pages[number - 1], len(pages)
     
     def get_images_for_topic(self, topic_key):
         """Возвращает изображения для указанного раздела"""
-        materials = self.load_materials()
-        return materials.get(topic_key, {}).get("images", [])
+        return self.materials_store.get_topic(topic_key).get("images", [])
     
     def get_files_for_topic(self, topic_key):
         """Возвращает файлы для указанного раздела"""
-        materials = self.load_materials()
-        return materials.get(topic_key, {}).get("files", [])
+        return self.materials_store.get_topic(topic_key).get("files", [])
     
-    def add_material(self, topic_key, file_path, caption, material_type="image"):
-        """Добавляет новый материал"""
-        materials = self.load_materials()
-        
-        if topic_key not in materials:
-            materials[topic_key] = {"images": [], "files": []}
+    @synchronized
+    def add_material(self, topic_key, file_path, caption, material_type="image", file_id=None, filename=None,
+                     upload_id=None):
+        """Добавляет новый материал.
         
+        upload_id - ожидающая загрузка файла: ее ссылка на файл переходит к
+        материалу. Если загрузку уже освободили, материал не создается и
+        возвращается None.
+        """
+        kind = material_kind(material_type)
+        if upload_id and self.materials_store.get_pending(upload_id) is None:
+            return None
         material_id = str(uuid.uuid4())
         
-        if material_type == "image":
-            materials[topic_key]["images"].append({
-                "id": material_id,
-                "path": file_path,
-                "caption": caption
-            })
-        else:
-            materials[topic_key]["files"].append({
-                "id": material_id,
-                "path": file_path,
-                "caption": caption,
-                "type": material_type
-            })
-        
-        self.save_materials(materials)
+        material = {
+            "id": material_id,
+            "path": file_path,
+            "caption": caption
+        }
+        if material_type != "image":
+            material["type"] = material_type
+        # file_id от Telegram позволяет отправлять материал без повторной загрузки
+        if file_id:
+            material["file_id"] = file_id
+        # Исходное имя файла (в хранилище файл назван по sha256)
+        if filename:
+            material["filename"] = filename
+        
+        self.materials_store.add(topic_key, kind, material)
+        if upload_id:
+            self.materials_store.delete_pending(upload_id)
+        self.bump_version()
         return material_id
     
+    @synchronized
     def update_material(self, topic_key, material_id, new_caption=None, new_file_path=None, material_type="image"):
         """Обновляет существующий материал"""
-        materials = self.load_materials()
+        kind = material_kind(material_type)
+        material = self.materials_store.get(topic_key, material_id, kind)
         
-        if topic_key not in materials:
+        if material is None:
             return False
         
-        material_list = materials[topic_key]["images"] if material_type == "image" else materials[topic_key]["files"]
-        
-        for material in material_list:
-            if material["id"] == material_id:
-                if new_caption:
-                    material["caption"] = new_caption
-                if new_file_path:
-                    # Удаляем старый файл
-                    if os.path.exists(material["path"]):
-                        os.remove(material["path"])
-                    material["path"] = new_file_path
-                
-                self.save_materials(materials)
-                return True
+        old_path = material["path"]
+        changes = {}
+        if new_caption:
+            changes["caption"] = new_caption
+        if new_file_path:
+            changes["path"] = new_file_path
+            # Старый file_id относится к прежнему файлу
+            changes["file_id"] = None
         
-        return False
+        if not self.materials_store.update(topic_key, material_id, kind, changes):
+            return False
+        self.bump_version()
+        
+        # Удаляем старый файл, если на него больше никто не ссылается
+        if new_file_path:
+            self.release_file(old_path)
+        return True
     
+    @synchronized
     def delete_material(self, topic_key, material_id, material_type="image"):
         """Удаляет материал"""
-        materials = self.load_materials()
+        material = self.materials_store.delete(topic_key, material_id, material_kind(material_type))
         
-        if topic_key not in materials:
+        if material is None:
             return False
+        self.bump_version()
+        self.remove_material_text(material_id)
         
-        material_list = materials[topic_key]["images"] if material_type == "image" else materials[topic_key]["files"]
-        
-        for i, material in enumerate(material_list):
-            if material["id"] == material_id:
-                # Удаляем файл
-                if os.path.exists(material["path"]):
-                    os.remove(material["path"])
-                # Удаляем запись
-                del material_list[i]
-                
-                # Если раздел пуст, удаляем его
-                if not materials[topic_key]["images"] and not materials[topic_key]["files"]:
-                    del materials[topic_key]
-                
-                self.save_materials(materials)
-                return True
+        # Удаляем файл, если на него больше никто не ссылается
+        self.release_file(material["path"])
         
-        return False
+        return True
     
-    def get_material(self, topic_key, material_id, material_type="image"):
-        """Возвращает материал по ID"""
-        materials = self.load_materials()
-        
-        if topic_key not in materials:
-            return None
+    def release_file(self, file_path):
+        """Удаляет файл материала, если это была последняя ссылка на него"""
+        if self.materials_store.count_path_references(file_path) > 0:
+            return False
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self.release_image_variants(file_path)
+        return True
+    
+    def image_variant_path(self, image_path, variant, ext=".jpg"):
+        """Путь к производному файлу изображения (исходнику) по sha256 обработанного файла"""
+        digest = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.images_path, variant, f"{digest}{ext.lower()}")
+    
+    def release_image_variants(self, image_path):
+        """Удаляет сохраненный исходник обработанного изображения"""
+        if os.path.dirname(os.path.abspath(image_path)) != os.path.abspath(self.images_path):
+            return
+        for original_path in glob.glob(glob.escape(self.image_variant_path(image_path, "originals", "")) + ".*"):
+            os.remove(original_path)
+    
+    @synchronized
+    def store_processed_image(self, source_path, image_tmp, keep_original=False, upload_id=None):
+        """Переносит обработанное изображение в хранилище.
         
-        material_list = materials[topic_key]["images"] if material_type == "image" else materials[topic_key]["files"]
+        Ожидающая загрузка upload_id начинает ссылаться на обработанное
+        изображение. Исходный файл сохраняется в images/originals только при
+        keep_original, иначе удаляется, если на него больше никто не ссылается.
+        Возвращает путь к обработанному изображению.
+        """
+        image_path = self.image_blobs.put_temp(image_tmp, ".jpg")
         
-        for material in material_list:
-            if material["id"] == material_id:
-                return material
+        if source_path != image_path:
+            if keep_original:
+                original_path = self.image_variant_path(image_path, "originals", os.path.splitext(source_path)[1])
+                os.makedirs(os.path.dirname(original_path), exist_ok=True)
+                if not os.path.exists(original_path):
+                    shutil.copyfile(source_path, original_path)
+            if upload_id:
+                self.materials_store.update_pending(upload_id, {"path": image_path})
+            self.release_file(source_path)
+        return image_path
+    
+    def material_source_path(self, path):
+        """Путь к файлу материала в текущей ОС (старые записи содержат разделители Windows)"""
+        if not os.path.exists(path) and '\\' in path:
+            return path.replace('\\', os.sep)
+        return path
+    
+    def material_text_doc_id(self, material_id):
+        """Идентификатор документа поискового индекса с текстом вложения"""
+        return f"material:{material_id}"
+    
+    def material_text_label(self, topic_key, material):
+        """Название документа с текстом вложения в результатах поиска"""
+        return f"{topic_key}: {material.get('caption') or os.path.basename(material['path'])}"
+    
+    def prepare_material_text(self, topic_key, material_id, material_type="file"):
+        """Готовит извлечение текста вложения.
         
-        return None
+        Возвращает (путь к файлу, sha256, путь к готовому тексту или None)
+        либо None, если текст из такого материала не извлекается.
+        """
+        material = self.get_material(topic_key, material_id, material_type)
+        if material is None:
+            return None
+        source_path = self.material_source_path(material["path"])
+        if not is_extractable(source_path) or not os.path.exists(source_path):
+            return None
+        # Текстовые материалы, созданные в боте, индексируются create_text_file
+        if self.index.has_document(source_path):
+            return None
+        digest = file_digest(source_path)
+        return source_path, digest, self.extracted_text.get(digest)
+    
+    @synchronized
+    def index_material_text(self, topic_key, material_id, text_path, material_type="file"):
+        """Добавляет извлеченный текст вложения в поисковый индекс"""
+        material = self.get_material(topic_key, material_id, material_type)
+        if material is None:
+            return False
+        self.index.add_document(self.material_text_doc_id(material_id), text_path,
+                                self.material_text_label(topic_key, material))
+        return True
+    
+    @synchronized
+    def remove_material_text(self, material_id):
+        """Удаляет текст вложения из поискового индекса"""
+        self.index.remove_document(self.material_text_doc_id(material_id))
     
+    def materials_without_text(self):
+        """Возвращает (ключ подраздела, id) вложений, текст которых еще не попал в индекс"""
+        pending = []
+        for topic_key, topic in self.materials_store.all().items():
+            for material in topic.get("files", []):
+                if self.index.has_document(self.material_text_doc_id(material["id"])) or \
+                        self.index.has_document(material["path"]):
+                    continue
+                if is_extractable(material["path"]):
+                    pending.append((topic_key, material["id"]))
+        return pending
+    
+    @synchronized
+    def set_material_file_id(self, topic_key, material_id, file_id, material_type="image"):
+        """Запоминает file_id, выданный Telegram при отправке материала"""
+        return self.materials_store.update(topic_key, material_id, material_kind(material_type), {"file_id": file_id})
+    
+    def get_material(self, topic_key, material_id, material_type="image"):
+        """Возвращает материал по ID"""
+        return self.materials_store.get(topic_key, material_id, material_kind(material_type))
+    
+    @synchronized
     def create_text_file(self, text, filename):
         """Создает текстовый файл"""
         file_path = os.path.join(self.files_path, filename)
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(text)
+        
+        # Добавляем материал в поисковый индекс
+        self.index.add_document(file_path, file_path, filename)
         return file_path
     
+    @synchronized
     def save_uploaded_file(self, file_data, filename, file_type="image"):
-        """Сохраняет загруженный файл"""
-        if file_type == "image":
-            save_path = self.images_path
-        else:
-            save_path = self.files_path
-        
-        file_path = os.path.join(save_path, filename)
-        with open(file_path, 'wb') as f:
-            f.write(file_data)
-        return file_path
+        """Сохраняет загруженный файл; одинаковые файлы хранятся в одном экземпляре"""
+        blob_store = self.image_blobs if file_type == "image" else self.file_blobs
+        return blob_store.put_bytes(bytes(file_data), os.path.splitext(filename)[1])
     
-    def search(self, query):
-        """Поиск по всем файлам базы знаний"""
-        results = []
+    def open_upload(self, filename, file_type="image"):
+        """Открывает потоковую запись загружаемого файла"""
+        blob_store = self.image_blobs if file_type == "image" else self.file_blobs
+        return UploadWriter(blob_store, os.path.splitext(filename)[1])
+    
+    @synchronized
+    def commit_upload(self, writer, file_type="image"):
+        """Переносит загруженный файл в хранилище и записывает ожидающую загрузку.
+        
+        До добавления подписи файл не принадлежит ни одному материалу; запись
+        загрузки держит ссылку на него, чтобы удаление материала с тем же
+        содержимым не удалило файл. Возвращает id загрузки.
+        """
+        file_path = writer.commit()
+        writer.upload_id = str(uuid.uuid4())
+        self.materials_store.add_pending(
+            {"id": writer.upload_id, "path": file_path, "type": file_type, "created": time.time()}
+        )
+        return writer.upload_id
+    
+    @synchronized
+    def release_upload(self, upload_id):
+        """Отменяет ожидающую загрузку и удаляет ее файл, если на него больше никто не ссылается"""
+        upload = self.materials_store.delete_pending(upload_id)
+        if upload is None:
+            return False
+        self.release_file(upload["path"])
+        return True
+    
+    @synchronized
+    def release_stale_uploads(self, max_age=None):
+        """Освобождает загрузки, брошенные без подписи и без /cancel; возвращает их число"""
+        cutoff = time.time() - (max_age if max_age is not None else self.PENDING_UPLOAD_MAX_AGE)
+        released = 0
+        for upload in self.materials_store.pending_uploads():
+            if upload.get("created", 0) < cutoff:
+                self.materials_store.delete_pending(upload["id"])
+                self.release_file(upload["path"])
+                released += 1
+        return released
+    
+    @synchronized
+    def sync_topic_index(self, topic):
+        """Доиндексирует новые и изменившиеся файлы подразделов раздела"""
+        for subtopic, subtopic_info in self.topics[topic]['subtopics'].items():
+            filepath = subtopic_info['path']
+            label = f"{topic}/{subtopic}"
+            indexed = self.index.get_document(filepath)
+            if not indexed or indexed["label"] != label or not self.index.is_fresh(filepath, filepath):
+                self.index.add_document(filepath, filepath, label)
+                # Файл новый или изменился - заново разбиваем его на страницы
+                self.pages.build(filepath)
+    
+    @synchronized
+    def sync_index(self):
+        """Загружает все разделы, доиндексирует изменившиеся файлы и удаляет из индекса исчезнувшие"""
         for topic in self.topics:
-            for subtopic in self.topics[topic]['subtopics']:
-                filepath = self.get_subtopic_path(topic, subtopic)
-                if filepath and os.path.exists(filepath):
-                    with open(filepath, 'r', encoding='utf-8') as file:
-                        content = file.read()
-                        if re.search(query, content, re.IGNORECASE):
-                            results.append(f"Найдено в {topic}/{subtopic}:")
-                            lines = content.split('\n')
-                            for line in lines:
-                                if re.search(query, line, re.IGNORECASE):
-                                    results.append(f"• {line}")
-                            results.append("")
-        
-        return "\n".join(results) if results else "Ничего не найдено"
+            self.get_topic_subtopics(topic)
+        
+        # Текст вложений: названия документов по текущим подписям материалов
+        material_labels = {}
+        for topic_key, topic in self.materials_store.all().items():
+            for material in topic.get("files", []):
+                material_labels[self.material_text_doc_id(material["id"])] = \
+                    self.material_text_label(topic_key, material)
+        material_prefix = self.material_text_doc_id("")
+        
+        # Удаленные подразделы и материалы, текст вложений и текстовые материалы,
+        # созданные через create_text_file
+        for doc_id, path, label in self.index.documents():
+            if doc_id.startswith(material_prefix):
+                # Материал удален (например, другим процессом) или его текст пропал из кэша -
+                # текст оставшегося материала заново извлечет backfill_material_text
+                if doc_id not in material_labels or not os.path.exists(path):
+                    self.index.remove_document(doc_id)
+                elif material_labels[doc_id] != label or not self.index.is_fresh(doc_id, path):
+                    self.index.add_document(doc_id, path, material_labels[doc_id])
+            elif not os.path.exists(path):
+                self.index.remove_document(doc_id)
+                self.pages.remove(path)
+            elif not self.index.is_fresh(doc_id, path):
+                # Подраздел или текстовый файл отредактировали на диске после индексации
+                self.index.add_document(doc_id, path, label)
+        
+        self.index_synced = True
+        self.index_checked_at = time.monotonic()
+    
+    def refresh_document(self, doc_id):
+        """Переиндексирует документ, если его файл изменился после индексации.
+
+        Возвращает True, если документ был устаревшим (переиндексирован или
+        удален вместе с файлом).
+        """
+        doc = self.index.get_document(doc_id)
+        if doc is None or self.index.is_fresh(doc_id, doc["path"]):
+            return False
+        with self.write_lock:
+            doc = self.index.get_document(doc_id)
+            if doc is None or self.index.is_fresh(doc_id, doc["path"]):
+                # Документ уже обновил другой поток или процесс
+                return True
+            if os.path.exists(doc["path"]):
+                self.index.add_document(doc_id, doc["path"], doc["label"])
+            else:
+                self.index.remove_document(doc_id)
+                self.pages.remove(doc["path"])
+        return True
+    
+    def search(self, query):
+        """Поиск по всем файлам базы знаний с ранжированием по BM25.
+
+        Возвращает снимок результатов [[doc_id, номера найденных строк], ...]
+        по убыванию оценки (не более SEARCH_RESULTS_LIMIT). Страницы
+        показываются по снимку через search_page, поэтому изменения индекса
+        между страницами не пропускают и не повторяют результаты.
+        """
+        if not self.index_synced or time.monotonic() - self.index_checked_at > self.INDEX_CHECK_INTERVAL:
+            self.sync_index()
+        ranked = self.index.ranked(query, self.SEARCH_RESULTS_LIMIT)
+        # Найденные файлы могли измениться после последней проверки - иначе
+        # номера строк указывали бы на старое содержимое
+        if any([self.refresh_document(doc_id) for doc_id, _, _ in ranked]):
+            ranked = self.index.ranked(query, self.SEARCH_RESULTS_LIMIT)
+        return [
+            [doc_id, sorted(line_numbers)[:self.SEARCH_SNIPPET_LINES]]
+            for doc_id, _, line_numbers in ranked
+        ]
+    
+    def search_page(self, results, offset=0, limit=10):
+        """Формирует страницу результатов поиска из снимка search, начиная с результата offset.
+
+        Возвращает (текст, offset следующей страницы или None); если показать
+        нечего - (None, None). Страница ограничена limit результатами и
+        размером сообщения Telegram; удаленные после поиска документы
+        пропускаются, а для измененных вместо строк снимка (они указывают на
+        старое содержимое) выводится просьба повторить поиск.
+        """
+        lines = []
+        length = 0
+        shown = 0
+        position = offset
+        while position < len(results) and shown < limit:
+            doc_id, line_numbers = results[position]
+            changed = self.refresh_document(doc_id)
+            doc = self.index.get_document(doc_id)
+            if doc is not None:
+                block = [f"Найдено в {doc['label']}:"]
+                if changed:
+                    block.append("• Текст изменился после поиска - повтори поиск, чтобы увидеть совпадения")
+                else:
+                    for line in self.index.read_lines(doc_id, line_numbers, self.SEARCH_SNIPPET_LINES):
+                        if len(line) > self.SEARCH_SNIPPET_LENGTH:
+                            line = line[:self.SEARCH_SNIPPET_LENGTH] + "…"
+                        block.append(f"• {line}")
+                block.append("")
+                block_length = sum(len(line) + 1 for line in block)
+                if lines and length + block_length > self.SEARCH_MESSAGE_LIMIT:
+                    break
+                lines.extend(block)
+                length += block_length
+                shown += 1
+            position += 1
+        
+        if not lines:
+            return None, None
+        return "\n".join(lines), (position if position < len(results) else None)
 
 # Инициализация базы знаний
 kb = KnowledgeBase(
     "knowledge_base/texts", 
     "knowledge_base/images", 
     "knowledge_base/files", 
-    "knowledge_base/materials.json"
+    "knowledge_base/materials.json",
+    "knowledge_base/search_index.sqlite3",
+    create_store(config.STORAGE_BACKEND, config.MATERIALS_FILE, config.MATERIALS_DB),
+    extracted_path=config.EXTRACTED_PATH,
+    pages_path=config.PAGES_PATH,
+    shared_version=SharedVersion(config.STATE_DB) if config.SHARED_STATE else None
 )
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import asyncio
+import contextlib
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto
+from telegram.error import BadRequest
+
+from async_kb import akb
+
+# Telegram принимает в одном альбоме от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+
+
+def article_page_markup(article_id, number, page_count):
+    """Кнопки листания статьи: callback_data "pg:<id статьи>:<номер страницы>" """
+    if page_count < 2:
+        return None
+    buttons = []
+    if number > 1:
+        buttons.append(InlineKeyboardButton(f"◀ {number - 1}/{page_count}", callback_data=f"pg:{article_id}:{number - 1}"))
+    if number < page_count:
+        buttons.append(InlineKeyboardButton(f"{number + 1}/{page_count} ▶", callback_data=f"pg:{article_id}:{number + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+
+def material_caption(material_info):
+    """Формирует подпись к материалу"""
+    return f"{material_info['caption']}\n\nID: {material_info['id']}"
+
+
+def material_not_found_text(material_info, material_type):
+    """Текст сообщения об отсутствующем файле материала"""
+    if material_type == "image":
+        return f"Изображение не найдено: {material_info['path']}"
+    return f"Файл не найден: {material_info['path']}"
+
+
+def material_filename(material_info):
+    """Имя файла для Telegram: исходное имя, если файл хранится под sha256"""
+    return material_info.get("filename") or os.path.basename(material_info["path"])
+
+
+def sent_file_id(sent_message, as_photo):
+    """Возвращает file_id из отправленного сообщения"""
+    if as_photo:
+        return sent_message.photo[-1].file_id
+    return sent_message.document.file_id
+
+
+async def send_material(message, topic_key, material_info, material_type):
+    """Отправляет изображение или файл, по возможности по сохраненному file_id"""
+    caption = material_caption(material_info)
+    as_photo = material_type == "image"
+    if as_photo:
+        send, field = message.reply_photo, "photo"
+    else:
+        send, field = message.reply_document, "document"
+
+    # Повторно используем file_id, выданный Telegram при первой отправке
+    if material_info.get("file_id"):
+        try:
+            await send(**{field: material_info["file_id"]}, caption=caption)
+            return
+        except BadRequest:
+            # Telegram не принял file_id - загружаем файл заново
+            pass
+
+    try:
+        async with akb.open_file(material_info["path"], material_filename(material_info)) as file_stream:
+            sent_message = await send(**{field: file_stream}, caption=caption)
+    except FileNotFoundError:
+        await message.reply_text(material_not_found_text(material_info, material_type))
+        return
+
+    await akb.set_material_file_id(topic_key, material_info["id"], sent_file_id(sent_message, as_photo), material_type)
+
+
+async def _send_media_group(message, batch, as_photo, use_file_ids):
+    """Отправляет пачку материалов альбомом, загружая с диска только файлы без file_id"""
+    media_class = InputMediaPhoto if as_photo else InputMediaDocument
+    async with contextlib.AsyncExitStack() as files:
+        media = []
+        for material_info, material_type in batch:
+            if use_file_ids and material_info.get("file_id"):
+                source = material_info["file_id"]
+            else:
+                source = await files.enter_async_context(
+                    akb.open_file(material_info["path"], material_filename(material_info), attach=True)
+                )
+            media.append(media_class(source, caption=material_caption(material_info)))
+        return await message.reply_media_group(media=media)
+
+
+async def send_media_batch(message, topic_key, batch, as_photo):
+    """Отправляет до 10 материалов одного вида одним альбомом"""
+    # Материалы без file_id и без файла на диске отправить нельзя
+    available = []
+    for material_info, material_type in batch:
+        if material_info.get("file_id") or await akb.run(os.path.exists, material_info["path"]):
+            available.append((material_info, material_type))
+        else:
+            await message.reply_text(material_not_found_text(material_info, material_type))
+
+    if len(available) < 2:
+        for material_info, material_type in available:
+            await send_material(message, topic_key, material_info, material_type)
+        return
+
+    reuploaded = False
+    try:
+        sent_messages = await _send_media_group(message, available, as_photo, use_file_ids=True)
+    except BadRequest:
+        # Telegram не принял один из file_id - загружаем пачку заново с диска
+        uploadable = [item for item in available if await akb.run(os.path.exists, item[0]["path"])]
+        for material_info, material_type in available:
+            if (material_info, material_type) not in uploadable:
+                await message.reply_text(material_not_found_text(material_info, material_type))
+        if len(uploadable) < 2:
+            for material_info, material_type in uploadable:
+                await send_material(message, topic_key, material_info, material_type)
+            return
+        available = uploadable
+        sent_messages = await _send_media_group(message, available, as_photo, use_file_ids=False)
+        reuploaded = True
+
+    # Запоминаем file_id только загруженных с диска материалов: для отправленного
+    # по file_id Telegram может вернуть другой file_id того же файла, и сохранять
+    # его незачем
+    for (material_info, material_type), sent_message in zip(available, sent_messages):
+        if reuploaded or not material_info.get("file_id"):
+            await akb.set_material_file_id(
+                topic_key, material_info["id"], sent_file_id(sent_message, as_photo), material_type
+            )
+
+
+async def send_media_batches(message, topic_key, items, as_photo):
+    """Отправляет материалы одного вида последовательными альбомами, сохраняя порядок"""
+    for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+        await send_media_batch(message, topic_key, items[start:start + MEDIA_GROUP_LIMIT], as_photo)
+
+
+async def send_content(message, content):
+    """Отправляет текст подраздела и связанные с ним изображения и файлы"""
+    # Отправляем первую страницу текста; остальные листаются кнопками
+    markup = article_page_markup(content.get("article_id"), 1, content.get("page_count", 1))
+    await message.reply_text(content["text"], reply_markup=markup)
+
+    topic_key = content.get("topic_key")
+    images = [(image_info, "image") for image_info in content["images"]]
+    files = [(file_info, file_info.get("type", "file")) for file_info in content["files"]]
+
+    # Фото и документы нельзя смешивать в одном альбоме, но их альбомы
+    # независимы друг от друга и отправляются параллельно
+    await asyncio.gather(
+        send_media_batches(message, topic_key, images, as_photo=True),
+        send_media_batches(message, topic_key, files, as_photo=False)
+    )
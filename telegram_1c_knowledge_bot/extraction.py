@@ -0,0 +1,89 @@
+import os
+import re
+import hashlib
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    # Без pypdf текст PDF не извлекается, остальные вложения индексируются как обычно
+    PdfReader = None
+
+# Расширения вложений, из которых извлекается текст
+PDF_EXTENSIONS = {".pdf"}
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".log", ".xml", ".json", ".html", ".htm"}
+
+# Имя файла в хранилище - sha256 содержимого
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_extractable(path):
+    """Проверяет, можно ли извлечь текст из файла по его расширению"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PDF_EXTENSIONS:
+        return PdfReader is not None
+    return ext in TEXT_EXTENSIONS
+
+
+def extract_text(path):
+    """Извлекает текст из PDF или текстового файла.
+
+    Выполняется в пуле процессов, поэтому не обращается к состоянию бота.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PDF_EXTENSIONS:
+        reader = PdfReader(path)
+        pages = []
+        for page in reader.pages:
+            try:
+                pages.append(page.extract_text() or "")
+            except Exception:
+                # Поврежденная страница не должна лишать поиска весь документ
+                pages.append("")
+        text = "\n".join(pages)
+    else:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+    # Пустые строки не нужны в сниппетах поиска
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def file_digest(path):
+    """Возвращает sha256 содержимого файла (для файлов хранилища - из имени)"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if DIGEST_RE.match(stem):
+        return stem
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ExtractedTextCache:
+    """Кэш извлеченного текста: <каталог>/<sha256 вложения>.txt.
+
+    Текст зависит только от содержимого файла, поэтому одинаковые вложения
+    обрабатываются один раз, а после перезапуска извлечение не повторяется.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest):
+        """Путь к файлу с текстом вложения"""
+        return os.path.join(self.root, f"{digest}.txt")
+
+    def get(self, digest):
+        """Возвращает путь к готовому тексту или None"""
+        path = self.path_for(digest)
+        return path if os.path.exists(path) else None
+
+    def put(self, digest, text):
+        """Атомарно сохраняет извлеченный текст, возвращает путь к нему"""
+        path = self.path_for(digest)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        return path
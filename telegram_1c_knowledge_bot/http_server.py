@@ -0,0 +1,173 @@
+import json
+import asyncio
+
+# Тексты статусов для строки ответа
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+}
+
+
+class HttpRequest:
+    """Разобранный HTTP-запрос"""
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        # Имена заголовков в нижнем регистре
+        self.headers = headers
+        self.body = body
+        self.keep_alive = False
+
+    def json(self):
+        """Разбирает тело запроса как JSON"""
+        return json.loads(self.body.decode('utf-8'))
+
+
+class HttpResponse:
+    """HTTP-ответ обработчика"""
+
+    def __init__(self, status=200, body=b"", content_type="text/plain; charset=utf-8", headers=None):
+        self.status = status
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.headers = {"Content-Type": content_type}
+        if headers:
+            self.headers.update(headers)
+
+
+def json_response(data, status=200):
+    """Ответ с телом в формате JSON"""
+    return HttpResponse(status, json.dumps(data, ensure_ascii=False), "application/json")
+
+
+class HttpServer:
+    """Минимальный асинхронный HTTP/1.1 сервер на asyncio.
+
+    Поддерживает только то, что нужно боту: маршруты по методу и пути,
+    тело фиксированной длины (Content-Length) и keep-alive. Работает в том
+    же цикле событий, что и Application, поэтому обработчики могут сразу
+    передавать данные боту.
+    """
+
+    # Ограничения на размер запроса
+    MAX_HEADER_SIZE = 16 * 1024
+    MAX_BODY_SIZE = 10 * 1024 * 1024
+    # Сколько ждать следующий запрос на открытом соединении (секунды)
+    KEEP_ALIVE_TIMEOUT = 75
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        # (метод, путь) -> async обработчик(request) -> HttpResponse
+        self.routes = {}
+        self.server = None
+        # Открытые соединения - закрываются при остановке сервера
+        self.connections = set()
+
+    def route(self, method, path, handler):
+        """Регистрирует обработчик запросов"""
+        self.routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        """Начинает принимать соединения"""
+        self.server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=self.MAX_HEADER_SIZE
+        )
+        # При порте 0 система выбирает свободный порт
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Перестает принимать соединения и закрывает сервер"""
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _read_request(self, reader):
+        """Читает один запрос с соединения, возвращает None при закрытии соединения"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.KEEP_ALIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError("Некорректная строка запроса")
+        method, target, version = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0") or 0)
+        if length > self.MAX_BODY_SIZE:
+            raise OverflowError("Слишком большое тело запроса")
+        body = await reader.readexactly(length) if length else b""
+
+        path, _, query = target.partition("?")
+        request = HttpRequest(method.upper(), path, query, headers, body)
+        request.keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return request
+
+    async def _dispatch(self, request):
+        """Вызывает обработчик маршрута"""
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self.routes)
+            return HttpResponse(405 if known_path else 404, "Method Not Allowed" if known_path else "Not Found")
+        try:
+            return await handler(request)
+        except Exception as e:
+            print(f"Ошибка обработки HTTP-запроса {request.method} {request.path}: {e!r}")
+            return HttpResponse(500, "Internal Server Error")
+
+    async def _write_response(self, writer, response, keep_alive):
+        """Отправляет ответ клиенту"""
+        head = [f"HTTP/1.1 {response.status} {STATUS_REASONS.get(response.status, 'Unknown')}"]
+        for name, value in response.headers.items():
+            head.append(f"{name}: {value}")
+        head.append(f"Content-Length: {len(response.body)}")
+        head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        """Обслуживает соединение: запросы обрабатываются по очереди"""
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except OverflowError:
+                    await self._write_response(writer, HttpResponse(413, "Payload Too Large"), False)
+                    break
+                except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    await self._write_response(writer, HttpResponse(400, "Bad Request"), False)
+                    break
+                if request is None:
+                    break
+                response = await self._dispatch(request)
+                await self._write_response(writer, response, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # Соединение закрыто клиентом или при остановке сервера/цикла событий
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
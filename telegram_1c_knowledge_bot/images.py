@@ -0,0 +1,37 @@
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Без Pillow изображения сохраняются как есть
+    Image = None
+
+# Фон для изображений с прозрачностью (JPEG ее не поддерживает)
+BACKGROUND_COLOR = (255, 255, 255)
+
+
+def _flatten(image):
+    """Приводит изображение к RGB, накладывая прозрачные области на белый фон"""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, BACKGROUND_COLOR)
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def normalize_image(source_path, image_path, max_side, quality):
+    """Готовит изображение к хранению и отправке в Telegram.
+
+    Поворачивает по EXIF, уменьшает до max_side по большей стороне и
+    перекодирует в JPEG без метаданных. Выполняется в пуле процессов.
+    Возвращает (ширина, высота) результата.
+    """
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        image = _flatten(image)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        # Метаданные (EXIF, ICC, комментарии) не передаются - сохраняем только пиксели
+        image.save(image_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        return image.size
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import time
+import threading
+
+
+class ScenarioMatcher:
+    """Сопоставляет текст пользователя со сценариями интеллектуальной системы.
+
+    Ключевые слова всех сценариев компилируются в одно регулярное выражение
+    (альтернацию внутри опережающей проверки, чтобы находить и
+    перекрывающиеся совпадения), поэтому текст просматривается за один проход.
+    Выражение перестраивается только при изменении набора сценариев.
+    """
+
+    def __init__(self, scenarios=None):
+        self.pattern = None
+        # ключевое слово -> сценарии, в которых оно встречается
+        self.keyword_scenarios = {}
+        # порядок сценариев для разрешения равных оценок
+        self.order = {}
+        self.rebuild(scenarios or {})
+
+    def rebuild(self, scenarios):
+        """Перестраивает автомат по словарю сценариев {название: {"keywords": [...]}}"""
+        keyword_scenarios = {}
+        for name, data in scenarios.items():
+            for keyword in data.get('keywords', []):
+                keyword_scenarios.setdefault(keyword.lower(), []).append(name)
+
+        self.order = {name: position for position, name in enumerate(scenarios)}
+        self.keyword_scenarios = keyword_scenarios
+        if keyword_scenarios:
+            # Длинные ключевые слова первыми, чтобы "не приходит" имело приоритет над "приходит"
+            alternation = "|".join(
+                re.escape(keyword) for keyword in sorted(keyword_scenarios, key=len, reverse=True)
+            )
+            self.pattern = re.compile(rf'(?=\b({alternation})\b)')
+        else:
+            self.pattern = None
+
+    def match(self, text):
+        """Возвращает список (сценарий, оценка) по убыванию оценки.
+
+        Оценка - число различных ключевых слов сценария, найденных в тексте.
+        """
+        if self.pattern is None:
+            return []
+
+        found_keywords = {match.group(1) for match in self.pattern.finditer(text.lower())}
+        scores = {}
+        for keyword in found_keywords:
+            for name in self.keyword_scenarios[keyword]:
+                scores[name] = scores.get(name, 0) + 1
+
+        return sorted(scores.items(), key=lambda item: (-item[1], self.order[item[0]]))
+
+
+class ScenarioError(ValueError):
+    """Ошибка в описании сценария"""
+
+
+# Допустимые ответы пользователя - ветви узла графа
+ANSWERS = ("да", "нет")
+
+
+def _condition_all_yes(answers):
+    return bool(answers) and all(answer == "да" for answer in answers.values())
+
+
+def _condition_any_yes(answers):
+    return any(answer == "да" for answer in answers.values())
+
+
+def _condition_all_no(answers):
+    return bool(answers) and all(answer == "нет" for answer in answers.values())
+
+
+NAMED_CONDITIONS = {
+    "always": lambda answers: True,
+    "all_yes": _condition_all_yes,
+    "any_yes": _condition_any_yes,
+    "all_no": _condition_all_no,
+}
+
+
+def compile_condition(spec, node_ids):
+    """Компилирует описание условия в функцию от ответов {узел: "да"/"нет"}.
+
+    Поддерживаются именованные условия ("all_yes", "any_yes", "all_no",
+    "always"), конкретные ответы {"answers": {"узел": "да"}} и их
+    комбинации {"all": [...]}, {"any": [...]}, {"not": ...}.
+    """
+    if spec is None:
+        return NAMED_CONDITIONS["always"]
+
+    if isinstance(spec, str):
+        if spec not in NAMED_CONDITIONS:
+            raise ScenarioError(f"Неизвестное условие: {spec}")
+        return NAMED_CONDITIONS[spec]
+
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ScenarioError(f"Некорректное условие: {spec!r}")
+
+    operator, argument = next(iter(spec.items()))
+    if operator == "answers":
+        if not isinstance(argument, dict):
+            raise ScenarioError("Условие 'answers' должно быть словарем {узел: ответ}")
+        for node_id, answer in argument.items():
+            if node_id not in node_ids:
+                raise ScenarioError(f"Условие ссылается на неизвестный узел: {node_id}")
+            if answer not in ANSWERS:
+                raise ScenarioError(f"Недопустимый ответ в условии: {answer}")
+        expected = dict(argument)
+        return lambda answers: all(answers.get(node_id) == answer for node_id, answer in expected.items())
+
+    if operator in ("all", "any"):
+        if not isinstance(argument, list) or not argument:
+            raise ScenarioError(f"Условие '{operator}' должно быть непустым списком")
+        parts = [compile_condition(part, node_ids) for part in argument]
+        combine = all if operator == "all" else any
+        return lambda answers: combine(part(answers) for part in parts)
+
+    if operator == "not":
+        part = compile_condition(argument, node_ids)
+        return lambda answers: not part(answers)
+
+    raise ScenarioError(f"Неизвестный оператор условия: {operator}")
+
+
+class Scenario:
+    """Скомпилированный сценарий диагностики - граф вопросов "да/нет".
+
+    Узел графа: {"question": "...", "да": ветвь, "нет": ветвь}, где ветвь -
+    {"say": "текст ответа", "next": "следующий узел" или null}. Ветвь без
+    next завершает диалог (в том числе досрочно). При загрузке проверяется,
+    что все переходы ведут в существующие узлы и в графе нет циклов, поэтому
+    каждый ответ обрабатывается одним обращением к словарю.
+    """
+
+    def __init__(self, scenario_id, data):
+        if not isinstance(data, dict):
+            raise ScenarioError("Описание сценария должно быть объектом")
+        self.id = scenario_id
+        self.keywords = data.get("keywords", [])
+        if not self.keywords:
+            raise ScenarioError("Не заданы ключевые слова сценария")
+
+        nodes = data.get("nodes")
+        if not isinstance(nodes, dict) or not nodes:
+            raise ScenarioError("Не заданы узлы сценария")
+        self.start = data.get("start")
+        if self.start not in nodes:
+            raise ScenarioError(f"Начальный узел не найден: {self.start}")
+
+        self.nodes = {}
+        for node_id, node in nodes.items():
+            if not isinstance(node, dict) or not node.get("question"):
+                raise ScenarioError(f"У узла {node_id} нет вопроса")
+            branches = {}
+            for answer in ANSWERS:
+                branch = node.get(answer)
+                if not isinstance(branch, dict):
+                    raise ScenarioError(f"У узла {node_id} нет ветви '{answer}'")
+                target = branch.get("next")
+                if target is not None and target not in nodes:
+                    raise ScenarioError(f"Ветвь '{answer}' узла {node_id} ведет в неизвестный узел: {target}")
+                branches[answer] = (branch.get("say", ""), target)
+            self.nodes[node_id] = (node["question"], branches)
+        self._check_acyclic()
+
+        self.related_subtopic = None
+        related = data.get("related_subtopic")
+        if related:
+            if not related.get("topic") or not related.get("subtopic"):
+                raise ScenarioError("В related_subtopic должны быть заданы topic и subtopic")
+            self.related_subtopic = (
+                related["topic"],
+                related["subtopic"],
+                compile_condition(related.get("condition"), self.nodes),
+            )
+
+    def _check_acyclic(self):
+        """Проверяет отсутствие циклов обходом в глубину"""
+        # 1 - узел на текущем пути обхода, 2 - узел полностью обработан
+        marks = {}
+        stack = [(self.start, iter(self._targets(self.start)))]
+        marks[self.start] = 1
+        while stack:
+            node_id, targets = stack[-1]
+            target = next(targets, None)
+            if target is None:
+                marks[node_id] = 2
+                stack.pop()
+            elif marks.get(target) == 1:
+                raise ScenarioError(f"Цикл в графе сценария через узел {target}")
+            elif target not in marks:
+                marks[target] = 1
+                stack.append((target, iter(self._targets(target))))
+
+    def _targets(self, node_id):
+        """Узлы, в которые ведут ветви узла"""
+        return [target for _, target in self.nodes[node_id][1].values() if target is not None]
+
+    def question(self, node_id):
+        """Текст вопроса узла"""
+        return self.nodes[node_id][0]
+
+    def step(self, node_id, answer):
+        """Переход по ответу: возвращает (текст ответа, следующий узел или None)"""
+        return self.nodes[node_id][1][answer]
+
+    def related_for(self, answers):
+        """Возвращает (раздел, подраздел) инструкции, если ее условие выполнено, иначе None"""
+        if self.related_subtopic is None:
+            return None
+        topic, subtopic, condition = self.related_subtopic
+        return (topic, subtopic) if condition(answers) else None
+
+
+class ScenarioRegistry:
+    """Сценарии из JSON-файлов каталога с горячей перезагрузкой.
+
+    Каталог проверяется не чаще раза в reload_interval секунд; изменившиеся
+    файлы перекомпилируются. Если новая версия файла содержит ошибку,
+    продолжает работать предыдущая, а текст ошибки сохраняется в errors.
+    """
+
+    def __init__(self, scenarios_path, reload_interval=2.0):
+        self.scenarios_path = scenarios_path
+        self.reload_interval = reload_interval
+        # путь к файлу -> (mtime_ns, размер, сценарий)
+        self.loaded = {}
+        # путь к файлу -> (mtime_ns, размер, текст ошибки) для последнего неудачного варианта файла
+        self.errors = {}
+        self.scenarios = {}
+        self.matcher = ScenarioMatcher()
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        """Возвращает {путь: (mtime_ns, размер)} файлов сценариев"""
+        signatures = {}
+        try:
+            names = sorted(os.listdir(self.scenarios_path))
+        except OSError:
+            return signatures
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.scenarios_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signatures[path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def _load_file(self, path):
+        """Читает и компилирует сценарий из файла"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ScenarioError(f"Не удалось прочитать файл: {e}")
+        scenario_id = data.get("id") if isinstance(data, dict) else None
+        return Scenario(scenario_id or os.path.splitext(os.path.basename(path))[0], data)
+
+    def refresh(self, force=False):
+        """Перезагружает изменившиеся файлы сценариев, возвращает True, если набор сценариев изменился"""
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < self.reload_interval:
+            return False
+        with self._lock:
+            self.checked_at = now
+            signatures = self._scan()
+            changed = False
+
+            for path in list(self.loaded):
+                if path not in signatures:
+                    del self.loaded[path]
+                    self.errors.pop(path, None)
+                    changed = True
+
+            for path, signature in signatures.items():
+                previous = self.loaded.get(path)
+                if previous is not None and previous[:2] == signature:
+                    continue
+                if previous is None and self.errors.get(path, ())[:2] == signature:
+                    # Этот вариант файла уже не удалось загрузить
+                    continue
+                try:
+                    scenario = self._load_file(path)
+                except ScenarioError as e:
+                    self.errors[path] = signature + (str(e),)
+                    print(f"Ошибка в сценарии {path}: {e}")
+                    if previous is not None:
+                        # Продолжаем использовать прежнюю версию, но не пытаемся перечитывать этот вариант файла
+                        self.loaded[path] = signature + (previous[2],)
+                    continue
+                self.errors.pop(path, None)
+                self.loaded[path] = signature + (scenario,)
+                changed = True
+
+            if changed:
+                scenarios = {}
+                for path in sorted(self.loaded):
+                    scenario = self.loaded[path][2]
+                    if scenario.id in scenarios:
+                        print(f"Сценарий {scenario.id} из {path} пропущен: такой id уже есть")
+                        continue
+                    scenarios[scenario.id] = scenario
+                self.matcher.rebuild({scenario_id: {"keywords": scenario.keywords}
+                                      for scenario_id, scenario in scenarios.items()})
+                self.scenarios = scenarios
+            return changed
+
+    def get(self, scenario_id):
+        """Возвращает сценарий по id или None"""
+        return self.scenarios.get(scenario_id)
+
+    def match(self, text):
+        """Возвращает наиболее подходящий тексту сценарий или None"""
+        matched = self.matcher.match(text)
+        return self.scenarios.get(matched[0][0]) if matched else None
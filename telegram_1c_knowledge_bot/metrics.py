@@ -0,0 +1,322 @@
+import os
+import time
+import bisect
+import functools
+import threading
+
+from http_server import HttpServer, HttpResponse
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    """Экранирует значение метки для текстового формата Prometheus"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Метрика с метками; значения хранятся по кортежу значений меток.
+
+    Если задана функция collect() -> {кортеж значений меток: значение},
+    значения берутся из нее при каждом запросе метрик - так отдаются
+    счетчики, которые уже ведут другие объекты.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.collect = collect
+        self.values = {}
+        # Метрики обновляются и из пула потоков базы знаний
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Строки (имя, метки, значение) для вывода"""
+        if self.collect is not None:
+            values = dict(self.collect())
+            with self._lock:
+                self.values = values
+        with self._lock:
+            items = list(self.values.items())
+        return [(self.name, _format_labels(self.label_names, labels), value) for labels, value in sorted(items)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение"""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам, сумма и число наблюдений"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(labels)
+            if state is None:
+                # Счетчики корзин (последняя - +Inf), сумма, число наблюдений
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(counts), total, count)) for labels, (counts, total, count) in self.values.items()]
+        samples = []
+        for labels, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket",
+                                _format_labels(self.label_names, labels, [("le", _format_value(bound))]),
+                                cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.label_names, labels), total))
+            samples.append((f"{self.name}_count", _format_labels(self.label_names, labels), count))
+        return samples
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=(), collect=None):
+        return self.register(Counter(name, help_text, labels, collect))
+
+    def gauge(self, name, help_text, labels=(), collect=None):
+        return self.register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+handler_duration = registry.histogram(
+    "bot_handler_duration_seconds", "Время выполнения обработчиков бота", ("handler",))
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках бота", ("handler",))
+kb_call_duration = registry.histogram(
+    "kb_call_duration_seconds", "Время выполнения методов базы знаний", ("component", "method"))
+kb_call_errors = registry.counter(
+    "kb_call_errors_total", "Исключения в методах базы знаний", ("component", "method"))
+upload_bytes = registry.counter(
+    "bot_upload_bytes_total", "Байт загружено пользователями в базу знаний", ("kind",))
+sent_requests = registry.counter(
+    "bot_sent_requests_total", "Запросы отправки к Bot API", ("endpoint",))
+sent_bytes = registry.counter(
+    "bot_sent_bytes_total", "Байт отправлено в Bot API (тексты и файлы)", ("endpoint",))
+
+# Текущее состояние диалога по ключу ConversationHandler (чат, пользователь)
+conversation_states = {}
+conversation_states_lock = threading.Lock()
+
+
+def _count_conversation_states():
+    counts = {}
+    with conversation_states_lock:
+        for state in conversation_states.values():
+            counts[(state,)] = counts.get((state,), 0) + 1
+    return counts
+
+
+registry.gauge("bot_conversations", "Число диалогов в каждом состоянии", ("state",),
+               collect=_count_conversation_states)
+
+
+def instrument_callback(callback, name=None, state_names=None):
+    """Оборачивает обработчик: время, исключения и (для диалога) состояние, в которое он перевел пользователя"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            state = await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, name)
+        if state_names is not None and state is not None:
+            chat = getattr(update, "effective_chat", None)
+            user = getattr(update, "effective_user", None)
+            key = (chat.id if chat else None, user.id if user else None)
+            with conversation_states_lock:
+                if state in state_names:
+                    conversation_states[key] = state_names[state]
+                else:
+                    # ConversationHandler.END - диалог завершен
+                    conversation_states.pop(key, None)
+        return state
+
+    return wrapper
+
+
+def instrument_conversation(conversation, state_names):
+    """Оборачивает все обработчики ConversationHandler"""
+    handlers = list(conversation.entry_points) + list(conversation.fallbacks)
+    for state_handlers in conversation.states.values():
+        handlers.extend(state_handlers)
+    for handler in handlers:
+        handler.callback = instrument_callback(handler.callback, state_names=state_names)
+
+
+def instrument_handler(handler):
+    """Оборачивает обработчик вне диалога"""
+    handler.callback = instrument_callback(handler.callback)
+
+
+def _timed_method(method, component, name):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            kb_call_errors.inc(component, name)
+            raise
+        finally:
+            kb_call_duration.observe(time.perf_counter() - started, component, name)
+    return wrapper
+
+
+def instrument_methods(obj, component):
+    """Оборачивает публичные методы объекта (на уровне экземпляра, класс не меняется)"""
+    for name in dir(type(obj)):
+        if name.startswith("_"):
+            continue
+        method = getattr(obj, name)
+        if callable(method) and not isinstance(method, type):
+            setattr(obj, name, _timed_method(method, component, name))
+
+
+def input_file_size(input_file):
+    """Размер файла InputFile: содержимого в памяти или открытого файла на диске"""
+    content = getattr(input_file, "input_file_content", None)
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    try:
+        return os.fstat(content.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def payload_size(data):
+    """Размер текстов и файлов в параметрах запроса Bot API"""
+    size = 0
+    for value in data.values():
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                size += input_file_size(getattr(item, "media", None))
+        elif isinstance(value, str):
+            size += len(value.encode('utf-8'))
+        else:
+            size += input_file_size(value)
+    return size
+
+
+def instrument_outbound(scheduler):
+    """Считает исходящие запросы и байты и отдает состояние очередей планировщика"""
+    process_request = scheduler.process_request
+
+    async def counted(callback, args, kwargs, endpoint, data, rate_limit_args):
+        sent_requests.inc(endpoint)
+        sent_bytes.inc(endpoint, amount=payload_size(data))
+        return await process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+
+    scheduler.process_request = counted
+
+    def queues():
+        snapshot = scheduler.snapshot()
+        values = {}
+        for bucket in ("chat_queue", "global_queue"):
+            for priority, count in snapshot[bucket].items():
+                values[(bucket, priority)] = count
+        return values
+
+    registry.gauge("outbound_queued_requests", "Запросы, ожидающие отправки", ("bucket", "priority"),
+                   collect=queues)
+    registry.gauge("outbound_chats_waiting", "Чаты с запросами в очереди",
+                   collect=lambda: {(): scheduler.snapshot()["chats_waiting"]})
+    registry.counter("outbound_retries_total", "Повторы запросов после ответа 429",
+                     collect=lambda: {(): scheduler.retries})
+
+
+def instrument_render_cache(render_cache):
+    """Попадания и промахи кэша клавиатур и страниц разделов"""
+    registry.counter("render_cache_requests_total", "Обращения к кэшу отображения", ("result",),
+                     collect=lambda: {("hit",): render_cache.hits, ("miss",): render_cache.misses})
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с /metrics в текстовом формате Prometheus"""
+
+    def __init__(self, listen, port, metrics_registry=None):
+        self.registry = metrics_registry or registry
+        self.http = HttpServer(listen, port)
+        self.http.route("GET", "/metrics", self.handle_metrics)
+
+    async def handle_metrics(self, request):
+        return HttpResponse(200, self.registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+
+    async def start(self):
+        await self.http.start()
+
+    async def stop(self):
+        await self.http.stop()
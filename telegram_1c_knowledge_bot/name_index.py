@@ -0,0 +1,120 @@
+def normalize_name(name):
+    """Нормализует название подраздела для сравнения"""
+    return name.strip().lower().replace(' ', '_')
+
+
+def trigrams(text):
+    """Возвращает множество триграмм строки"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SubtopicNameIndex:
+    """Индекс названий подразделов.
+
+    Хранит отображение нормализованное название -> (раздел, подраздел) для
+    точных совпадений за O(1) и триграммный индекс для частичных и
+    нечетких совпадений. Обновляется инкрементально при добавлении
+    подразделов.
+    """
+
+    # Служебный файл описания раздела не является подразделом
+    SERVICE_NAMES = {'_description'}
+
+    # Минимальная доля общих триграмм для нечеткого совпадения
+    SIMILARITY_THRESHOLD = 0.5
+
+    def __init__(self):
+        # Записи в порядке добавления: (раздел, подраздел, нормализованное название)
+        self.entries = []
+        # нормализованное название -> номера записей
+        self.by_name = {}
+        # (раздел, нормализованное название) -> подраздел
+        self.by_topic_name = {}
+        # раздел -> список подразделов без служебных
+        self.by_topic = {}
+        # триграмма -> номера записей
+        self.trigram_postings = {}
+
+    def add_topic(self, topic):
+        """Регистрирует раздел (возможно, пока без подразделов)"""
+        self.by_topic.setdefault(topic, [])
+
+    def add(self, topic, subtopic):
+        """Добавляет подраздел в индекс"""
+        self.add_topic(topic)
+        if subtopic in self.SERVICE_NAMES:
+            return
+        normalized = normalize_name(subtopic)
+        if (topic, normalized) in self.by_topic_name:
+            return
+
+        entry_id = len(self.entries)
+        self.entries.append((topic, subtopic, normalized))
+        self.by_name.setdefault(normalized, []).append(entry_id)
+        self.by_topic_name[(topic, normalized)] = subtopic
+        self.by_topic[topic].append(subtopic)
+        for trigram in trigrams(normalized):
+            self.trigram_postings.setdefault(trigram, set()).add(entry_id)
+
+    def subtopics(self, topic):
+        """Возвращает подразделы раздела без служебных"""
+        return list(self.by_topic.get(topic, []))
+
+    def find(self, name, topic=None):
+        """Ищет подраздел по точному нормализованному названию.
+
+        Возвращает (раздел, подраздел) или None.
+        """
+        normalized = normalize_name(name)
+        if topic is not None:
+            subtopic = self.by_topic_name.get((topic, normalized))
+            return (topic, subtopic) if subtopic else None
+        entry_ids = self.by_name.get(normalized)
+        if not entry_ids:
+            return None
+        topic, subtopic, _ = self.entries[entry_ids[0]]
+        return (topic, subtopic)
+
+    def _candidates(self, word):
+        """Записи, содержащие все триграммы слова"""
+        candidates = None
+        for trigram in trigrams(word):
+            postings = self.trigram_postings.get(trigram)
+            if not postings:
+                return set()
+            candidates = set(postings) if candidates is None else candidates & postings
+            if not candidates:
+                return set()
+        return candidates or set()
+
+    def find_partial(self, query):
+        """Ищет подразделы, в названии которых встречается хотя бы одно слово запроса (длиннее 2 символов)"""
+        words = [word for word in normalize_name(query).split('_') if len(word) > 2]
+        matched = set()
+        for word in words:
+            for entry_id in self._candidates(word):
+                # Триграммы лишь отбирают кандидатов - проверяем вхождение целиком
+                if word in self.entries[entry_id][2]:
+                    matched.add(entry_id)
+        return [self.entries[entry_id][:2] for entry_id in sorted(matched)]
+
+    def find_similar(self, query, limit=10):
+        """Ищет подразделы с похожими названиями (например, при опечатках)"""
+        query_trigrams = set()
+        for word in normalize_name(query).split('_'):
+            query_trigrams |= trigrams(word)
+        if not query_trigrams:
+            return []
+
+        overlap = {}
+        for trigram in query_trigrams:
+            for entry_id in self.trigram_postings.get(trigram, ()):
+                overlap[entry_id] = overlap.get(entry_id, 0) + 1
+
+        scored = []
+        for entry_id, common in overlap.items():
+            score = common / len(query_trigrams)
+            if score >= self.SIMILARITY_THRESHOLD:
+                scored.append((-score, entry_id))
+        scored.sort()
+        return [self.entries[entry_id][:2] for _, entry_id in scored[:limit]]
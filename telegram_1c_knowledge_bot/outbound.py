@@ -0,0 +1,241 @@
+import time
+import heapq
+import asyncio
+import itertools
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Приоритеты исходящих запросов: меньше - раньше
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Методы Bot API, которые пользователь ждет в ответ на свое действие
+INTERACTIVE_ENDPOINTS = {
+    "sendMessage",
+    "editMessageText",
+    "editMessageReplyMarkup",
+    "editMessageCaption",
+    "deleteMessage",
+    "sendChatAction",
+}
+
+
+class PriorityTokenBucket:
+    """Корзина токенов с очередью ожидающих по приоритету.
+
+    Токены пополняются со скоростью rate в секунду до capacity. Если
+    токенов нет, запрос встает в очередь; интерактивные запросы обгоняют
+    массовые. pause() останавливает выдачу токенов (ответ 429 от Telegram).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        # (приоритет, порядковый номер, future)
+        self.waiters = []
+        self._sequence = itertools.count()
+        self._timer = None
+
+    def _refill(self, now):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def _try_take(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, priority=BULK):
+        """Дожидается токена с учетом приоритета"""
+        if not self.waiters and self._try_take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._sequence), future))
+        self._schedule()
+        await future
+
+    def pause(self, seconds):
+        """Не выдает токены seconds секунд"""
+        now = time.monotonic()
+        self._refill(now)
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self._schedule(reschedule=True)
+
+    def _schedule(self, reschedule=False):
+        """Планирует выдачу токена первому в очереди"""
+        if self._timer is not None:
+            if not reschedule:
+                return
+            self._timer.cancel()
+            self._timer = None
+        if not self.waiters:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        delay = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._release)
+
+    def _release(self):
+        """Выдает накопившиеся токены ожидающим в порядке приоритета"""
+        self._timer = None
+        while self.waiters:
+            future = self.waiters[0][2]
+            if future.done():
+                # Ожидание отменено
+                heapq.heappop(self.waiters)
+                continue
+            if not self._try_take():
+                break
+            heapq.heappop(self.waiters)
+            future.set_result(None)
+        self._schedule()
+
+    def queued(self):
+        """Число ожидающих по приоритетам"""
+        counts = {}
+        for priority, _, future in self.waiters:
+            if not future.done():
+                counts[priority] = counts.get(priority, 0) + 1
+        return counts
+
+    def idle(self):
+        """Корзина не нужна: очередь пуста и токены восстановились"""
+        if self.waiters:
+            return False
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and time.monotonic() >= self.paused_until
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Планировщик исходящих запросов к Bot API с учетом ограничений Telegram.
+
+    Каждый запрос в чат берет токен из корзины чата и из общей корзины бота.
+    Ответы пользователю (sendMessage и правки сообщений) обгоняют отправку
+    вложений. При 429 корзина чата приостанавливается на retry_after, и
+    запрос повторяется; остальные чаты продолжают получать ответы. Запросы
+    без чата (getUpdates, getFile и т.п.) не ограничиваются, но их 429 -
+    ограничение всего бота, поэтому приостанавливается общая корзина.
+    """
+
+    # Сколько корзин чатов держать, прежде чем удалять простаивающие
+    MAX_IDLE_CHATS = 1000
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_rate=20 / 60, max_retries=3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.global_bucket = None
+        self.chat_buckets = {}
+        self.sent = 0
+        self.retries = 0
+        self.retry_after_seconds = 0.0
+
+    async def initialize(self):
+        self.global_bucket = PriorityTokenBucket(self.global_rate, self.global_rate)
+
+    async def shutdown(self):
+        self.chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_IDLE_CHATS:
+                for key in [key for key, value in self.chat_buckets.items() if value.idle()]:
+                    del self.chat_buckets[key]
+            # У групп (отрицательный id или @username канала) ограничение строже
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            if is_group:
+                bucket = PriorityTokenBucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = PriorityTokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def request_priority(endpoint, rate_limit_args):
+        """Приоритет запроса: явно заданный в rate_limit_args или по методу Bot API"""
+        if isinstance(rate_limit_args, dict) and "priority" in rate_limit_args:
+            return rate_limit_args["priority"]
+        return INTERACTIVE if endpoint in INTERACTIVE_ENDPOINTS else BULK
+
+    def _retry_delay(self, error):
+        """Пауза после ответа 429 с небольшим запасом, чтобы не попасть в ограничение повторно на границе интервала"""
+        retry_after = error.retry_after + 0.1
+        self.retries += 1
+        self.retry_after_seconds += retry_after
+        return retry_after
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        max_retries = self.max_retries
+        if isinstance(rate_limit_args, dict):
+            max_retries = rate_limit_args.get("max_retries", max_retries)
+
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            for attempt in range(max_retries + 1):
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    if attempt == max_retries:
+                        raise
+                    retry_after = self._retry_delay(e)
+                    self.global_bucket.pause(retry_after)
+                    await asyncio.sleep(retry_after)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        priority = self.request_priority(endpoint, rate_limit_args)
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(max_retries + 1):
+            await chat_bucket.acquire(priority)
+            await self.global_bucket.acquire(priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    raise
+                # Ограничение касается только этого чата - другие чаты не ждут
+                chat_bucket.pause(self._retry_delay(e))
+                continue
+            self.sent += 1
+            return result
+
+    def snapshot(self):
+        """Метрики очередей: глубина по приоритетам, число чатов, повторы после 429"""
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        chats_waiting = 0
+        for bucket in self.chat_buckets.values():
+            counts = bucket.queued()
+            if counts:
+                chats_waiting += 1
+            for priority, count in counts.items():
+                queued[PRIORITY_NAMES.get(priority, str(priority))] += count
+        global_queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        if self.global_bucket is not None:
+            for priority, count in self.global_bucket.queued().items():
+                global_queued[PRIORITY_NAMES.get(priority, str(priority))] += count
+        return {
+            "chat_queue": queued,
+            "global_queue": global_queued,
+            "chats": len(self.chat_buckets),
+            "chats_waiting": chats_waiting,
+            "sent": self.sent,
+            "retries": self.retries,
+            "retry_after_seconds": self.retry_after_seconds,
+        }
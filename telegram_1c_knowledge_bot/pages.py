@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+# Ограничение длины страницы: Telegram принимает до 4096 символов (UTF-16) в сообщении
+PAGE_LIMIT = 4000
+
+# Границы, по которым делится слишком длинный текст: абзацы, строки, слова
+SPLIT_LEVELS = (
+    (re.compile(r'\n[ \t]*\n\s*'), "\n\n"),
+    (re.compile(r'\n'), "\n"),
+    (re.compile(r'[ \t]+'), " "),
+)
+
+
+def text_length(text):
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _cut(text, limit):
+    """Делит текст без пробелов на куски не длиннее limit за один проход"""
+    pieces = []
+    start = 0
+    length = 0
+    for position, char in enumerate(text):
+        # Символы вне BMP занимают в UTF-16 две единицы
+        units = 2 if ord(char) > 0xFFFF else 1
+        if length + units > limit and position > start:
+            pieces.append(text[start:position])
+            start, length = position, 0
+        length += units
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def _split(text, limit, level):
+    if text_length(text) <= limit:
+        return [text]
+    if level == len(SPLIT_LEVELS):
+        return _cut(text, limit)
+
+    pattern, joiner = SPLIT_LEVELS[level]
+    pages = []
+    current, current_length = "", 0
+    for part in pattern.split(text):
+        if not part.strip():
+            continue
+        part_length = text_length(part)
+        if current and current_length + len(joiner) + part_length <= limit:
+            current += joiner + part
+            current_length += len(joiner) + part_length
+            continue
+        if current:
+            pages.append(current)
+        if part_length <= limit:
+            current, current_length = part, part_length
+        else:
+            # Абзац не помещается на страницу - делим его по строкам, строку - по словам
+            pieces = _split(part, limit, level + 1)
+            pages.extend(pieces[:-1])
+            current, current_length = pieces[-1], text_length(pieces[-1])
+    if current:
+        pages.append(current)
+    return pages
+
+
+def split_pages(text, limit=PAGE_LIMIT):
+    """Делит текст на страницы не длиннее limit, по возможности по границам абзацев"""
+    text = text.strip()
+    if not text:
+        return []
+    return _split(text, limit, 0)
+
+
+class ArticlePages:
+    """Кэш страниц статей (файлов подразделов): <каталог>/<id статьи>.json.
+
+    Статья делится на страницы при индексации и при изменении файла; при
+    листании страницы берутся из кэша без чтения и разбиения самого файла.
+    Запись действительна, пока у файла те же mtime и размер. Последние
+    memory_size статей держатся и в памяти. У пустой статьи нет страниц.
+    """
+
+    def __init__(self, root, limit=PAGE_LIMIT, memory_size=256):
+        self.root = root
+        self.limit = limit
+        self.memory_size = memory_size
+        # id статьи -> {"path", "mtime", "size", "pages"}, в порядке обращения
+        self.entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def article_id(path):
+        """Короткий идентификатор статьи для callback_data кнопок"""
+        return hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+
+    def cache_path(self, article_id):
+        return os.path.join(self.root, f"{article_id}.json")
+
+    def _remember(self, article_id, entry):
+        with self._lock:
+            self.entries.pop(article_id, None)
+            self.entries[article_id] = entry
+            while len(self.entries) > self.memory_size:
+                del self.entries[next(iter(self.entries))]
+
+    def _is_fresh(self, entry):
+        try:
+            stat = os.stat(entry["path"])
+        except OSError:
+            return False
+        return entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+
+    def build(self, path):
+        """Делит файл статьи на страницы и сохраняет их в кэш; возвращает запись или None"""
+        try:
+            stat = os.stat(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            return None
+        entry = {"path": path, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                 "pages": split_pages(text, self.limit)}
+        article_id = self.article_id(path)
+        cache_path = self.cache_path(article_id)
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Кэш на диске необязателен - страницы остаются в памяти
+            pass
+        self._remember(article_id, entry)
+        return entry
+
+    def get(self, article_id):
+        """Возвращает запись статьи по id, переразбивая файл, если он изменился; None - статьи нет"""
+        with self._lock:
+            entry = self.entries.get(article_id)
+        if entry is None:
+            try:
+                with open(self.cache_path(article_id), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+        if not self._is_fresh(entry):
+            return self.build(entry["path"])
+        self._remember(article_id, entry)
+        return entry
+
+    def pages_for(self, path):
+        """Возвращает запись статьи по пути к файлу, разбивая его при отсутствии в кэше"""
+        entry = self.get(self.article_id(path))
+        if entry is None or entry["path"] != path:
+            entry = self.build(path)
+        return entry
+
+    def remove(self, path):
+        """Удаляет страницы статьи из кэша"""
+        article_id = self.article_id(path)
+        with self._lock:
+            self.entries.pop(article_id, None)
+        try:
+            os.remove(self.cache_path(article_id))
+        except OSError:
+            pass
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import random
+import cProfile
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import Counter, deque
+
+from telegram import Update
+
+# Сведения об обрабатываемом обновлении: обработчики дописывают в них свое имя и состояние диалога
+update_info = contextvars.ContextVar("update_info", default=None)
+
+
+def annotate_callback(callback, state=None, state_names=None):
+    """Оборачивает обработчик: записывает его имя, состояние диалога и новое состояние в сведения об обновлении"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        info = update_info.get()
+        if info is not None:
+            info["handlers"].append(name)
+            if state is not None:
+                info["state"] = state
+        result = await callback(update, context)
+        if info is not None and result is not None and state_names is not None:
+            info["next_state"] = state_names.get(result, result)
+        return result
+
+    return wrapper
+
+
+def annotate_conversation(conversation, state_names):
+    """Оборачивает обработчики ConversationHandler с указанием состояния, в котором они вызываются"""
+    groups = [("entry", conversation.entry_points), ("fallback", conversation.fallbacks)]
+    groups.extend((state_names.get(state, str(state)), handlers) for state, handlers in conversation.states.items())
+    for state, handlers in groups:
+        for handler in handlers:
+            handler.callback = annotate_callback(handler.callback, state, state_names)
+
+
+def annotate_handler(handler):
+    """Оборачивает обработчик вне диалога"""
+    handler.callback = annotate_callback(handler.callback)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame):
+    """Поток ждет работы: цикл событий в select, поток пула - в очереди задач"""
+    filename = frame.f_code.co_filename
+    name = frame.f_code.co_name
+    return (
+        filename.endswith("selectors.py")
+        or (name == "_worker" and filename.endswith(os.path.join("futures", "thread.py")))
+        or (name == "wait" and filename.endswith("threading.py"))
+    )
+
+
+class StackSampler(threading.Thread):
+    """Фоновый сэмплер стеков всех потоков процесса.
+
+    Сэмплер спит, пока ни одно обновление не обрабатывается дольше delay
+    секунд: обход стеков всех потоков не бесплатен, а быстрым обновлениям
+    профиль не нужен. Пока такое обновление есть, раз в interval секунд
+    стеки занятых потоков запоминаются в кольцевом буфере за последние
+    window секунд; профиль медленного обновления собирается из буфера уже
+    после того, как обновление завершилось.
+    """
+
+    def __init__(self, interval=0.02, window=120.0, delay=0.0):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.delay = delay
+        self.samples = deque(maxlen=max(1, int(window / interval)))
+        # Обрабатываемые обновления: метка -> время начала обработки
+        self.active = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stop_event = threading.Event()
+
+    def begin(self):
+        """Отмечает начало обработки обновления; возвращает метку для end"""
+        token = object()
+        with self._lock:
+            self.active[token] = time.perf_counter()
+        self._changed.set()
+        return token
+
+    def end(self, token):
+        """Отмечает конец обработки обновления"""
+        with self._lock:
+            self.active.pop(token, None)
+
+    def _time_to_sampling(self):
+        """Секунды до момента, когда самое долгое обновление превысит delay; None - обновлений нет"""
+        with self._lock:
+            if not self.active:
+                return None
+            oldest = min(self.active.values())
+        return oldest + self.delay - time.perf_counter()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.is_set():
+            wait = self._time_to_sampling()
+            if wait is None or wait > 0:
+                # Ждем нового обновления или пока текущее не станет достаточно долгим
+                self._changed.wait(wait)
+                self._changed.clear()
+                continue
+            self._sample(own_id)
+            self._stop_event.wait(self.interval)
+
+    def _sample(self, own_id):
+        now = time.perf_counter()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or _is_idle(frame):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.samples.append((now, tuple(reversed(stack))))
+
+    def stop(self):
+        self._stop_event.set()
+        self._changed.set()
+
+    def collapsed(self, started, finished):
+        """Стеки за интервал в формате collapsed (flamegraph.pl, speedscope): "поток;внешняя;...;внутренняя N" """
+        counts = Counter(stack for timestamp, stack in list(self.samples) if started <= timestamp <= finished)
+        return [f"{';'.join(stack)} {count}" for stack, count in counts.most_common()]
+
+
+class UpdateProfiler:
+    """Профилирование обработки обновлений.
+
+    Доля sample_rate обновлений профилируется cProfile (файл .prof для
+    pstats, snakeviz и т.п.). Для каждого обновления дольше slow_seconds
+    сохраняются стеки из StackSampler (файл .folded); сэмплер включается,
+    когда обработка длится дольше доли SAMPLE_AFTER от порога, поэтому
+    стеки покрывают только остаток времени обработки.
+    Рядом пишется .json с обработчиком, состоянием диалога, id пользователя
+    и длительностью. В каталоге хранятся только max_files последних профилей.
+
+    cProfile видит поток цикла событий целиком, а сэмплер - все потоки
+    (в том числе пул базы знаний), поэтому в профиль попадает и работа
+    обновлений других чатов, выполнявшихся одновременно.
+    """
+
+    # Доля порога медленного обновления, после которой начинается сэмплирование стеков
+    SAMPLE_AFTER = 0.5
+
+    def __init__(self, directory, sample_rate=0.01, slow_seconds=1.0, max_files=200, interval=0.02):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.max_files = max_files
+        self.sampler = StackSampler(interval, delay=slow_seconds * self.SAMPLE_AFTER) if slow_seconds > 0 else None
+        # cProfile может профилировать только одно обновление за раз
+        self._profiling = False
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self.sampler is not None and not self.sampler.is_alive():
+            self.sampler.start()
+
+    def stop(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    async def run(self, update, coroutine):
+        """Выполняет обработку обновления, при необходимости сохраняя профиль"""
+        user = update.effective_user if isinstance(update, Update) else None
+        info = {
+            "update_id": getattr(update, "update_id", None),
+            "user_id": user.id if user else None,
+            "handlers": [],
+            "state": None,
+            "next_state": None,
+        }
+        token = update_info.set(info)
+        profile = None
+        if not self._profiling and self.sample_rate > 0 and random.random() < self.sample_rate:
+            self._profiling = True
+            profile = cProfile.Profile()
+            profile.enable()
+        sampling = self.sampler.begin() if self.sampler is not None else None
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            finished = time.perf_counter()
+            if sampling is not None:
+                self.sampler.end(sampling)
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            update_info.reset(token)
+
+        duration = finished - started
+        slow = self.sampler is not None and duration >= self.slow_seconds
+        if profile is not None or slow:
+            info["duration_seconds"] = round(duration, 6)
+            info["slow"] = slow
+            stacks = self.sampler.collapsed(started, finished) if slow else None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.save, info, profile, stacks)
+
+    def save(self, info, profile, stacks):
+        """Записывает профиль и сведения об обновлении, удаляя старые профили"""
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{info['update_id']}"
+        base = os.path.join(self.directory, name)
+        with self._write_lock:
+            files = []
+            if profile is not None:
+                profile.dump_stats(f"{base}.prof")
+                files.append(f"{name}.prof")
+            if stacks is not None:
+                with open(f"{base}.folded", 'w', encoding='utf-8') as f:
+                    f.write("\n".join(stacks) + "\n")
+                files.append(f"{name}.folded")
+            info["files"] = files
+            with open(f"{base}.json", 'w', encoding='utf-8') as f:
+                json.dump(info, f, ensure_ascii=False, indent=2)
+            self.rotate()
+
+    def rotate(self):
+        """Оставляет в каталоге только max_files последних профилей"""
+        profiles = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in profiles[:max(0, len(profiles) - self.max_files)]:
+            stem = entry.path[:-len(".json")]
+            for ext in (".json", ".prof", ".folded"):
+                if os.path.exists(stem + ext):
+                    os.remove(stem + ext)
@@ -0,0 +1,108 @@
+from telegram import ReplyKeyboardMarkup
+
+from async_kb import akb
+
+
+def create_main_keyboard(topics):
+    """Создает клавиатуру для основного меню"""
+    keyboard = [[topic] for topic in topics]
+    keyboard.append(["Поиск", "Управление материалами","Интеллектуальная система"])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
+def create_subtopic_keyboard(subtopics):
+    """Создает клавиатуру для подразделов"""
+    keyboard = [[subtopic] for subtopic in subtopics]
+    keyboard.append(["Назад к разделам"])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
+class RenderCache:
+    """Кэш готовых клавиатур и страниц разделов.
+
+    Записи действительны, пока не изменилась версия базы знаний
+    (KnowledgeBase.version), которая увеличивается при добавлении разделов,
+    подразделов и материалов.
+    """
+
+    def __init__(self, async_kb):
+        self.akb = async_kb
+        self.version = None
+        self.items = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        """Возвращает (найдено, значение), сбрасывая кэш при смене версии базы знаний"""
+        if self.version != self.akb.kb.version:
+            self.items.clear()
+            self.version = self.akb.kb.version
+        if key in self.items:
+            self.hits += 1
+            return True, self.items[key]
+        self.misses += 1
+        return False, None
+
+    def main_keyboard(self):
+        """Клавиатура основного меню"""
+        found, markup = self._lookup(("main",))
+        if not found:
+            markup = self.items[("main",)] = create_main_keyboard(self.akb.get_topics())
+        return markup
+
+    async def subtopic_keyboard(self, topic):
+        """Клавиатура подразделов раздела"""
+        found, markup = self._lookup(("subtopics", topic))
+        if found:
+            return markup
+
+        version = self.version
+        markup = create_subtopic_keyboard(await self.akb.get_visible_subtopics(topic))
+        if version == self.akb.kb.version:
+            self.items[("subtopics", topic)] = markup
+        return markup
+
+    async def topic_page(self, topic):
+        """Страница раздела: описание и список подразделов.
+
+        Возвращает (текст, есть ли в разделе подразделы).
+        """
+        found, page = self._lookup(("page", topic))
+        if found:
+            return page
+
+        version = self.version
+        description = await self.akb.get_topic_description(topic)
+        subtopics = await self.akb.get_visible_subtopics(topic)
+        if subtopics:
+            lines = [f"{description}\n\nПодразделы раздела '{topic}':"]
+            lines.extend(f"• {subtopic}" for subtopic in subtopics)
+            lines.append("\nВыбери подраздел:")
+            page = ("\n".join(lines), True)
+        else:
+            page = (f"{description}\n\nВ разделе '{topic}' пока нет подразделов. Добавь подраздел через меню 'Управление материалами'.", False)
+
+        # Пока читались описание и подразделы, база знаний могла измениться - такую страницу не кэшируем
+        if version == self.akb.kb.version:
+            self.items[("page", topic)] = page
+        return page
+
+
+render_cache = RenderCache(akb)
+
+
+async def user_markup(context):
+    """Возвращает текущую клавиатуру пользователя"""
+    topic = context.user_data.get('keyboard_topic')
+    if topic:
+        return await render_cache.subtopic_keyboard(topic)
+    return render_cache.main_keyboard()
+
+
+async def set_user_markup(context, topic=None):
+    """Переключает клавиатуру пользователя на подразделы раздела (или основное меню) и возвращает ее"""
+    if topic:
+        context.user_data['keyboard_topic'] = topic
+    else:
+        context.user_data.pop('keyboard_topic', None)
+    return await user_markup(context)
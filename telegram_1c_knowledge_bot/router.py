@@ -0,0 +1,163 @@
+import os
+import sys
+import zlib
+import signal
+import asyncio
+
+import httpx
+
+import config
+from http_server import HttpServer, HttpResponse, json_response
+from webhook import SECRET_HEADER, check_webhook_settings, secret_matches
+
+# Пауза перед перезапуском упавшего процесса-обработчика (секунды)
+RESTART_DELAY = 1.0
+
+
+def routing_key(data):
+    """Ключ маршрутизации обновления: id пользователя, иначе id чата, иначе номер обновления"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return data.get("update_id", 0)
+
+
+def worker_for(key, workers):
+    """Номер процесса-обработчика для ключа (стабилен между перезапусками)"""
+    return zlib.crc32(str(key).encode()) % workers
+
+
+class WorkerRouter:
+    """Маршрутизатор режима BOT_MODE=multi.
+
+    Запускает workers процессов бота в режиме webhook на внутренних портах
+    (/healthz - на портах после них) и принимает webhook Telegram сам. Каждое обновление пересылается
+    процессу, выбранному по хэшу id пользователя, поэтому диалог
+    пользователя всегда обрабатывается одним процессом. Упавшие процессы
+    перезапускаются.
+    """
+
+    def __init__(self, workers, listen, port, path, secret, base_port):
+        self.workers = workers
+        self.path = path
+        self.secret = secret
+        self.base_port = base_port
+        self.http = HttpServer(listen, port)
+        self.http.route("POST", path, self.handle_update)
+        self.http.route("GET", "/healthz", self.handle_health)
+        self.processes = {}
+        self.client = None
+        self.stopping = False
+        self.forwarded = [0] * workers
+
+    def worker_url(self, worker_id, path):
+        return f"http://127.0.0.1:{self.base_port + worker_id}{path}"
+
+    def worker_health_url(self, worker_id):
+        return f"http://127.0.0.1:{self.base_port + self.workers + worker_id}/healthz"
+
+    def worker_env(self, worker_id):
+        """Окружение процесса-обработчика"""
+        env = dict(os.environ)
+        env.update({
+            "BOT_MODE": "webhook",
+            "WORKER_ID": str(worker_id),
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.base_port + worker_id),
+            "WEBHOOK_PATH": self.path,
+            "WEBHOOK_HEALTH_PORT": str(self.base_port + self.workers + worker_id),
+            # PTB при запуске вызывает setWebhook - все процессы регистрируют
+            # один и тот же внешний адрес маршрутизатора
+            "WEBHOOK_URL": config.WEBHOOK_URL,
+            "SHARED_STATE": "true",
+            # Материалы изменяются несколькими процессами - нужен SQLite
+            "STORAGE_BACKEND": "sqlite",
+            # У каждого процесса свой порт метрик
+            "METRICS_PORT": str(config.METRICS_PORT + 1 + worker_id),
+        })
+        return env
+
+    async def supervise(self, worker_id):
+        """Запускает процесс-обработчик и перезапускает его при падении"""
+        while not self.stopping:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(sys.argv[0]), env=self.worker_env(worker_id)
+            )
+            self.processes[worker_id] = process
+            code = await process.wait()
+            if not self.stopping:
+                print(f"Обработчик {worker_id} завершился с кодом {code}, перезапуск")
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def handle_update(self, request):
+        """Пересылает обновление закрепленному за пользователем процессу"""
+        if not secret_matches(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return HttpResponse(403, "Forbidden")
+        try:
+            data = request.json()
+        except ValueError:
+            return HttpResponse(400, "Bad Request")
+        worker_id = worker_for(routing_key(data), self.workers)
+        headers = {"Content-Type": "application/json", SECRET_HEADER: self.secret}
+        try:
+            response = await self.client.post(self.worker_url(worker_id, self.path), content=request.body,
+                                              headers=headers)
+        except httpx.HTTPError:
+            # Telegram повторит доставку обновления позже
+            return HttpResponse(502, "Bad Gateway")
+        self.forwarded[worker_id] += 1
+        return HttpResponse(response.status_code, response.content)
+
+    async def handle_health(self, request):
+        """Состояние маршрутизатора и процессов-обработчиков"""
+        workers = []
+        for worker_id in range(self.workers):
+            try:
+                response = await self.client.get(self.worker_health_url(worker_id), timeout=2)
+                status = response.json()
+            except (httpx.HTTPError, ValueError):
+                status = {"status": "down"}
+            status["worker"] = worker_id
+            status["forwarded_updates"] = self.forwarded[worker_id]
+            workers.append(status)
+        healthy = all(worker["status"] == "ok" for worker in workers)
+        return json_response({"status": "ok" if healthy else "degraded", "workers": workers},
+                             200 if healthy else 503)
+
+    async def run(self):
+        """Работает до SIGINT/SIGTERM"""
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
+        supervisors = [asyncio.create_task(self.supervise(worker_id)) for worker_id in range(self.workers)]
+        try:
+            await self.http.start()
+            print(f"Маршрутизатор слушает порт {self.http.port}, обработчиков: {self.workers}")
+            await stop_event.wait()
+        finally:
+            self.stopping = True
+            await self.http.stop()
+            for process in self.processes.values():
+                if process.returncode is None:
+                    process.terminate()
+            await asyncio.gather(*supervisors, return_exceptions=True)
+            await self.client.aclose()
+
+
+async def run_router():
+    """Запускает маршрутизатор с процессами-обработчиками по настройкам config"""
+    check_webhook_settings()
+    router = WorkerRouter(
+        config.BOT_WORKERS, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, config.WEBHOOK_PATH,
+        config.WEBHOOK_SECRET, config.WORKER_BASE_PORT
+    )
+    await router.run()
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import math
+import heapq
+
+from shared_state import SqliteConnections
+
+TOKEN_RE = re.compile(r'\w+')
+# Верхняя граница диапазона токенов, начинающихся с данного префикса
+PREFIX_END = "\U0010ffff"
+
+
+def tokenize(text):
+    """Разбивает текст на токены в нижнем регистре"""
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+def title_tokens(label):
+    """Токены названия документа - последней части метки раздел/подраздел"""
+    return tokenize(label.rsplit('/', 1)[-1].replace('_', ' '))
+
+
+class SearchIndex:
+    """Инвертированный индекс в SQLite: токен -> документ -> номера строк.
+
+    Для каждого документа хранятся смещения строк в байтах, поэтому
+    строки-сниппеты читаются через seek без чтения всего файла. Документ
+    добавляется и удаляется одной транзакцией только по своим строкам
+    (postings проиндексированы и по doc_id), файл индекса общий для всех
+    процессов бота. Результаты ранжируются по BM25 с надбавкой за
+    совпадение с названием документа.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS docs (
+            doc_id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            label TEXT NOT NULL,
+            mtime REAL,
+            size INTEGER,
+            length INTEGER NOT NULL,
+            offsets TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_docs_length ON docs (length);
+        CREATE TABLE IF NOT EXISTS postings (
+            token TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            lines TEXT NOT NULL,
+            PRIMARY KEY (token, doc_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+        CREATE TABLE IF NOT EXISTS titles (
+            token TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            PRIMARY KEY (token, doc_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_titles_doc ON titles (doc_id);
+    """
+
+    # Параметры BM25
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    # Вес совпадения слова запроса с названием документа (в долях idf)
+    TITLE_BOOST = 2.0
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.connections = SqliteConnections(index_file, self.SCHEMA)
+
+    def get_document(self, doc_id):
+        """Возвращает {"path", "label", "mtime", "size", "length"} документа или None"""
+        row = self.connections.get().execute(
+            "SELECT path, label, mtime, size, length FROM docs WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("path", "label", "mtime", "size", "length"), row))
+
+    def has_document(self, doc_id):
+        """Проверяет, есть ли документ в индексе"""
+        return self.connections.get().execute(
+            "SELECT 1 FROM docs WHERE doc_id = ?", (doc_id,)
+        ).fetchone() is not None
+
+    def documents(self):
+        """Возвращает [(doc_id, путь, метка)] всех документов"""
+        return self.connections.get().execute("SELECT doc_id, path, label FROM docs").fetchall()
+
+    def document_count(self):
+        return self.connections.get().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def is_fresh(self, doc_id, path):
+        """Проверяет, что документ проиндексирован и файл с тех пор не менялся"""
+        doc = self.get_document(doc_id)
+        if not doc or doc["path"] != path:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return doc["mtime"] == stat.st_mtime and doc["size"] == stat.st_size
+
+    def add_document(self, doc_id, path, label):
+        """Индексирует (или переиндексирует) текстовый файл"""
+        try:
+            stat = os.stat(path)
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return False
+
+        offsets = []
+        postings = {}
+        position = 0
+        length = 0
+        for line_no, raw_line in enumerate(raw.split(b'\n')):
+            offsets.append(position)
+            position += len(raw_line) + 1
+            line = raw_line.decode('utf-8', errors='replace')
+            for token in tokenize(line):
+                postings.setdefault(token, []).append(line_no)
+                length += 1
+
+        with self.connections.get() as conn:
+            self._remove(conn, doc_id)
+            conn.execute(
+                "INSERT INTO docs (doc_id, path, label, mtime, size, length, offsets) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, path, label, stat.st_mtime, stat.st_size, length, json.dumps(offsets))
+            )
+            conn.executemany(
+                "INSERT INTO postings (token, doc_id, lines) VALUES (?, ?, ?)",
+                ((token, doc_id, json.dumps(lines)) for token, lines in postings.items())
+            )
+            conn.executemany(
+                "INSERT INTO titles (token, doc_id) VALUES (?, ?)",
+                ((token, doc_id) for token in set(title_tokens(label)))
+            )
+        return True
+
+    def remove_document(self, doc_id):
+        """Удаляет документ из индекса"""
+        with self.connections.get() as conn:
+            self._remove(conn, doc_id)
+
+    def _remove(self, conn, doc_id):
+        conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        conn.execute("DELETE FROM titles WHERE doc_id = ?", (doc_id,))
+        conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+
+    def _idf(self, total, doc_count):
+        """Обратная частота документа по BM25"""
+        return math.log(1 + (total - doc_count + 0.5) / (doc_count + 0.5))
+
+    def _score(self, conn, query):
+        """Возвращает ({doc_id: оценка BM25}, {doc_id: строки с совпадениями})"""
+        scores = {}
+        matched_lines = {}
+        total, total_length = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+        if not total:
+            return scores, matched_lines
+        average_length = max(total_length / total, 1)
+
+        for query_token in set(tokenize(query)):
+            # Слово запроса совпадает со всеми токенами, которые с него начинаются
+            bounds = (query_token, query_token + PREFIX_END)
+            # Частота слова запроса в документе - сумма частот всех его продолжений
+            frequencies = {}
+            lengths = {}
+            rows = conn.execute(
+                "SELECT p.doc_id, p.lines, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id "
+                "WHERE p.token >= ? AND p.token < ?", bounds
+            )
+            for doc_id, lines, length in rows:
+                lines = json.loads(lines)
+                frequencies[doc_id] = frequencies.get(doc_id, 0) + len(lines)
+                lengths[doc_id] = length
+                matched_lines.setdefault(doc_id, set()).update(lines)
+            titled = {row[0] for row in conn.execute(
+                "SELECT DISTINCT doc_id FROM titles WHERE token >= ? AND token < ?", bounds
+            )}
+
+            idf = self._idf(total, len(frequencies.keys() | titled))
+            for doc_id, frequency in frequencies.items():
+                length_norm = 1 - self.BM25_B + self.BM25_B * lengths[doc_id] / average_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.BM25_K1 + 1) / (
+                    frequency + self.BM25_K1 * length_norm)
+            for doc_id in titled:
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * self.TITLE_BOOST
+        return scores, matched_lines
+
+    def ranked(self, query, limit):
+        """Возвращает limit лучших результатов [(doc_id, оценка, номера строк)] по убыванию оценки.
+
+        Лучшие документы выбираются через кучу без полной сортировки.
+        """
+        conn = self.connections.get()
+        # Оценки считаются по одному снимку индекса, даже если его меняет другой процесс
+        with conn:
+            conn.execute("BEGIN")
+            scores, matched_lines = self._score(conn, query)
+        best = heapq.nsmallest(limit, ((-score, doc_id) for doc_id, score in scores.items()))
+        return [
+            (doc_id, -negative_score, matched_lines.get(doc_id, set()))
+            for negative_score, doc_id in best
+        ]
+
+    def read_lines(self, doc_id, line_numbers, limit=None):
+        """Читает указанные строки документа по сохраненным смещениям"""
+        row = self.connections.get().execute(
+            "SELECT path, offsets FROM docs WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            return []
+        path, offsets = row[0], json.loads(row[1])
+        lines = []
+        try:
+            with open(path, 'rb') as f:
+                for line_no in sorted(line_numbers)[:limit]:
+                    f.seek(offsets[line_no])
+                    line = f.readline().decode('utf-8', errors='replace').rstrip('\r\n')
+                    lines.append(line)
+        except (OSError, IndexError):
+            pass
+        return lines
@@ -0,0 +1,236 @@
+import pickle
+import asyncio
+import sqlite3
+import threading
+import functools
+
+try:
+    import fcntl
+except ImportError:
+    # Без fcntl (Windows) блокировка действует только между потоками процесса
+    fcntl = None
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+class SqliteConnections:
+    """Соединения с файлом SQLite, по одному на поток, в режиме WAL"""
+
+    def __init__(self, db_file, schema):
+        self.db_file = db_file
+        self._local = threading.local()
+        with self.get() as conn:
+            conn.executescript(schema)
+
+    def get(self):
+        """Возвращает соединение текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class FileLock:
+    """Реентерабельная блокировка между потоками процесса и между процессами бота.
+
+    Потоки процесса сериализуются RLock, процессы - flock на файле блокировки.
+    Файловая блокировка берется при первом входе потока и снимается при
+    последнем выходе.
+    """
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                if self._file is None:
+                    self._file = open(self.lock_file, 'a')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SharedVersion:
+    """Версия базы знаний, общая для всех процессов бота.
+
+    Процесс, изменивший базу знаний, увеличивает версию; остальные сравнивают
+    ее со своей и перечитывают структуру разделов при расхождении.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shared_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, db_file, key="kb_version"):
+        self.key = key
+        self.connections = SqliteConnections(db_file, self.SCHEMA)
+
+    def get(self):
+        """Текущая общая версия"""
+        row = self.connections.get().execute(
+            "SELECT value FROM shared_meta WHERE key = ?", (self.key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self):
+        """Увеличивает общую версию, возвращает (прежняя версия, новая версия)"""
+        with self.connections.get() as conn:
+            # BEGIN IMMEDIATE - чтение и запись версии атомарны между процессами
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM shared_meta WHERE key = ?", (self.key,)).fetchone()
+            previous = row[0] if row else 0
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_meta (key, value) VALUES (?, ?)", (self.key, previous + 1)
+            )
+        return previous, previous + 1
+
+
+class SqlitePersistence(BasePersistence):
+    """Хранение состояний диалогов и user_data/chat_data/bot_data в SQLite.
+
+    Позволяет нескольким процессам бота работать с общим состоянием и не
+    терять диалоги при перезапуске. Значения сериализуются pickle. Каждый
+    пользователь закреплен за одним процессом, поэтому данные читаются при
+    запуске, а не перед каждым обновлением.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_data (
+            id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS chat_data (
+            id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS bot_data (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            conversation_key BLOB NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY (name, conversation_key)
+        );
+    """
+
+    def __init__(self, db_file, update_interval=1):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.connections = SqliteConnections(db_file, self.SCHEMA)
+
+    async def _run(self, func, *args):
+        """Выполняет запрос к SQLite вне цикла событий"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    def _load_table(self, table):
+        rows = self.connections.get().execute(f"SELECT id, data FROM {table}").fetchall()
+        return {row_id: pickle.loads(data) for row_id, data in rows}
+
+    def _store(self, table, row_id, data):
+        with self.connections.get() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)",
+                (row_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+            )
+
+    def _drop(self, table, row_id):
+        with self.connections.get() as conn:
+            conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+
+    async def get_user_data(self):
+        return await self._run(self._load_table, "user_data")
+
+    async def get_chat_data(self):
+        return await self._run(self._load_table, "chat_data")
+
+    async def get_bot_data(self):
+        return (await self._run(self._load_table, "bot_data")).get(0, {})
+
+    async def get_callback_data(self):
+        return None
+
+    def _load_conversations(self, name):
+        rows = self.connections.get().execute(
+            "SELECT conversation_key, state FROM conversations WHERE name = ?", (name,)
+        ).fetchall()
+        return {pickle.loads(key): pickle.loads(state) for key, state in rows}
+
+    async def get_conversations(self, name):
+        return await self._run(self._load_conversations, name)
+
+    def _store_conversation(self, name, key, new_state):
+        with self.connections.get() as conn:
+            if new_state is None:
+                conn.execute(
+                    "DELETE FROM conversations WHERE name = ? AND conversation_key = ?",
+                    (name, pickle.dumps(key))
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversations (name, conversation_key, state) VALUES (?, ?, ?)",
+                    (name, pickle.dumps(key), pickle.dumps(new_state))
+                )
+
+    async def update_conversation(self, name, key, new_state):
+        await self._run(self._store_conversation, name, key, new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self._run(self._store, "user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._run(self._store, "chat_data", chat_id, data)
+
+    async def update_bot_data(self, data):
+        await self._run(self._store, "bot_data", 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._run(self._drop, "user_data", user_id)
+
+    async def drop_chat_data(self, chat_id):
+        await self._run(self._drop, "chat_data", chat_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
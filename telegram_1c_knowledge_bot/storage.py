@@ -0,0 +1,481 @@
+import os
+import copy
+import json
+import threading
+from abc import ABC, abstractmethod
+
+from shared_state import SqliteConnections
+
+
+def material_kind(material_type):
+    """Возвращает список материалов подраздела ("images" или "files") по типу материала"""
+    return "images" if material_type == "image" else "files"
+
+
+class MaterialsStore(ABC):
+    """Интерфейс хранилища материалов.
+
+    Материалы сгруппированы по ключу подраздела ("раздел/подраздел") и виду
+    ("images" или "files"); каждая запись - словарь с обязательными полями
+    "id" и "path".
+
+    Отдельно от материалов хранятся ожидающие загрузки - файлы, к которым
+    еще не добавили подпись. Они держат ссылку на файл (учитываются в
+    count_path_references), но не принадлежат ни одному подразделу.
+    """
+
+    @abstractmethod
+    def all(self):
+        """Возвращает словарь всех материалов (ключ подраздела -> материалы)"""
+
+    @abstractmethod
+    def save(self, materials):
+        """Полностью заменяет содержимое хранилища"""
+
+    @abstractmethod
+    def get_topic(self, topic_key):
+        """Возвращает материалы подраздела: {"images": [...], "files": [...]}"""
+
+    @abstractmethod
+    def get(self, topic_key, material_id, kind):
+        """Возвращает запись материала или None"""
+
+    @abstractmethod
+    def add(self, topic_key, kind, material):
+        """Добавляет запись материала в конец списка подраздела"""
+
+    @abstractmethod
+    def update(self, topic_key, material_id, kind, changes):
+        """Обновляет поля записи материала, возвращает True при успехе"""
+
+    @abstractmethod
+    def delete(self, topic_key, material_id, kind):
+        """Удаляет запись материала, возвращает удаленную запись или None"""
+
+    @abstractmethod
+    def count_path_references(self, path):
+        """Возвращает число записей материалов и ожидающих загрузок, ссылающихся на файл"""
+
+    @abstractmethod
+    def pending_uploads(self):
+        """Возвращает список ожидающих загрузок"""
+
+    @abstractmethod
+    def get_pending(self, upload_id):
+        """Возвращает запись ожидающей загрузки или None"""
+
+    @abstractmethod
+    def add_pending(self, upload):
+        """Добавляет ожидающую загрузку (словарь с полями "id" и "path")"""
+
+    @abstractmethod
+    def update_pending(self, upload_id, changes):
+        """Обновляет поля ожидающей загрузки, возвращает True при успехе"""
+
+    @abstractmethod
+    def delete_pending(self, upload_id):
+        """Удаляет ожидающую загрузку, возвращает удаленную запись или None"""
+
+
+class JsonMaterialsStore(MaterialsStore):
+    """Хранилище материалов в JSON-файле с кэшем разобранного словаря в памяти.
+
+    Файл перечитывается только при изменении его mtime или размера,
+    поэтому чтение материалов подраздела не требует разбора JSON.
+    Читающие методы возвращают копии записей: кэш меняется только через
+    add/update/delete/save.
+    Ожидающие загрузки лежат в отдельном небольшом файле рядом
+    (materials_pending.json для materials.json).
+    """
+
+    def __init__(self, materials_file):
+        self.materials_file = materials_file
+        self.pending_file = os.path.splitext(materials_file)[0] + "_pending.json"
+        self._materials = {}
+        self._signature = None
+        # Число ссылок на каждый путь, пересчитывается после изменений
+        self._path_refs = None
+        self._lock = threading.RLock()
+
+    def _stat_signature(self):
+        """Возвращает (mtime, size) файла или None, если файла нет"""
+        try:
+            stat = os.stat(self.materials_file)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        """Перечитывает файл, если он изменился с момента последней загрузки"""
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            materials = {}
+            if signature is not None:
+                try:
+                    with open(self.materials_file, 'r', encoding='utf-8') as f:
+                        materials = json.load(f)
+                except (OSError, ValueError):
+                    materials = {}
+            self._materials = materials
+            self._signature = signature
+            self._path_refs = None
+
+    def all(self):
+        self._refresh()
+        return copy.deepcopy(self._materials)
+
+    def get_topic(self, topic_key):
+        self._refresh()
+        return copy.deepcopy(self._materials.get(topic_key, {}))
+
+    def save(self, materials):
+        """Атомарно сохраняет материалы и обновляет кэш"""
+        with self._lock:
+            tmp_path = f"{self.materials_file}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(materials, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.materials_file)
+            except OSError:
+                # Кэш мог разойтись с диском - перечитаем файл при следующем обращении
+                self._signature = None
+                raise
+            # Вызывающий код может продолжить менять свой словарь
+            self._materials = copy.deepcopy(materials)
+            self._signature = self._stat_signature()
+            self._path_refs = None
+
+    def _find(self, topic_key, material_id, kind):
+        """Возвращает запись материала из кэша (не копию) или None"""
+        self._refresh()
+        for material in self._materials.get(topic_key, {}).get(kind, []):
+            if material["id"] == material_id:
+                return material
+        return None
+
+    def get(self, topic_key, material_id, kind):
+        material = self._find(topic_key, material_id, kind)
+        return dict(material) if material is not None else None
+
+    def add(self, topic_key, kind, material):
+        with self._lock:
+            materials = self.all()
+            if topic_key not in materials:
+                materials[topic_key] = {"images": [], "files": []}
+            materials[topic_key][kind].append(dict(material))
+            self.save(materials)
+
+    def update(self, topic_key, material_id, kind, changes):
+        with self._lock:
+            material = self._find(topic_key, material_id, kind)
+            if material is None:
+                return False
+            material.update(changes)
+            self.save(self._materials)
+            return True
+
+    def delete(self, topic_key, material_id, kind):
+        with self._lock:
+            materials = self.all()
+            if topic_key not in materials:
+                return None
+            material_list = materials[topic_key][kind]
+            for i, material in enumerate(material_list):
+                if material["id"] == material_id:
+                    del material_list[i]
+                    # Если раздел пуст, удаляем его
+                    if not materials[topic_key]["images"] and not materials[topic_key]["files"]:
+                        del materials[topic_key]
+                    self.save(materials)
+                    return material
+            return None
+
+    def count_path_references(self, path):
+        with self._lock:
+            self._refresh()
+            if self._path_refs is None:
+                path_refs = {}
+                for topic in self._materials.values():
+                    for kind in ("images", "files"):
+                        for material in topic.get(kind, []):
+                            path_refs[material["path"]] = path_refs.get(material["path"], 0) + 1
+                self._path_refs = path_refs
+            pending_refs = sum(1 for upload in self.pending_uploads() if upload["path"] == path)
+            return self._path_refs.get(path, 0) + pending_refs
+
+    def pending_uploads(self):
+        try:
+            with open(self.pending_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _save_pending(self, uploads):
+        """Атомарно сохраняет список ожидающих загрузок"""
+        tmp_path = f"{self.pending_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(uploads, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.pending_file)
+
+    def get_pending(self, upload_id):
+        for upload in self.pending_uploads():
+            if upload["id"] == upload_id:
+                return upload
+        return None
+
+    def add_pending(self, upload):
+        with self._lock:
+            uploads = self.pending_uploads()
+            uploads.append(upload)
+            self._save_pending(uploads)
+
+    def update_pending(self, upload_id, changes):
+        with self._lock:
+            uploads = self.pending_uploads()
+            for upload in uploads:
+                if upload["id"] == upload_id:
+                    upload.update(changes)
+                    self._save_pending(uploads)
+                    return True
+            return False
+
+    def delete_pending(self, upload_id):
+        with self._lock:
+            uploads = self.pending_uploads()
+            for i, upload in enumerate(uploads):
+                if upload["id"] == upload_id:
+                    del uploads[i]
+                    self._save_pending(uploads)
+                    return upload
+            return None
+
+
+class SqliteMaterialsStore(MaterialsStore):
+    """Хранилище материалов в SQLite в режиме WAL.
+
+    Каждая запись - отдельная строка, поэтому изменение материала стоит
+    O(log N), а читатели не блокируют писателя. Произвольные поля записи
+    хранятся в JSON-колонке data.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS materials (
+            id TEXT PRIMARY KEY,
+            topic_key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_materials_topic ON materials (topic_key, kind, position);
+        CREATE INDEX IF NOT EXISTS idx_materials_path ON materials (path);
+        CREATE TABLE IF NOT EXISTS pending_uploads (
+            id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_pending_uploads_path ON pending_uploads (path);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connections = SqliteConnections(db_file, self.SCHEMA)
+
+    def get_meta(self, key, default=None):
+        """Возвращает значение служебного ключа"""
+        row = self.connections.get().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """Сохраняет значение служебного ключа"""
+        with self.connections.get() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def all(self):
+        materials = {}
+        rows = self.connections.get().execute(
+            "SELECT topic_key, kind, data FROM materials ORDER BY topic_key, kind, position"
+        )
+        for topic_key, kind, data in rows:
+            topic = materials.setdefault(topic_key, {"images": [], "files": []})
+            topic[kind].append(json.loads(data))
+        return materials
+
+    def save(self, materials):
+        with self.connections.get() as conn:
+            conn.execute("DELETE FROM materials")
+            self._insert_all(conn, materials)
+
+    def _insert_all(self, conn, materials):
+        """Вставляет материалы из словаря в формате materials.json"""
+        for topic_key, topic in materials.items():
+            for kind in ("images", "files"):
+                for position, material in enumerate(topic.get(kind, [])):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO materials (id, topic_key, kind, position, path, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (material["id"], topic_key, kind, position, material["path"],
+                         json.dumps(material, ensure_ascii=False))
+                    )
+
+    def get_topic(self, topic_key):
+        rows = self.connections.get().execute(
+            "SELECT kind, data FROM materials WHERE topic_key = ? ORDER BY kind, position",
+            (topic_key,)
+        ).fetchall()
+        if not rows:
+            return {}
+        topic = {"images": [], "files": []}
+        for kind, data in rows:
+            topic[kind].append(json.loads(data))
+        return topic
+
+    def get(self, topic_key, material_id, kind):
+        row = self.connections.get().execute(
+            "SELECT data FROM materials WHERE id = ? AND topic_key = ? AND kind = ?",
+            (material_id, topic_key, kind)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, topic_key, kind, material):
+        with self.connections.get() as conn:
+            row = conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM materials WHERE topic_key = ? AND kind = ?",
+                (topic_key, kind)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO materials (id, topic_key, kind, position, path, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (material["id"], topic_key, kind, row[0], material["path"],
+                 json.dumps(material, ensure_ascii=False))
+            )
+
+    def update(self, topic_key, material_id, kind, changes):
+        with self.connections.get() as conn:
+            row = conn.execute(
+                "SELECT data FROM materials WHERE id = ? AND topic_key = ? AND kind = ?",
+                (material_id, topic_key, kind)
+            ).fetchone()
+            if not row:
+                return False
+            material = json.loads(row[0])
+            material.update(changes)
+            conn.execute(
+                "UPDATE materials SET path = ?, data = ? WHERE id = ?",
+                (material["path"], json.dumps(material, ensure_ascii=False), material_id)
+            )
+            return True
+
+    def delete(self, topic_key, material_id, kind):
+        with self.connections.get() as conn:
+            row = conn.execute(
+                "SELECT data FROM materials WHERE id = ? AND topic_key = ? AND kind = ?",
+                (material_id, topic_key, kind)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute("DELETE FROM materials WHERE id = ?", (material_id,))
+            return json.loads(row[0])
+
+    def count_path_references(self, path):
+        row = self.connections.get().execute(
+            "SELECT (SELECT COUNT(*) FROM materials WHERE path = ?) + "
+            "(SELECT COUNT(*) FROM pending_uploads WHERE path = ?)",
+            (path, path)
+        ).fetchone()
+        return row[0]
+
+    def pending_uploads(self):
+        rows = self.connections.get().execute("SELECT data FROM pending_uploads ORDER BY rowid")
+        return [json.loads(data) for data, in rows]
+
+    def get_pending(self, upload_id):
+        row = self.connections.get().execute("SELECT data FROM pending_uploads WHERE id = ?", (upload_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_pending(self, upload):
+        with self.connections.get() as conn:
+            conn.execute(
+                "INSERT INTO pending_uploads (id, path, data) VALUES (?, ?, ?)",
+                (upload["id"], upload["path"], json.dumps(upload, ensure_ascii=False))
+            )
+
+    def update_pending(self, upload_id, changes):
+        with self.connections.get() as conn:
+            row = conn.execute("SELECT data FROM pending_uploads WHERE id = ?", (upload_id,)).fetchone()
+            if not row:
+                return False
+            upload = json.loads(row[0])
+            upload.update(changes)
+            conn.execute(
+                "UPDATE pending_uploads SET path = ?, data = ? WHERE id = ?",
+                (upload["path"], json.dumps(upload, ensure_ascii=False), upload_id)
+            )
+            return True
+
+    def delete_pending(self, upload_id):
+        with self.connections.get() as conn:
+            row = conn.execute("SELECT data FROM pending_uploads WHERE id = ?", (upload_id,)).fetchone()
+            if not row:
+                return None
+            conn.execute("DELETE FROM pending_uploads WHERE id = ?", (upload_id,))
+            return json.loads(row[0])
+
+    def migrate_from_json(self, materials_file):
+        """Однократно переносит материалы из materials.json"""
+        if self.get_meta("migrated_from_json") or not os.path.exists(materials_file):
+            return False
+        try:
+            with open(materials_file, 'r', encoding='utf-8') as f:
+                materials = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self.connections.get() as conn:
+            self._insert_all(conn, materials)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (materials_file,)
+            )
+        return True
+
+
+# Общие для процесса хранилища, по одному на файл
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_json_store(materials_file):
+    """Возвращает общее для процесса JSON-хранилище для указанного файла"""
+    key = ("json", os.path.abspath(materials_file))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = JsonMaterialsStore(materials_file)
+        return _stores[key]
+
+
+def get_sqlite_store(db_file, materials_file=None):
+    """Возвращает общее для процесса SQLite-хранилище, при первом открытии мигрируя JSON"""
+    key = ("sqlite", os.path.abspath(db_file))
+    with _stores_lock:
+        if key not in _stores:
+            store = SqliteMaterialsStore(db_file)
+            if materials_file:
+                store.migrate_from_json(materials_file)
+            _stores[key] = store
+        return _stores[key]
+
+
+def create_store(backend, materials_file, db_file):
+    """Создает хранилище материалов по названию бэкенда ("json" или "sqlite")"""
+    if backend == "sqlite":
+        return get_sqlite_store(db_file, materials_file)
+    if backend == "json":
+        return get_json_store(materials_file)
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
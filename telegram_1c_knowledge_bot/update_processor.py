@@ -0,0 +1,78 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_chat_key(update):
+    """Ключ упорядочивания обновления: id чата (или пользователя), None - порядок не важен"""
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных чатов с сохранением порядка внутри чата.
+
+    Обновления одного чата обрабатываются строго по очереди (состояния
+    ConversationHandler не перемешиваются), обновления разных чатов -
+    одновременно, но не более workers штук. Ожидающие своей очереди в чате
+    обновления не занимают обработчиков. Если задан profiler
+    (profiling.UpdateProfiler), обработка обновлений идет через него.
+    """
+
+    # Сколько обновлений может ожидать обработки одновременно
+    PENDING_PER_WORKER = 64
+
+    def __init__(self, workers, profiler=None):
+        super().__init__(workers * self.PENDING_PER_WORKER)
+        self.workers = workers
+        self.profiler = profiler
+        self._workers = None
+        # ключ чата -> [блокировка, число обновлений чата в обработке и в очереди]
+        self._chat_locks = {}
+
+    async def initialize(self):
+        self._workers = asyncio.Semaphore(self.workers)
+        if self.profiler is not None:
+            self.profiler.start()
+
+    async def shutdown(self):
+        self._chat_locks.clear()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    async def _process(self, update, coroutine):
+        if self.profiler is not None:
+            await self.profiler.run(update, coroutine)
+        else:
+            await coroutine
+
+    def pending_chats(self):
+        """Число чатов, у которых есть обновления в обработке или в очереди"""
+        return len(self._chat_locks)
+
+    async def do_process_update(self, update, coroutine):
+        key = update_chat_key(update)
+        if key is None:
+            async with self._workers:
+                await self._process(update, coroutine)
+            return
+
+        # До захвата блокировки нет точек переключения, поэтому обновления
+        # встают в очередь чата (FIFO) в порядке поступления
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await self._process(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
@@ -0,0 +1,69 @@
+import httpx
+
+import config
+import metrics
+from async_kb import akb
+
+
+# Общий клиент для скачивания файлов: соединения с сервером файлов переиспользуются
+_client = None
+
+
+def download_client():
+    """Возвращает общий HTTP-клиент скачивания, создавая его при первом обращении"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=120.0), proxies=config.PROXY_URL)
+    return _client
+
+
+async def close_download_client():
+    """Закрывает общий HTTP-клиент скачивания при остановке бота"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _iter_remote_chunks(url, chunk_size):
+    """Читает файл с серверов Telegram фрагментами, не держа его целиком в памяти"""
+    async with download_client().stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(chunk_size):
+            yield chunk
+
+
+async def _iter_local_chunks(path, chunk_size):
+    """Читает файл локального Bot API сервера фрагментами в пуле потоков"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = await akb.run(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def stream_upload(telegram_file, filename, file_type="image", chunk_size=None):
+    """Потоково сохраняет файл Telegram в хранилище базы знаний.
+
+    Пиковое потребление памяти ограничено размером фрагмента. Возвращает
+    записанный UploadWriter (путь, sha256, размер файла и id ожидающей
+    загрузки, которая держит файл до создания материала).
+    """
+    chunk_size = chunk_size or config.UPLOAD_CHUNK_SIZE
+    file_path = telegram_file.file_path
+    if file_path.startswith(("http://", "https://")):
+        chunks = _iter_remote_chunks(file_path, chunk_size)
+    else:
+        chunks = _iter_local_chunks(file_path, chunk_size)
+
+    writer = await akb.open_upload(filename, file_type)
+    try:
+        async for chunk in chunks:
+            await akb.run(writer.write, chunk)
+        await akb.commit_upload(writer, file_type)
+    except BaseException:
+        await akb.run(writer.abort)
+        raise
+    metrics.upload_bytes.inc(file_type, amount=writer.size)
+    return writer
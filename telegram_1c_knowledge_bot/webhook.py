@@ -0,0 +1,86 @@
+"""Режим webhook: обновления принимает веб-сервер PTB (Application.run_webhook).
+
+PTB сам вызывает setWebhook с WEBHOOK_URL и WEBHOOK_SECRET и отвечает 403
+на запросы без заголовка X-Telegram-Bot-Api-Secret-Token с этим секретом.
+Рядом работает небольшой HTTP-сервер проверки работоспособности (GET
+/healthz на WEBHOOK_HEALTH_PORT).
+
+Для локальной проверки без Telegram (BOT_API_BASE_URL указывает на заглушку,
+принимающую setWebhook) можно отправить записанное обновление:
+
+    curl -X POST http://127.0.0.1:8443/telegram \\
+         -H "Content-Type: application/json" \\
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -d @update.json
+
+    curl http://127.0.0.1:8444/healthz
+"""
+import re
+import hmac
+
+from telegram import Update
+
+import config
+from http_server import HttpServer, json_response
+
+# Заголовок, в котором Telegram передает секрет, заданный в setWebhook
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+# Telegram принимает секрет из 1-256 символов A-Z, a-z, 0-9, _ и -
+SECRET_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+
+def check_webhook_settings():
+    """Проверяет настройки режимов webhook и multi, завершая процесс при ошибке.
+
+    Без секрета webhook принял бы поддельные обновления от кого угодно.
+    """
+    if not config.WEBHOOK_SECRET:
+        raise SystemExit(f"BOT_MODE={config.BOT_MODE}: задай WEBHOOK_SECRET - без него webhook примет чужие обновления")
+    if not SECRET_PATTERN.fullmatch(config.WEBHOOK_SECRET):
+        raise SystemExit("WEBHOOK_SECRET должен состоять из 1-256 символов A-Z, a-z, 0-9, _ и -")
+    if not config.WEBHOOK_URL:
+        raise SystemExit(f"BOT_MODE={config.BOT_MODE}: задай WEBHOOK_URL - внешний адрес бота (https://...)")
+
+
+def secret_matches(header_value, secret):
+    """Сравнивает секрет из заголовка с ожидаемым за постоянное время.
+
+    http_server декодирует заголовки как latin-1, поэтому сравниваются исходные
+    байты: строка с не-ASCII символами не вызывает ошибку в compare_digest.
+    """
+    return hmac.compare_digest(header_value.encode('latin-1'), secret.encode('utf-8'))
+
+
+class HealthServer:
+    """GET /healthz процесса в режиме webhook - для балансировщика, мониторинга и маршрутизатора"""
+
+    def __init__(self, application, listen, port):
+        self.application = application
+        self.http = HttpServer(listen, port)
+        self.http.route("GET", "/healthz", self.handle_health)
+
+    async def handle_health(self, request):
+        return json_response({
+            "status": "ok" if self.application.running else "starting",
+            "pending_updates": self.application.update_queue.qsize(),
+        })
+
+    async def start(self):
+        await self.http.start()
+
+    async def stop(self):
+        await self.http.stop()
+
+
+def run_webhook(application):
+    """Запускает бота в режиме webhook и работает до SIGINT/SIGTERM"""
+    check_webhook_settings()
+    print(f"Webhook слушает {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+    application.run_webhook(
+        listen=config.WEBHOOK_LISTEN,
+        port=config.WEBHOOK_PORT,
+        url_path=config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET,
+        webhook_url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+        allowed_updates=Update.ALL_TYPES,
+    )
@@ -0,0 +1,37 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+# Общий для процесса пул для тяжелых по CPU задач (извлечение текста, обработка изображений)
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Возвращает общий пул процессов, создавая его при первом обращении"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=config.PROCESS_WORKERS)
+        return _process_pool
+
+
+async def run_in_process(func, *args, **kwargs):
+    """Выполняет функцию в пуле процессов, не блокируя цикл событий.
+
+    Функция и аргументы должны сериализоваться pickle (функции уровня модуля).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_process_pool():
+    """Останавливает пул процессов"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
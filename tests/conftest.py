@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Модули бота импортируются так же, как в bot.py - из каталога бота
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "telegram_1c_knowledge_bot"))
+os.environ.setdefault("BOT_TOKEN", "1:test")
+# database.py при импорте открывает базу знаний knowledge_base/ в текущем каталоге -
+# тесты работают во временном каталоге, а не в рабочей базе
+os.chdir(tempfile.mkdtemp(prefix="kb-tests-"))
@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+from async_kb import akb
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def call(handler, text, user_data):
+    message = FakeMessage(text)
+    update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=1),
+                             effective_chat=SimpleNamespace(id=1))
+    context = SimpleNamespace(user_data=user_data, bot_data={}, chat_data={})
+    return asyncio.run(handler(update, context)), message.replies
+
+
+def make_topic(topic, subtopic):
+    akb.kb.add_topic(topic)
+    akb.kb.add_subtopic(topic, subtopic)
+
+
+def test_subtopic_choice_for_material_action_asks_for_material():
+    make_topic("Материалы", "Инструкция")
+    user_data = {'action': 'add_text', 'topic': "Материалы"}
+
+    state, replies = call(bot.handle_subtopic_selection, "Инструкция", user_data)
+
+    assert state == bot.TYPING_TITLE
+    assert replies == ["Введи заголовок материала:"]
+    assert user_data['subtopic'] == "Инструкция"
+
+
+def test_opening_topic_drops_pending_material_action():
+    make_topic("Просмотр", "Статья")
+    user_data = {'action': 'upload_file'}
+
+    call(bot.handle_message, "Просмотр", user_data)
+
+    assert 'action' not in user_data
+    assert user_data['current_topic'] == "Просмотр"
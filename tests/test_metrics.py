@@ -0,0 +1,28 @@
+from metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("op_seconds", "Время операции", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "поиск")
+
+    assert registry.render().split("\n") == [
+        "# HELP op_seconds Время операции",
+        "# TYPE op_seconds histogram",
+        # Граница корзины включается в нее (le - "меньше или равно")
+        'op_seconds_bucket{op="поиск",le="0.1"} 2',
+        'op_seconds_bucket{op="поиск",le="1.0"} 3',
+        'op_seconds_bucket{op="поиск",le="+Inf"} 4',
+        'op_seconds_sum{op="поиск"} 3.65',
+        'op_seconds_count{op="поиск"} 4',
+        "",
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter("errors_total", "Ошибки", ("handler",))
+    counter.inc('a"b\\c\nd')
+
+    assert 'errors_total{handler="a\\"b\\\\c\\nd"} 1' in registry.render().split("\n")
@@ -0,0 +1,53 @@
+import os
+
+from database import KnowledgeBase
+from name_index import SubtopicNameIndex
+
+
+def make_index():
+    name_index = SubtopicNameIndex()
+    for topic, subtopic in [("Документы", "Счет на оплату"), ("Документы", "_description"),
+                            ("Документы", "акт_сверки"), ("Отчеты", "Счет-фактура")]:
+        name_index.add(topic, subtopic)
+    return name_index
+
+
+def test_find_ignores_case_and_spaces():
+    name_index = make_index()
+    assert name_index.find("  счет НА оплату ") == ("Документы", "Счет на оплату")
+    assert name_index.find("акт сверки", topic="Документы") == ("Документы", "акт_сверки")
+    assert name_index.find("акт сверки", topic="Отчеты") is None
+    # Служебный файл описания раздела - не подраздел
+    assert name_index.subtopics("Документы") == ["Счет на оплату", "акт_сверки"]
+
+
+def test_find_partial_and_similar():
+    name_index = make_index()
+    assert name_index.find_partial("счет") == [("Документы", "Счет на оплату"), ("Отчеты", "Счет-фактура")]
+    assert name_index.find_partial("накладная") == []
+    # Опечатка в названии
+    assert name_index.find_similar("акт сверкт")[0] == ("Документы", "акт_сверки")
+
+
+def make_kb(tmp_path):
+    return KnowledgeBase(
+        str(tmp_path / "texts"), str(tmp_path / "images"), str(tmp_path / "files"),
+        str(tmp_path / "materials.json")
+    )
+
+
+def test_name_index_does_not_load_topics(tmp_path):
+    topic_path = tmp_path / "texts" / "Документы"
+    os.makedirs(topic_path)
+    for name in ("_description", "счет_на_оплату", "акт_сверки"):
+        (topic_path / f"{name}.txt").write_text(f"# {name}", encoding='utf-8')
+
+    kb = make_kb(tmp_path)
+    assert kb.find_subtopic("Счет на оплату") == ("Документы", "счет_на_оплату")
+    assert sorted(kb.get_visible_subtopics("Документы")) == ["акт_сверки", "счет_на_оплату"]
+    # Подразделы не загружены и не проиндексированы - названия взяты из манифеста
+    assert kb.topics["Документы"]["subtopics"] is None
+    assert kb.index.document_count() == 0
+
+    # Новый процесс строит индекс названий по сохраненному манифесту
+    assert make_kb(tmp_path).find_subtopic("акт сверки") == ("Документы", "акт_сверки")
@@ -0,0 +1,86 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from outbound import BULK, INTERACTIVE, OutboundScheduler, PriorityTokenBucket
+
+
+def test_bucket_serves_interactive_before_bulk():
+    async def scenario():
+        bucket = PriorityTokenBucket(rate=50, capacity=1)
+        await bucket.acquire()
+        order = []
+
+        async def take(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        await asyncio.gather(take("bulk", BULK), take("interactive", INTERACTIVE))
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
+
+
+def test_bucket_pause_blocks_tokens():
+    async def scenario():
+        bucket = PriorityTokenBucket(rate=1000, capacity=5)
+        bucket.pause(0.2)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await bucket.acquire()
+        return loop.time() - started
+
+    assert asyncio.run(scenario()) >= 0.15
+
+
+def test_retry_after_pauses_only_the_chat():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=100, chat_rate=100, chat_burst=5)
+        await scheduler.initialize()
+        calls = []
+
+        async def flooded():
+            calls.append("flooded")
+            if calls.count("flooded") == 1:
+                raise RetryAfter(0.2)
+            return "flooded"
+
+        async def other():
+            calls.append("other")
+            return "other"
+
+        flooded_task = asyncio.create_task(
+            scheduler.process_request(flooded, (), {}, "sendMessage", {"chat_id": 1}, None)
+        )
+        await asyncio.sleep(0.05)
+        # Другой чат получает ответ, пока первый ждет retry_after
+        assert await asyncio.wait_for(
+            scheduler.process_request(other, (), {}, "sendMessage", {"chat_id": 2}, None), 0.1
+        ) == "other"
+        assert scheduler.global_bucket.paused_until == 0.0
+        assert await flooded_task == "flooded"
+        return calls, scheduler.retries
+
+    calls, retries = asyncio.run(scenario())
+    assert calls == ["flooded", "other", "flooded"]
+    assert retries == 1
+
+
+def test_retry_after_without_chat_pauses_global_bucket():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=100)
+        await scheduler.initialize()
+        attempts = []
+
+        async def get_file():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return "file"
+
+        result = await scheduler.process_request(get_file, (), {}, "getFile", {"file_id": "x"}, None)
+        return result, scheduler.global_bucket.paused_until
+
+    result, paused_until = asyncio.run(scenario())
+    assert result == "file"
+    assert paused_until > 0
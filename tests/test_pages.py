@@ -0,0 +1,74 @@
+import os
+
+from database import KnowledgeBase
+from pages import ArticlePages, split_pages, text_length
+
+
+def test_short_text_is_one_page():
+    assert split_pages("  Короткая статья\n") == ["Короткая статья"]
+    assert split_pages(" \n ") == []
+
+
+def test_pages_break_on_paragraphs():
+    paragraphs = [f"Абзац {number} " + " ".join(["слово"] * 10) for number in range(10)]
+    pages = split_pages("\n\n".join(paragraphs), limit=200)
+
+    assert len(pages) > 1
+    assert all(text_length(page) <= 200 for page in pages)
+    # Абзацы не разрезаются и не теряются
+    assert [p for page in pages for p in page.split("\n\n")] == paragraphs
+
+
+def test_long_paragraph_breaks_on_lines_then_words():
+    lines = ["строка " * 5 for _ in range(6)]
+    pages = split_pages("\n".join(lines) + " " + "оченьдлинноеслово" * 10, limit=60)
+
+    assert all(text_length(page) <= 60 for page in pages)
+    assert "".join(pages).replace("\n", "").replace(" ", "") == \
+        ("\n".join(lines) + "оченьдлинноеслово" * 10).replace("\n", "").replace(" ", "")
+
+
+def test_limit_counts_utf16_units():
+    # Эмодзи - две единицы UTF-16: 30 эмодзи не помещаются на страницу из 40
+    pages = split_pages("😀" * 30, limit=40)
+
+    assert [len(page) for page in pages] == [20, 10]
+    assert all(text_length(page) <= 40 for page in pages)
+
+
+def test_article_pages_are_rebuilt_when_file_changes(tmp_path):
+    article = tmp_path / "статья.txt"
+    article.write_text("первая версия", encoding='utf-8')
+    pages = ArticlePages(str(tmp_path / "pages"), limit=100)
+
+    article_id = pages.article_id(str(article))
+    assert pages.pages_for(str(article))["pages"] == ["первая версия"]
+    assert ArticlePages(str(tmp_path / "pages")).get(article_id)["pages"] == ["первая версия"]
+
+    article.write_text("вторая, более длинная версия", encoding='utf-8')
+    os.utime(article, ns=(0, 10 ** 9))
+    assert pages.pages_for(str(article))["pages"] == ["вторая, более длинная версия"]
+
+
+def test_long_word_is_cut_by_utf16_length():
+    text = ("а" * 3 + "😀") * 50000
+    pages = split_pages(text, limit=4000)
+
+    assert "".join(pages) == text
+    assert all(text_length(page) <= 4000 for page in pages)
+    assert all(text_length(page) >= 3999 for page in pages[:-1])
+
+
+def test_empty_article_has_placeholder_page(tmp_path):
+    topic_path = tmp_path / "texts" / "Раздел"
+    os.makedirs(topic_path)
+    (topic_path / "Пустой.txt").write_text(" \n", encoding='utf-8')
+    kb = KnowledgeBase(
+        str(tmp_path / "texts"), str(tmp_path / "images"), str(tmp_path / "files"),
+        str(tmp_path / "materials.json")
+    )
+
+    content = kb.get_content("Раздел", "Пустой")
+    assert content["text"] == kb.EMPTY_ARTICLE_TEXT
+    assert content["page_count"] == 1
+    assert kb.get_article_page(content["article_id"], 1) == (kb.EMPTY_ARTICLE_TEXT, 1)
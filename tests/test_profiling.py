@@ -0,0 +1,34 @@
+import time
+
+from profiling import StackSampler
+
+
+def busy(seconds):
+    finish = time.perf_counter() + seconds
+    while time.perf_counter() < finish:
+        pass
+
+
+def test_sampler_waits_for_long_updates():
+    sampler = StackSampler(interval=0.005, delay=0.1)
+    sampler.start()
+    try:
+        token = sampler.begin()
+        busy(0.05)
+        sampler.end(token)
+        time.sleep(0.05)
+        # Быстрое обновление не включает сэмплирование
+        assert not sampler.samples
+
+        token = sampler.begin()
+        started = time.perf_counter()
+        busy(0.3)
+        sampler.end(token)
+        finished = time.perf_counter()
+    finally:
+        sampler.stop()
+        sampler.join(1)
+
+    assert sampler.samples
+    assert all(timestamp >= started + 0.1 for timestamp, _ in sampler.samples)
+    assert any("busy" in line for line in sampler.collapsed(started, finished))
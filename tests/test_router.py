@@ -0,0 +1,21 @@
+from router import routing_key, worker_for
+
+
+def test_routing_key_prefers_user():
+    message = {"update_id": 7, "message": {"from": {"id": 42}, "chat": {"id": -100}}}
+    callback = {"update_id": 8, "callback_query": {"from": {"id": 42}, "message": {"chat": {"id": -100}}}}
+    assert routing_key(message) == 42
+    assert routing_key(callback) == 42
+
+
+def test_routing_key_falls_back_to_chat_and_update_id():
+    assert routing_key({"update_id": 9, "channel_post": {"chat": {"id": -100}}}) == -100
+    assert routing_key({"update_id": 10, "poll": {"id": "p"}}) == 10
+
+
+def test_worker_for_is_stable_and_in_range():
+    workers = [worker_for(user_id, 4) for user_id in range(1000)]
+    assert all(0 <= worker < 4 for worker in workers)
+    assert set(workers) == {0, 1, 2, 3}
+    assert worker_for(42, 4) == worker_for(42, 4)
+    assert worker_for(42, 1) == 0
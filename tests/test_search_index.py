@@ -0,0 +1,84 @@
+import pytest
+
+from search_index import SearchIndex, tokenize
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / "index.sqlite3"))
+
+
+def test_tokenize_skips_single_letters():
+    assert tokenize("Документ в 1С, ЭДО!") == ["документ", "1с", "эдо"]
+
+
+def test_add_and_rank(index, tmp_path):
+    invoices = write(tmp_path / "invoices.txt", "Счета\nСчет на оплату\nСчет-фактура и счет")
+    acts = write(tmp_path / "acts.txt", "Акты\nАкт сверки со счетом")
+    index.add_document(invoices, invoices, "Документы/счета")
+    index.add_document(acts, acts, "Документы/акты")
+
+    ranked = index.ranked("счет", 10)
+    assert [doc_id for doc_id, _, _ in ranked] == [invoices, acts]
+    # Слово запроса совпадает с токенами, которые с него начинаются
+    assert ranked[1][2] == {1}
+    assert index.read_lines(invoices, ranked[0][2], 2) == ["Счета", "Счет на оплату"]
+
+
+def test_title_match_is_boosted(index, tmp_path):
+    body = write(tmp_path / "body.txt", "подписание подписание подписание")
+    titled = write(tmp_path / "titled.txt", "текст без совпадений")
+    index.add_document(body, body, "Раздел/прочее")
+    index.add_document(titled, titled, "Раздел/подписание_документов")
+    assert index.ranked("подписание", 1)[0][0] == titled
+
+
+def test_remove_document(index, tmp_path):
+    path = write(tmp_path / "doc.txt", "уникальное слово")
+    index.add_document(path, path, "Раздел/документ")
+    index.remove_document(path)
+
+    assert not index.has_document(path)
+    assert index.ranked("уникальное", 10) == []
+    assert index.ranked("документ", 10) == []
+    conn = index.connections.get()
+    assert conn.execute("SELECT COUNT(*) FROM postings").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM titles").fetchone()[0] == 0
+
+
+def test_reindex_replaces_old_postings(index, tmp_path):
+    path = write(tmp_path / "doc.txt", "старое содержание")
+    index.add_document(path, path, "Раздел/документ")
+    write(path, "новое содержание")
+    assert not index.is_fresh(path, path)
+    index.add_document(path, path, "Раздел/документ")
+
+    assert index.is_fresh(path, path)
+    assert index.ranked("старое", 10) == []
+    assert [doc_id for doc_id, _, _ in index.ranked("новое", 10)] == [path]
+
+
+def test_ranked_limit(index, tmp_path):
+    for number in range(7):
+        path = write(tmp_path / f"doc{number}.txt", "ключ " * (number + 1))
+        index.add_document(path, path, f"Раздел/документ {number}")
+
+    ranked = index.ranked("ключ", 3)
+    assert len(ranked) == 3
+    scores = [score for _, score, _ in index.ranked("ключ", 10)]
+    assert scores == sorted(scores, reverse=True)
+    assert ranked == index.ranked("ключ", 10)[:3]
+
+
+def test_index_file_is_shared_between_instances(index, tmp_path):
+    path = write(tmp_path / "doc.txt", "общий индекс")
+    index.add_document(path, path, "Раздел/документ")
+    other = SearchIndex(index.index_file)
+    assert other.document_count() == 1
+    assert [doc_id for doc_id, _, _ in other.ranked("общий", 10)] == [path]
@@ -0,0 +1,74 @@
+import os
+
+from database import KnowledgeBase
+
+
+def make_kb(tmp_path, documents):
+    topic_path = tmp_path / "texts" / "Раздел"
+    os.makedirs(topic_path)
+    for number in range(documents):
+        (topic_path / f"документ_{number}.txt").write_text("ключ " * (number + 1), encoding='utf-8')
+    return KnowledgeBase(
+        str(tmp_path / "texts"), str(tmp_path / "images"), str(tmp_path / "files"),
+        str(tmp_path / "materials.json")
+    )
+
+
+def labels(page):
+    return [line for line in page.split("\n") if line.startswith("Найдено в")]
+
+
+def test_pages_follow_snapshot(tmp_path):
+    kb = make_kb(tmp_path, 5)
+    results = kb.search("ключ")
+    assert len(results) == 5
+
+    first, offset = kb.search_page(results, 0, 2)
+    assert offset == 2
+    # Индекс изменился между страницами: новый документ с лучшей оценкой
+    kb.add_subtopic("Раздел", "новый ключ ключ ключ ключ ключ ключ ключ")
+    second, offset = kb.search_page(results, offset, 2)
+    third, offset = kb.search_page(results, offset, 2)
+    assert offset is None
+
+    shown = labels(first) + labels(second) + labels(third)
+    assert len(shown) == len(set(shown)) == 5
+    assert not any("новый" in label for label in shown)
+
+
+def test_removed_documents_are_skipped(tmp_path):
+    kb = make_kb(tmp_path, 3)
+    results = kb.search("ключ")
+    kb.index.remove_document(results[0][0])
+
+    page, offset = kb.search_page(results, 0, 10)
+    assert len(labels(page)) == 2
+    assert offset is None
+    assert kb.search_page(results[:1], 0, 10) == (None, None)
+
+
+def test_edited_file_gives_fresh_snippets(tmp_path):
+    kb = make_kb(tmp_path, 1)
+    path = tmp_path / "texts" / "Раздел" / "документ_0.txt"
+    path.write_text("первая строка\nключ в середине\n", encoding='utf-8')
+    kb.search("ключ")
+
+    # Файл отредактировали на диске сразу после поиска
+    path.write_text("вставка в начале файла\nещё строка\nисправленный ключ\n", encoding='utf-8')
+    page, _ = kb.search_page(kb.search("ключ"), 0, 10)
+    assert "• исправленный ключ" in page
+    assert "середине" not in page
+
+    path.write_text("ключа больше нет\n", encoding='utf-8')
+    assert kb.search("исправленный") == []
+
+
+def test_file_edited_between_pages(tmp_path):
+    kb = make_kb(tmp_path, 1)
+    results = kb.search("ключ")
+    path = tmp_path / "texts" / "Раздел" / "документ_0.txt"
+    path.write_text("другой текст\nключ\n", encoding='utf-8')
+
+    page, _ = kb.search_page(results, 0, 10)
+    assert "повтори поиск" in page
+    assert kb.index.is_fresh(str(path), str(path))
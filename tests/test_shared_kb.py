@@ -0,0 +1,74 @@
+import os
+import time
+import multiprocessing
+
+from database import KnowledgeBase
+from shared_state import FileLock
+
+
+def make_kb(tmp_path):
+    return KnowledgeBase(
+        str(tmp_path / "texts"), str(tmp_path / "images"), str(tmp_path / "files"),
+        str(tmp_path / "materials.json")
+    )
+
+
+def hold_lock(lock_file, ready, seconds):
+    with FileLock(lock_file):
+        ready.set()
+        time.sleep(seconds)
+
+
+def test_file_lock_excludes_other_processes(tmp_path):
+    lock_file = str(tmp_path / "kb.lock")
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    process = context.Process(target=hold_lock, args=(lock_file, ready, 0.5))
+    process.start()
+    try:
+        assert ready.wait(10)
+        started = time.monotonic()
+        lock = FileLock(lock_file)
+        with lock:
+            # Повторный вход того же потока не ждет
+            with lock:
+                waited = time.monotonic() - started
+    finally:
+        process.join(10)
+    assert waited >= 0.3
+
+
+def test_manifest_keeps_other_processes_entries(tmp_path):
+    for topic in ("Первый", "Второй"):
+        os.makedirs(tmp_path / "texts" / topic)
+        (tmp_path / "texts" / topic / "старый.txt").write_text("текст", encoding='utf-8')
+    first = make_kb(tmp_path)
+    second = make_kb(tmp_path)
+    first.get_name_index()
+    second.get_name_index()
+
+    first.add_subtopic("Первый", "новый в первом")
+    second.add_subtopic("Второй", "новый во втором")
+
+    # Каждый процесс сохранил только свой раздел - изменения другого не потеряны
+    topics = make_kb(tmp_path).load_manifest()["topics"]
+    assert "новый_в_первом.txt" in topics["Первый"]["files"]
+    assert "новый_во_втором.txt" in topics["Второй"]["files"]
+
+
+def test_sync_index_keeps_and_prunes_attachment_text(tmp_path):
+    kb = make_kb(tmp_path)
+    text_path = tmp_path / "extracted.txt"
+    text_path.write_text("накладная на отгрузку", encoding='utf-8')
+    for caption in ("Накладная", "Счет"):
+        kb.materials_store.add("Раздел/Подраздел", "files",
+                               {"id": caption, "path": str(tmp_path / f"{caption}.pdf"), "caption": caption})
+        kb.index_material_text("Раздел/Подраздел", caption, str(text_path), "file")
+
+    # Другой процесс изменил подпись одного материала и удалил другой
+    kb.materials_store.update("Раздел/Подраздел", "Накладная", "files", {"caption": "Товарная накладная"})
+    kb.materials_store.delete("Раздел/Подраздел", "Счет", "files")
+    kb.sync_index()
+
+    assert kb.index.get_document("material:Накладная")["label"] == "Раздел/Подраздел: Товарная накладная"
+    assert not kb.index.has_document("material:Счет")
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from storage import JsonMaterialsStore, MaterialsStore, SqliteMaterialsStore
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return JsonMaterialsStore(str(tmp_path / "materials.json"))
+    return SqliteMaterialsStore(str(tmp_path / "materials.sqlite3"))
+
+
+def test_incomplete_backend_fails_on_construction():
+    class PartialStore(MaterialsStore):
+        def all(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+def test_add_update_delete(store):
+    store.add("Раздел/Подраздел", "files", {"id": "a", "path": "files/x.pdf"})
+    store.add("Раздел/Подраздел", "files", {"id": "b", "path": "files/x.pdf"})
+
+    assert [m["id"] for m in store.get_topic("Раздел/Подраздел")["files"]] == ["a", "b"]
+    assert store.count_path_references("files/x.pdf") == 2
+
+    assert store.update("Раздел/Подраздел", "a", "files", {"path": "files/y.pdf", "caption": "Инструкция"})
+    assert store.get("Раздел/Подраздел", "a", "files")["caption"] == "Инструкция"
+    assert store.count_path_references("files/x.pdf") == 1
+
+    assert store.delete("Раздел/Подраздел", "b", "files")["id"] == "b"
+    assert store.count_path_references("files/x.pdf") == 0
+    assert store.get("Раздел/Подраздел", "b", "files") is None
+    assert not store.update("Раздел/Подраздел", "b", "files", {"caption": "Нет"})
+
+
+def test_sqlite_migrates_json_once(tmp_path):
+    materials_file = tmp_path / "materials.json"
+    materials_file.write_text(json.dumps({
+        "Раздел/Подраздел": {"images": [{"id": "i", "path": "images/i.jpg"}], "files": []}
+    }), encoding='utf-8')
+    store = SqliteMaterialsStore(str(tmp_path / "materials.sqlite3"))
+
+    assert store.migrate_from_json(str(materials_file))
+    assert store.get("Раздел/Подраздел", "i", "images")["path"] == "images/i.jpg"
+    # Повторная миграция не дублирует записи
+    assert not store.migrate_from_json(str(materials_file))
+    assert len(store.all()["Раздел/Подраздел"]["images"]) == 1
+
+
+def test_pending_uploads_are_kept_apart_from_materials(store):
+    store.add_pending({"id": "u", "path": "files/x.pdf"})
+    store.add("Раздел/Подраздел", "files", {"id": "a", "path": "files/x.pdf"})
+
+    assert list(store.all()) == ["Раздел/Подраздел"]
+    assert store.count_path_references("files/x.pdf") == 2
+    # Полная замена материалов не трогает ожидающие загрузки
+    store.save({})
+    assert [upload["id"] for upload in store.pending_uploads()] == ["u"]
+
+    assert store.update_pending("u", {"path": "files/y.pdf"})
+    assert store.get_pending("u")["path"] == "files/y.pdf"
+    assert store.count_path_references("files/y.pdf") == 1
+    assert store.delete_pending("u")["id"] == "u"
+    assert store.get_pending("u") is None
+    assert store.count_path_references("files/y.pdf") == 0
+
+
+def test_returned_materials_are_copies(store):
+    store.add("Раздел/Подраздел", "images", {"id": "a", "path": "images/a.jpg"})
+
+    store.get("Раздел/Подраздел", "a", "images")["path"] = "images/b.jpg"
+    store.get_topic("Раздел/Подраздел")["images"].clear()
+    store.all()["Раздел/Подраздел"]["images"].append({"id": "b", "path": "images/b.jpg"})
+
+    assert store.all() == {"Раздел/Подраздел": {"images": [{"id": "a", "path": "images/a.jpg"}], "files": []}}
+    assert store.count_path_references("images/a.jpg") == 1
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from database import KnowledgeBase
+
+
+@pytest.fixture
+def kb(tmp_path):
+    return KnowledgeBase(
+        str(tmp_path / "texts"), str(tmp_path / "images"), str(tmp_path / "files"),
+        str(tmp_path / "materials.json")
+    )
+
+
+def upload(kb, data, filename="doc.txt", file_type="file"):
+    writer = kb.open_upload(filename, file_type)
+    writer.write(data)
+    kb.commit_upload(writer, file_type)
+    return writer
+
+
+def test_pending_upload_keeps_shared_file(kb):
+    first = upload(kb, b"same content")
+    material_id = kb.add_material("Раздел/Подраздел", first.file_path, "Первый", "file", upload_id=first.upload_id)
+
+    # Тот же файл загружен еще раз, подпись пока не добавлена
+    second = upload(kb, b"same content")
+    assert second.file_path == first.file_path
+
+    assert kb.delete_material("Раздел/Подраздел", material_id, "file")
+    assert os.path.exists(second.file_path)
+
+    assert kb.add_material("Раздел/Подраздел", second.file_path, "Второй", "file", upload_id=second.upload_id)
+    assert os.path.exists(second.file_path)
+
+
+def test_material_takes_over_upload_reference(kb):
+    writer = upload(kb, b"content")
+    material_id = kb.add_material("Раздел/Подраздел", writer.file_path, "Файл", "file", upload_id=writer.upload_id)
+    assert kb.materials_store.count_path_references(writer.file_path) == 1
+
+    kb.delete_material("Раздел/Подраздел", material_id, "file")
+    assert not os.path.exists(writer.file_path)
+
+
+def test_cancelled_upload_releases_file(kb):
+    writer = upload(kb, b"content")
+    assert kb.release_upload(writer.upload_id)
+    assert not os.path.exists(writer.file_path)
+    # Материал по освобожденной загрузке не создается
+    assert kb.add_material("Раздел/Подраздел", writer.file_path, "Файл", "file", upload_id=writer.upload_id) is None
+
+
+def test_release_keeps_file_used_by_material(kb):
+    used = upload(kb, b"content")
+    kb.add_material("Раздел/Подраздел", used.file_path, "Файл", "file", upload_id=used.upload_id)
+    cancelled = upload(kb, b"content")
+    kb.release_upload(cancelled.upload_id)
+    assert os.path.exists(used.file_path)
+
+
+def test_stale_uploads_are_released(kb):
+    fresh = upload(kb, b"fresh")
+    assert kb.release_stale_uploads() == 0
+    assert kb.release_stale_uploads(max_age=-1) == 1
+    assert not os.path.exists(fresh.file_path)
+
+
+def test_processed_image_moves_upload_reference(kb):
+    writer = upload(kb, b"raw image", "photo.png", "image")
+    image_tmp = kb.image_blobs.temp_path()
+    with open(image_tmp, 'wb') as f:
+        f.write(b"jpeg")
+
+    image_path = kb.store_processed_image(writer.file_path, image_tmp, upload_id=writer.upload_id)
+    assert not os.path.exists(writer.file_path)
+    assert kb.materials_store.count_path_references(image_path) == 1
+
+    kb.release_upload(writer.upload_id)
+    assert not os.path.exists(image_path)
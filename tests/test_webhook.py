@@ -0,0 +1,26 @@
+import pytest
+
+import config
+from webhook import check_webhook_settings, secret_matches
+
+
+def test_secret_matches_compares_bytes():
+    assert secret_matches("s3cret-token", "s3cret-token")
+    assert not secret_matches("", "s3cret-token")
+    # Не-ASCII заголовок (http_server декодирует его как latin-1) - отказ, а не TypeError
+    assert not secret_matches("sécret", "s3cret-token")
+
+
+def test_webhook_requires_secret_and_url(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_URL", "https://bot.example.com")
+    monkeypatch.setattr(config, "WEBHOOK_SECRET", "")
+    with pytest.raises(SystemExit):
+        check_webhook_settings()
+    monkeypatch.setattr(config, "WEBHOOK_SECRET", "не подходит")
+    with pytest.raises(SystemExit):
+        check_webhook_settings()
+    monkeypatch.setattr(config, "WEBHOOK_SECRET", "s3cret-token")
+    check_webhook_settings()
+    monkeypatch.setattr(config, "WEBHOOK_URL", "")
+    with pytest.raises(SystemExit):
+        check_webhook_settings()